@@ -9,3 +9,27 @@ time python -m unittest -v faucet_mininet_test
 
 echo "========== Running faucet config tests =========="
 python test_config.py
+
+echo "========== Running faucet valve tests ==========="
+python test_valve.py
+
+echo "======= Running faucet event queue tests ========"
+python test_eventqueue.py
+
+echo "======== Running faucet async log tests ========="
+python test_asynclog.py
+
+echo "======= Running faucet ofchannel log tests ======"
+python test_ofchannel.py
+
+echo "======== Running faucet profiling tests ========="
+python test_profiling.py
+
+echo "========= Running faucet metrics tests =========="
+python test_metrics.py
+
+echo "=========== Running faucet util tests ==========="
+python test_util.py
+
+echo "========== Running gauge tests =================="
+python test_gauge.py
@@ -24,8 +24,6 @@ class LoadRyuTables(object):
     def _read_json_document(self, filename):
         try:
             python_object_result = 0
-            json_string = (open(filename))
-            python_object_result = json.load(json_string)
             self.ryu_table_translator.set_json_document(filename)
             self.ryu_table_translator.create_ryu_structure()
             python_object_result = self.ryu_table_translator.tables
@@ -104,6 +102,42 @@ class LoadRyuTables(object):
         return instruction_array
 
 
+# Compiled pipelines by filename, see compiled_pipeline().
+_compiled_pipelines = {}
+
+
+def compiled_pipeline(filename, ofproto_parser):
+    """
+    return (ryu_tables, body_bytes) for the pipeline in filename, where body_bytes
+    is ryu_tables serialized as a table features request body.
+    The pipeline is only read, translated and serialized once per process, so
+    switches reconnecting don't each pay for it. ryu_tables must not be modified.
+    """
+    if filename not in _compiled_pipelines:
+        ryu_table_loader = LoadRyuTables()
+        ryu_table_loader.load_tables(filename, ofproto_parser)
+        body_bytes = bytearray()
+        for ryu_table in ryu_table_loader.ryu_tables:
+            body_bytes += ryu_table.serialize()
+        _compiled_pipelines[filename] = (
+            ryu_table_loader.ryu_tables, str(body_bytes))
+    return _compiled_pipelines[filename]
+
+
+class CompiledTableFeaturesStatsRequest(ofproto_v1_3_parser.OFPTableFeaturesStatsRequest):
+    """
+    table features request sending a body already serialized by compiled_pipeline()
+    """
+
+    def __init__(self, datapath, body, body_bytes, flags=0):
+        super(CompiledTableFeaturesStatsRequest, self).__init__(
+            datapath, flags=flags, body=body)
+        self.body_bytes = body_bytes
+
+    def _serialize_stats_body(self):
+        self.buf += self.body_bytes
+
+
 """
 This script allows dynamically create a set of tables. Each table has a set of properties that allows take some actions
 depended of the incoming package. Those properties are defined ine th file "openflow_structure_tables.json", which are based on
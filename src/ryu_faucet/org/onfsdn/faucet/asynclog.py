@@ -0,0 +1,191 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+
+from util import Queue, start_native_thread, threading
+
+
+class RateLimitFilter(logging.Filter):
+    """Pass at most rate records like each other every interval seconds.
+
+    Records are alike if they come from the same logger at the same level
+    with the same format string, so 'learned %u hosts on vlan %u' is limited
+    however many hosts are learned. Suppressed records are counted, and
+    summarized by summaries()."""
+
+    def __init__(self, rate, interval):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.interval = interval
+        self.lock = threading.Lock()
+        # record key -> [start of current interval, records passed in it]
+        self.windows = {}
+        # record key -> [records suppressed, last record suppressed]
+        self.suppressed = {}
+
+    @staticmethod
+    def record_key(record):
+        return (record.name, record.levelno, record.msg)
+
+    def filter(self, record):
+        key = self.record_key(record)
+        with self.lock:
+            window = self.windows.get(key, None)
+            if window is None or record.created - window[0] >= self.interval:
+                self.windows[key] = [record.created, 1]
+                return True
+            if window[1] < self.rate:
+                window[1] += 1
+                return True
+            suppressed = self.suppressed.setdefault(key, [0, None])
+            suppressed[0] += 1
+            suppressed[1] = record
+            return False
+
+    def summaries(self, now):
+        """Return a record summarizing each kind of record suppressed."""
+        with self.lock:
+            suppressed = self.suppressed
+            self.suppressed = {}
+            for key, window in self.windows.items():
+                if now - window[0] >= self.interval:
+                    del self.windows[key]
+        summaries = []
+        for count, record in suppressed.itervalues():
+            summaries.append(logging.makeLogRecord({
+                'name': record.name,
+                'levelno': record.levelno,
+                'levelname': record.levelname,
+                'msg': '%u messages suppressed in %us, the last: %s',
+                'args': (count, self.interval, record.getMessage()),
+            }))
+        return summaries
+
+
+class AsyncLogHandler(logging.Handler):
+    """Write log records with another handler, from a native thread.
+
+    The eventlet hub doesn't wait for the disk to log. Records are queued
+    already formatted, and dropped if the queue is full. With rate_limit,
+    at most rate_limit records like each other are written every
+    summary_interval seconds, and the number suppressed is then logged."""
+
+    def __init__(self, target, queue_size=10000, rate_limit=None,
+                 summary_interval=60):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue.Queue(queue_size)
+        self.summary_interval = summary_interval
+        self.dropped = 0
+        self.dropped_reported = 0
+        self.rate_limiter = None
+        if rate_limit:
+            self.rate_limiter = RateLimitFilter(rate_limit, summary_interval)
+            self.addFilter(self.rate_limiter)
+        self.thread = start_native_thread(self.writer)
+
+    def emit(self, record):
+        # format now, as the arguments may have changed by the time the
+        # record is written.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def write(self, record):
+        if record.levelno >= self.target.level:
+            self.target.handle(record)
+
+    def summarize(self, now):
+        if self.rate_limiter is not None:
+            for record in self.rate_limiter.summaries(now):
+                self.write(record)
+        dropped = self.dropped
+        if dropped != self.dropped_reported:
+            self.write(logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': 'log queue full, %u messages dropped',
+                'args': (dropped - self.dropped_reported,),
+            }))
+            self.dropped_reported = dropped
+
+    def writer(self):
+        next_summary = time.time() + self.summary_interval
+        while True:
+            try:
+                record = self.queue.get(
+                    timeout=max(0, next_summary - time.time()))
+            except Queue.Empty:
+                pass
+            else:
+                if record is None:
+                    # closed.
+                    self.summarize(time.time())
+                    self.queue.task_done()
+                    return
+                try:
+                    self.write(record)
+                finally:
+                    self.queue.task_done()
+            now = time.time()
+            if now >= next_summary:
+                self.summarize(now)
+                next_summary = now + self.summary_interval
+
+    def flush(self):
+        """Wait until all queued records are written."""
+        self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        """Write the records queued, then stop the writer thread."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def parse_log_levels(log_levels):
+    """Parse levels by logger, eg 'valve.learn=INFO,valve.route=WARNING'.
+
+    Returns a dict of level by logger name, or raises ValueError saying
+    which part of log_levels is wrong."""
+    levels = {}
+    for log_level in log_levels.split(','):
+        if not log_level.strip():
+            continue
+        if '=' not in log_level:
+            raise ValueError('%s is not logger=LEVEL' % log_level.strip())
+        name, level_name = log_level.split('=', 1)
+        name = name.strip()
+        level_name = level_name.strip()
+        if not name:
+            raise ValueError('no logger for level %s' % level_name)
+        level = logging.getLevelName(level_name.upper())
+        if not isinstance(level, int):
+            raise ValueError(
+                'unknown log level %s for %s' % (level_name, name))
+        levels[name] = level
+    return levels
@@ -0,0 +1,108 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Layout of the cookies of FAUCET's flows.
+
+Each flow's 64 bit cookie records what the flow belongs to, so all the flows
+of a port or VLAN can be deleted, or requested, with one cookie/mask message
+across all tables rather than a match per table:
+
+    bits 63-32  the datapath's configured cookie, identifying FAUCET
+    bits 31-28  the owner type (OWNER_PORT, OWNER_VLAN, ...), which for
+                flows sending packets to the controller is what the packets
+                are sent for
+    bits 27-16  the VLAN the flow belongs to, if any
+    bits 15-0   the port the flow belongs to, if any
+
+Port numbers too large for the port field are not recorded, so the flows
+of such ports can't be matched by cookie (see port_in_cookie()).
+"""
+
+BASE_SHIFT = 32
+OWNER_SHIFT = 28
+VID_SHIFT = 16
+
+BASE_MASK = 0xffffffff << BASE_SHIFT
+OWNER_MASK = 0xf << OWNER_SHIFT
+VID_MASK = 0xfff << VID_SHIFT
+PORT_MASK = 0xffff
+
+# Owner types.
+OWNER_DEFAULT = 0
+OWNER_PORT = 1
+OWNER_VLAN = 2
+OWNER_ACL = 3
+OWNER_ROUTE = 4
+OWNER_HOST = 5
+OWNER_LEARN = 6
+OWNER_CONTROLLER_ARP = 7
+OWNER_CONTROLLER_ICMP = 8
+OWNER_CONTROLLER_ICMPV6 = 9
+
+OWNER_NAMES = {
+    OWNER_DEFAULT: 'default',
+    OWNER_PORT: 'port',
+    OWNER_VLAN: 'vlan',
+    OWNER_ACL: 'acl',
+    OWNER_ROUTE: 'route',
+    OWNER_HOST: 'host',
+    OWNER_LEARN: 'learn',
+    OWNER_CONTROLLER_ARP: 'controller_arp',
+    OWNER_CONTROLLER_ICMP: 'controller_icmp',
+    OWNER_CONTROLLER_ICMPV6: 'controller_icmpv6',
+}
+
+
+def port_in_cookie(port_num):
+    """Return True if port_num can be recorded in a flow's cookie."""
+    return port_num <= PORT_MASK
+
+
+def flow_cookie(base, owner=OWNER_DEFAULT, vid=0, port_num=0):
+    """Return the cookie for a flow of owner on a VLAN and/or port."""
+    if not port_in_cookie(port_num):
+        port_num = 0
+    return ((base << BASE_SHIFT) | (owner << OWNER_SHIFT) |
+            (vid << VID_SHIFT) | port_num)
+
+
+def owner_cookie(base, owner=None, vid=None, port_num=None):
+    """Return (cookie, cookie_mask) matching the flows of owner, vid and
+    port_num. Fields that are None match any value, so with no fields all
+    FAUCET's flows are matched.
+
+    A port_num too large to be recorded would match the flows of no port,
+    so is refused with ValueError."""
+    cookie_mask = BASE_MASK
+    if owner is not None:
+        cookie_mask |= OWNER_MASK
+    else:
+        owner = OWNER_DEFAULT
+    if vid is not None:
+        cookie_mask |= VID_MASK
+    else:
+        vid = 0
+    if port_num is not None:
+        if not port_in_cookie(port_num):
+            raise ValueError('port %u is not recorded in cookies' % port_num)
+        cookie_mask |= PORT_MASK
+    else:
+        port_num = 0
+    return flow_cookie(base, owner, vid, port_num), cookie_mask
+
+
+def cookie_owner(cookie):
+    """Return the owner type of a flow's cookie."""
+    return (cookie & OWNER_MASK) >> OWNER_SHIFT
+
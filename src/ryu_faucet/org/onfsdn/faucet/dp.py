@@ -68,6 +68,13 @@ class DP(object):
         acls = conf.pop('acls', {})
         dp.__dict__.update(conf)
         dp.set_defaults()
+        if isinstance(dp.cookie, (int, long)) and dp.cookie >= 2**32:
+            # the cookie was once the whole 64 bits of each flow's cookie,
+            # but is now only the upper half, see cookie.py.
+            logger.warning(
+                'cookie %x in %s does not fit in 32 bits, using %x',
+                dp.cookie, config_file, dp.cookie & 0xffffffff)
+            dp.cookie &= 0xffffffff
 
         for vid, vlan_conf in vlans.iteritems():
             dp.add_vlan(vid, vlan_conf)
@@ -96,6 +103,10 @@ class DP(object):
         assert isinstance(self.monitor_flow_table_file, basestring)
         assert isinstance(self.monitor_flow_table_interval, int)
         assert isinstance(self.influxdb_stats, bool)
+        assert isinstance(self.prometheus_stats, bool)
+        # the cookie is the top half of each flow's cookie, see cookie.py.
+        assert 0 <= self.cookie < 2**32
+        assert 18 <= self.packet_in_max_len <= 0xffff
 
     def set_defaults(self):
         # Offset for tables used by faucet
@@ -118,7 +129,8 @@ class DP(object):
         self.__dict__.setdefault('high_priority', self.low_priority + 1)
         self.__dict__.setdefault('highest_priority', self.high_priority + 98)
         # Identification cookie value to allow for multiple controllers to
-        # control the same datapath
+        # control the same datapath (32 bits, the rest identify each flow's
+        # owner)
         self.__dict__.setdefault('cookie', 1524372928)
         # inactive MAC timeout
         self.__dict__.setdefault('timeout', 300)
@@ -142,10 +154,46 @@ class DP(object):
         self.__dict__.setdefault('hardware', 'Open_vSwitch')
         # Whether to use influxdb for stats
         self.__dict__.setdefault('influxdb_stats', False)
+        # Whether to keep the latest stats for Prometheus to scrape from Gauge
+        self.__dict__.setdefault('prometheus_stats', False)
         # ARP and neighbor timeout (seconds)
         self.__dict__.setdefault('arp_neighbor_timeout', 500)
         # OF channel log
         self.__dict__.setdefault('ofchannel_log', None)
+        # On reconnect, reconcile flows with those on the datapath rather
+        # than deleting and reinstalling them all.
+        self.__dict__.setdefault('warm_reconnect', True)
+        # File to periodically save learned hosts and neighbors to, so they
+        # can be restored after a restart.
+        self.__dict__.setdefault('snapshot_file', None)
+        # How often to save learned hosts and neighbors (seconds)
+        self.__dict__.setdefault('snapshot_interval', 60)
+        # Maximum number of flows in each table, by table_id. Learned hosts
+        # are evicted to keep within these. Tables not listed use the
+        # capacity the datapath reports in its table features, if any.
+        self.__dict__.setdefault('table_sizes', {})
+        # Request the datapath's table features when it connects, for the
+        # capacities of tables not in table_sizes (not all datapaths
+        # support table features, and may answer with an error).
+        self.__dict__.setdefault('request_table_features', False)
+        # Maximum number of times a host may move between ports in a minute,
+        # after which it is held on its current port (None for no limit).
+        self.__dict__.setdefault('max_host_moves', None)
+        # Flood using an OpenFlow group per VLAN, rather than listing every
+        # port in each flood flow (requires group support on the datapath).
+        self.__dict__.setdefault('group_table', False)
+        # Take up to this many seconds at random off learned hosts' timeouts,
+        # so hosts learned together don't all expire together.
+        self.__dict__.setdefault('learn_jitter', 0)
+        # How often to check which learned hosts are active (seconds), so
+        # active hosts are relearned before they expire (None to disable).
+        self.__dict__.setdefault('host_refresh_interval', None)
+        # Bytes of each packet sent to the controller to learn its source
+        # (at least the Ethernet and VLAN headers, 18 bytes)
+        self.__dict__.setdefault('packet_in_max_len', 256)
+        # Bytes of packets missing all flows the datapath should send to the
+        # controller (None to leave the datapath's default)
+        self.__dict__.setdefault('miss_send_len', None)
 
     def add_acl(self, acl_num, acl_conf=None):
         if acl_conf is not None:
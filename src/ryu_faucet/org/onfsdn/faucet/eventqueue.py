@@ -0,0 +1,164 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prioritized event queues for a ryu app.
+
+ryu gives each app a single FIFO of events, so a packet-in storm delays
+port status changes, datapath connects and config reloads queued behind it.
+Here events are sorted into classes, each with its own queue, and the
+classes are served by weighted round robin: every class gets a turn, so none
+is starved, but more important classes handle more events per turn.
+
+Every queue is bounded. Control and timer events must not be lost, so as
+with ryu's own event queue, sending one to a full queue waits until there
+is room (holding up the datapath's connection or the timer that sent it).
+Packet-ins are the only events a switch can send faster than they can be
+handled, and can be retried by the switch, so they are dropped instead.
+
+These queues replace RyuApp's, by overriding RyuApp._send_event() and
+RyuApp._event_loop(), which are internal to ryu (and were checked against
+ryu 4.30). ryu_app_supported() checks they still exist, so the app can
+fall back to ryu's own queue if they don't.
+"""
+
+import collections
+
+from ryu.lib import hub
+
+
+CONTROL = 0
+TIMER = 1
+PACKET_IN = 2
+
+# Events handled per turn, by class.
+CLASS_WEIGHTS = {CONTROL: 8, TIMER: 4, PACKET_IN: 2}
+
+CLASS_NAMES = {CONTROL: 'control', TIMER: 'timer', PACKET_IN: 'packet_in'}
+
+# Events queued at most of each class other than packet-ins, as ryu queues.
+EVENT_QUEUE_SIZE = 128
+
+# What to do with an event that arrives when its queue is full.
+DROP_NEWEST = 'newest'
+DROP_OLDEST = 'oldest'
+BLOCK = 'block'
+
+
+def ryu_app_supported(app_class):
+    """Return True if PrioritizedEventQueues can replace app_class' queue."""
+    return (hasattr(app_class, '_send_event') and
+            hasattr(app_class, '_event_loop'))
+
+
+class EventClassQueue(object):
+    """Bounded FIFO of the events of one class."""
+
+    def __init__(self, name, weight, maxlen, drop_policy=DROP_NEWEST):
+        if drop_policy not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+            raise ValueError('unknown drop policy %s' % drop_policy)
+        self.name = name
+        self.weight = weight
+        self.maxlen = maxlen
+        self.drop_policy = drop_policy
+        self.events = collections.deque()
+        self.queued = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.slots = None
+        if drop_policy == BLOCK:
+            self.slots = hub.BoundedSemaphore(maxlen)
+
+    def put(self, item):
+        """Queue item, returning True if the queue grew.
+
+        If the queue is full, wait for room if the drop policy is BLOCK."""
+        if self.slots is not None:
+            self.slots.acquire()
+        elif len(self.events) >= self.maxlen:
+            self.dropped += 1
+            if self.drop_policy == DROP_NEWEST:
+                return False
+            self.events.popleft()
+            self.events.append(item)
+            self.queued += 1
+            return False
+        self.events.append(item)
+        self.queued += 1
+        self.max_depth = max(self.max_depth, len(self.events))
+        return True
+
+    def get(self):
+        item = self.events.popleft()
+        if self.slots is not None:
+            self.slots.release()
+        return item
+
+    def __str__(self):
+        return '%s events: queued %u dropped %u depth %u max depth %u' % (
+            self.name, self.queued, self.dropped, len(self.events),
+            self.max_depth)
+
+
+class PrioritizedEventQueues(object):
+    """Queues of (event, state), served by weighted round robin.
+
+    event_classes maps event classes to CONTROL, TIMER or PACKET_IN; events
+    of other classes are CONTROL. Packet-ins beyond packet_in_maxlen are
+    dropped by drop_policy, other events wait for room."""
+
+    def __init__(self, event_classes, packet_in_maxlen=1024,
+                 drop_policy=DROP_NEWEST, maxlen=EVENT_QUEUE_SIZE):
+        if drop_policy == BLOCK:
+            raise ValueError('packet-ins must be dropped, not waited for')
+        self.event_classes = event_classes
+        self.queues = []
+        for event_class in (CONTROL, TIMER, PACKET_IN):
+            if event_class == PACKET_IN:
+                queue = EventClassQueue(
+                    CLASS_NAMES[event_class], CLASS_WEIGHTS[event_class],
+                    packet_in_maxlen, drop_policy)
+            else:
+                queue = EventClassQueue(
+                    CLASS_NAMES[event_class], CLASS_WEIGHTS[event_class],
+                    maxlen, BLOCK)
+            self.queues.append(queue)
+        # counts events in all queues, so get() can wait for one.
+        self.ready = hub.Semaphore(0)
+        self.turn = CONTROL
+        self.served = 0
+
+    def put(self, ev, state):
+        event_class = self.event_classes.get(ev.__class__, CONTROL)
+        if self.queues[event_class].put((ev, state)):
+            self.ready.release()
+
+    def get(self):
+        """Wait for and return the next (event, state) to handle."""
+        self.ready.acquire()
+        while True:
+            queue = self.queues[self.turn]
+            if queue.events and self.served < queue.weight:
+                self.served += 1
+                return queue.get()
+            self.turn = (self.turn + 1) % len(self.queues)
+            self.served = 0
+
+    def empty(self):
+        for queue in self.queues:
+            if queue.events:
+                return False
+        return True
+
+    def summary(self):
+        return [str(queue) for queue in self.queues]
@@ -15,12 +15,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os, signal, logging
+import os, signal, logging, socket, time
 
 from logging.handlers import TimedRotatingFileHandler
 
 from valve import valve_factory
+from asynclog import AsyncLogHandler, parse_log_levels
 from util import kill_on_exception
+from journal import ValveJournal
+from instrumentation import Instrumentation, instrument_handler
+from metrics import FaucetMetrics, MetricsServer
+from profiling import CPUProfiler, MemoryProfiler
+from eventqueue import PrioritizedEventQueues, ryu_app_supported
+from eventqueue import TIMER, PACKET_IN
 from dp import DP
 
 from ryu.base import app_manager
@@ -31,7 +38,6 @@ from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.controller import event
 from ryu.ofproto import ofproto_v1_3, ether
-from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import vlan
 from ryu.lib import hub
@@ -49,6 +55,22 @@ class EventFaucetHostExpire(event.EventBase):
     pass
 
 
+class EventFaucetProfile(event.EventBase):
+
+    def __init__(self, profile):
+        super(EventFaucetProfile, self).__init__()
+        self.profile = profile
+
+
+# Events not listed here are control events, handled before all others.
+EVENT_CLASSES = {
+    EventFaucetResolveGateways: TIMER,
+    EventFaucetHostExpire: TIMER,
+    ofp_event.EventOFPFlowRemoved: TIMER,
+    ofp_event.EventOFPPacketIn: PACKET_IN,
+}
+
+
 class Faucet(app_manager.RyuApp):
     """A Ryu app that performs layer 2 switching with VLANs.
 
@@ -76,14 +98,53 @@ class Faucet(app_manager.RyuApp):
             'FAUCET_LOG', '/var/log/ryu/faucet/faucet.log')
         self.exc_logfile = os.getenv(
             'FAUCET_EXCEPTION_LOG', '/var/log/ryu/faucet/faucet_exception.log')
+        # Log levels by subsystem, eg valve.learn=INFO,valve.route=WARNING
+        self.log_levels = os.getenv('FAUCET_LOG_LEVELS', '')
+        # Messages like each other logged at most, per summary interval
+        # (0 for no limit), and how often to log the number suppressed
+        self.log_rate_limit = int(os.getenv('FAUCET_LOG_RATE_LIMIT', 100))
+        self.log_summary_interval = int(
+            os.getenv('FAUCET_LOG_SUMMARY_INTERVAL', 60))
+        # Optional journal of all inputs to valve, for offline replay.
+        self.journal_file = os.getenv('FAUCET_JOURNAL', None)
+        # How often to log handler latency and hub lag (0 to disable)
+        self.stats_interval = int(os.getenv('FAUCET_STATS_INTERVAL', 60))
+        # Packet-ins queued at most, and which to drop when that is exceeded
+        self.packet_in_queue_size = int(
+            os.getenv('FAUCET_PACKET_IN_QUEUE', 1024))
+        self.packet_in_drop = os.getenv('FAUCET_PACKET_IN_DROP', 'newest')
+        # Where to write profiles started by SIGUSR1 (CPU) and SIGUSR2
+        # (memory), and for how long to profile (seconds)
+        self.profile_dir = os.getenv(
+            'FAUCET_PROFILE_DIR', os.path.dirname(self.logfile))
+        self.profile_duration = int(os.getenv('FAUCET_PROFILE_DURATION', 30))
+        self.profilers = {'cpu': CPUProfiler(), 'memory': MemoryProfiler()}
+        # Address and port to serve metrics on, for Prometheus (port 0 to
+        # disable)
+        self.prometheus_addr = os.getenv('FAUCET_PROMETHEUS_ADDR', '127.0.0.1')
+        self.prometheus_port = int(os.getenv('FAUCET_PROMETHEUS_PORT', 9302))
+
+        # Events are handled by priority class rather than in arrival order,
+        # if this version of ryu lets us replace its event queue.
+        self.event_queues = None
+        if ryu_app_supported(app_manager.RyuApp):
+            self.event_queues = PrioritizedEventQueues(
+                EVENT_CLASSES, self.packet_in_queue_size, self.packet_in_drop)
 
         # Set the signal handler for reloading config file
         signal.signal(signal.SIGHUP, self.signal_handler)
+        # and for profiling
+        signal.signal(signal.SIGUSR1, self.signal_handler)
+        signal.signal(signal.SIGUSR2, self.signal_handler)
 
         # Create dpset object for querying Ryu's DPSet application
         self.dpset = kwargs['dpset']
 
-        # Setup logging
+        # Flow stats received so far for the current request, by dp_id
+        self.flow_stats = {}
+
+        # Setup logging, written from a separate thread so the hub doesn't
+        # wait for the disk.
         self.logger = logging.getLogger(self.logname)
         logger_handler = TimedRotatingFileHandler(
             self.logfile,
@@ -91,9 +152,20 @@ class Faucet(app_manager.RyuApp):
         log_fmt = '%(asctime)s %(name)-6s %(levelname)-8s %(message)s'
         logger_handler.setFormatter(
             logging.Formatter(log_fmt, '%b %d %H:%M:%S'))
-        self.logger.addHandler(logger_handler)
+        self.logger.addHandler(AsyncLogHandler(
+            logger_handler, rate_limit=self.log_rate_limit,
+            summary_interval=self.log_summary_interval))
         self.logger.propagate = 0
         self.logger.setLevel(logging.DEBUG)
+        try:
+            log_levels = parse_log_levels(self.log_levels)
+        except ValueError:
+            self.logger.exception(
+                'Invalid FAUCET_LOG_LEVELS %s', self.log_levels)
+        else:
+            for subsystem, level in log_levels.iteritems():
+                logging.getLogger(
+                    '.'.join((self.logname, subsystem))).setLevel(level)
 
         # Set up separate logging for exceptions
         exc_logger = logging.getLogger(self.exc_logname)
@@ -104,6 +176,16 @@ class Faucet(app_manager.RyuApp):
         exc_logger.propagate = 1
         exc_logger.setLevel(logging.CRITICAL)
 
+        if self.event_queues is None:
+            self.logger.warning(
+                'this ryu does not support prioritized event queues, '
+                'handling events in arrival order')
+
+        self.journal = None
+        if self.journal_file is not None:
+            self.journal = ValveJournal(self.journal_file)
+            self.journal.config(self.config_file)
+
         dp = self.parse_config(self.config_file, self.logname)
         self.valve = valve_factory(dp)
         if self.valve is None:
@@ -114,16 +196,72 @@ class Faucet(app_manager.RyuApp):
         self.host_expire_request_thread = hub.spawn(
             self.host_expire_request)
 
+        self.instrumentation = Instrumentation()
+        self.instrumentation.start_watchdog()
+        self.metrics = FaucetMetrics()
+        self.metrics_server = None
+        if self.prometheus_port:
+            try:
+                self.metrics_server = MetricsServer(
+                    self.prometheus_addr, self.prometheus_port,
+                    self.render_metrics, self.logname)
+            except socket.error:
+                self.logger.exception(
+                    'Could not serve metrics on %s:%u',
+                    self.prometheus_addr, self.prometheus_port)
+        if self.stats_interval:
+            self.stats_log_thread = hub.spawn(self.stats_log)
+
     def gateway_resolve_request(self):
         while True:
             self.send_event('Faucet', EventFaucetResolveGateways())
             hub.sleep(2)
 
     def host_expire_request(self):
+        # hosts are expired by FlowRemoved, so this only forgets expired
+        # flows, saves snapshots and requests host usage.
         while True:
             self.send_event('Faucet', EventFaucetHostExpire())
             hub.sleep(5)
 
+    def stats_log(self):
+        while True:
+            hub.sleep(self.stats_interval)
+            for line in self.instrumentation.summary():
+                self.logger.info(line)
+            if self.event_queues is not None:
+                for line in self.event_queues.summary():
+                    self.logger.info(line)
+
+    def render_metrics(self):
+        # rendered in a native thread, see metrics.py.
+        return self.metrics.render(
+            self.valve, self.instrumentation, self.event_queues)
+
+    # These override RyuApp internals (as of ryu 4.30), see eventqueue.py.
+    def _send_event(self, ev, state):
+        if self.event_queues is None:
+            return super(Faucet, self)._send_event(ev, state)
+        self.event_queues.put(ev, state)
+
+    def _event_loop(self):
+        # As RyuApp._event_loop, taking events from the prioritized queues.
+        if self.event_queues is None:
+            return super(Faucet, self)._event_loop()
+        while self.is_active or not self.event_queues.empty():
+            ev, state = self.event_queues.get()
+            if ev == self._event_stop:
+                continue
+            for handler in self.get_handlers(ev, state):
+                try:
+                    handler(ev)
+                except hub.TaskExit:
+                    raise
+                except:
+                    self.logger.exception(
+                        'Exception in handler %s for event %s',
+                        handler.__name__, ev.__class__.__name__)
+
     def parse_config(self, config_file, log_name):
         new_dp = DP.parser(config_file, log_name)
         if new_dp:
@@ -135,45 +273,89 @@ class Faucet(app_manager.RyuApp):
         return None
 
     def send_flow_msgs(self, dp, flow_msgs):
-        self.valve.ofchannel_log(flow_msgs)
+        self.instrumentation.sent_ofmsgs(len(flow_msgs))
+        self.metrics.sent(flow_msgs)
         for flow_msg in flow_msgs:
             flow_msg.datapath = dp
             dp.send_msg(flow_msg)
+        # log after sending, so messages are already serialized.
+        self.valve.ofchannel_log(flow_msgs)
 
     def signal_handler(self, sigid, frame):
         if sigid == signal.SIGHUP:
             self.send_event('Faucet', EventFaucetReconfigure())
+        elif sigid == signal.SIGUSR1:
+            self.send_event('Faucet', EventFaucetProfile('cpu'))
+        elif sigid == signal.SIGUSR2:
+            self.send_event('Faucet', EventFaucetProfile('memory'))
+
+    @set_ev_cls(EventFaucetProfile, MAIN_DISPATCHER)
+    def start_profile(self, ev):
+        profiler = self.profilers[ev.profile]
+        if not profiler.start():
+            self.logger.info('%s profile already running', ev.profile)
+            return
+        self.logger.info(
+            'started %s profile for %us', ev.profile, self.profile_duration)
+        hub.spawn(self.stop_profile, ev.profile)
+
+    def stop_profile(self, profile):
+        hub.sleep(self.profile_duration)
+        profiler = self.profilers[profile]
+        elapsed = profiler.stop()
+        try:
+            for profile_file in profiler.write(self.profile_dir, elapsed):
+                self.logger.info(
+                    '%s profile written to %s', profile, profile_file)
+        except IOError:
+            self.logger.exception('Could not write %s profile', profile)
 
     @set_ev_cls(EventFaucetReconfigure, MAIN_DISPATCHER)
+    @instrument_handler
     def reload_config(self, ev):
+        start = time.time()
         new_config_file = os.getenv('FAUCET_CONFIG', self.config_file)
         new_dp = self.parse_config(new_config_file, self.logname)
         if new_dp:
+            if self.journal is not None:
+                self.journal.reload(new_config_file)
             flowmods = self.valve.reload_config(new_dp)
             ryudp = self.dpset.get(new_dp.dp_id)
             self.send_flow_msgs(ryudp, flowmods)
+            self.metrics.reloaded(time.time() - start)
 
     @set_ev_cls(EventFaucetResolveGateways, MAIN_DISPATCHER)
+    @instrument_handler
     def resolve_gateways(self, ev):
         if self.valve is not None:
+            if self.journal is not None:
+                self.journal.resolve_gateways()
             flowmods = self.valve.resolve_gateways()
             if flowmods:
                 ryudp = self.dpset.get(self.valve.dp.dp_id)
                 self.send_flow_msgs(ryudp, flowmods)
 
     @set_ev_cls(EventFaucetHostExpire, MAIN_DISPATCHER)
+    @instrument_handler
     def host_expire(self, ev):
         if self.valve is not None:
-            self.valve.host_expire()
+            if self.journal is not None:
+                self.journal.host_expire()
+            flowmods = self.valve.host_expire()
+            if flowmods:
+                ryudp = self.dpset.get(self.valve.dp.dp_id)
+                self.send_flow_msgs(ryudp, flowmods)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
+    @instrument_handler
     def _packet_in_handler(self, ev):
         msg = ev.msg
         dp = msg.datapath
-        self.valve.ofchannel_log([msg])
+        self.valve.ofchannel_log([msg], received=True)
+        self.metrics.packet_in(self.valve.packet_in_owner(msg.cookie))
 
-        pkt = packet.Packet(msg.data)
+        pkt = self.valve.parse_packet_in(msg.data, msg.cookie)
         eth_pkt = pkt.get_protocols(ethernet.ethernet)[0]
         eth_type = eth_pkt.ethertype
 
@@ -185,14 +367,29 @@ class Faucet(app_manager.RyuApp):
             return
 
         in_port = msg.match['in_port']
-        flowmods = self.valve.rcv_packet(dp.id, in_port, vlan_vid, pkt)
+        if self.journal is not None:
+            self.journal.packet_in(
+                dp.id, in_port, vlan_vid, msg.data, msg.cookie)
+        flowmods = self.valve.rcv_packet(
+            dp.id, in_port, vlan_vid, pkt, msg.cookie)
         self.send_flow_msgs(dp, flowmods)
 
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    @kill_on_exception(exc_logname)
+    @instrument_handler
+    def flow_removed_handler(self, ev):
+        msg = ev.msg
+        dp = msg.datapath
+        self.valve.ofchannel_log([msg], received=True)
+        if self.journal is not None:
+            self.journal.flow_removed(dp.id, str(msg.buf))
+        self.valve.flow_removed(dp.id, msg)
+
     @set_ev_cls(ofp_event.EventOFPErrorMsg, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
     def _error_handler(self, ev):
         msg = ev.msg
-        self.valve.ofchannel_log([msg])
+        self.valve.ofchannel_log([msg], received=True)
         self.logger.error('Got OFError: %s', msg)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -210,6 +407,8 @@ class Faucet(app_manager.RyuApp):
         if not ev.enter:
             # Datapath down message
             self.logger.debug('DP %s disconnected' % str(dp.id))
+            if self.journal is not None:
+                self.journal.disconnect(dp.id)
             self.valve.datapath_disconnect(dp.id)
             return
 
@@ -223,14 +422,50 @@ class Faucet(app_manager.RyuApp):
         self.logger.debug('DP %s reconnected' % str(dp.id))
         self.handler_datapath(dp)
 
+    @instrument_handler
     def handler_datapath(self, dp):
         discovered_ports = [
             p.port_no for p in dp.ports.values() if p.state == 0]
-        flowmods = self.valve.datapath_connect(dp.id, discovered_ports)
+        if self.journal is not None:
+            self.journal.connect(dp.id, discovered_ports)
+        flowmods = self.valve.datapath_reconnect(dp.id, discovered_ports)
+        # flow stats requested before the reconnect won't be answered.
+        self.flow_stats.pop(dp.id, None)
+        self.send_flow_msgs(dp, flowmods)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    @kill_on_exception(exc_logname)
+    def flow_stats_reply_handler(self, ev):
+        msg = ev.msg
+        dp = msg.datapath
+        if self.journal is not None:
+            self.journal.stats_reply(dp.id, str(msg.buf))
+        self.flow_stats.setdefault(dp.id, []).extend(msg.body)
+        if msg.flags & dp.ofproto.OFPMPF_REPLY_MORE:
+            return
+        flow_stats = self.flow_stats.pop(dp.id)
+        flowmods = self.valve.flow_stats_reply(dp.id, flow_stats)
         self.send_flow_msgs(dp, flowmods)
 
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER)
+    @kill_on_exception(exc_logname)
+    def group_desc_reply_handler(self, ev):
+        msg = ev.msg
+        if self.journal is not None:
+            self.journal.stats_reply(msg.datapath.id, str(msg.buf))
+        self.valve.group_desc(msg.datapath.id, msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPTableFeaturesStatsReply, MAIN_DISPATCHER)
+    @kill_on_exception(exc_logname)
+    def table_features_reply_handler(self, ev):
+        msg = ev.msg
+        if self.journal is not None:
+            self.journal.stats_reply(msg.datapath.id, str(msg.buf))
+        self.valve.table_features(msg.datapath.id, msg.body)
+
     @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
     @kill_on_exception(exc_logname)
+    @instrument_handler
     def port_status_handler(self, ev):
         msg = ev.msg
         dp = msg.datapath
@@ -239,18 +474,25 @@ class Faucet(app_manager.RyuApp):
         port_no = msg.desc.port_no
 
         flowmods = []
+        port_add = None
         if reason == ofp.OFPPR_ADD:
-            flowmods = self.valve.port_add(dp.id, port_no)
+            port_add = True
         elif reason == ofp.OFPPR_DELETE:
-            flowmods = self.valve.port_delete(dp.id, port_no)
+            port_add = False
         elif reason == ofp.OFPPR_MODIFY:
             port_down = msg.desc.state & ofp.OFPPS_LINK_DOWN
-            if port_down:
-                flowmods = self.valve.port_delete(dp.id, port_no)
-            else:
-                flowmods = self.valve.port_add(dp.id, port_no)
+            port_add = not port_down
         else:
             self.logger.warning('Unhandled port status %s for port %u',
                                 reason, port_no)
 
+        if port_add is True:
+            if self.journal is not None:
+                self.journal.port_add(dp.id, port_no)
+            flowmods = self.valve.port_add(dp.id, port_no)
+        elif port_add is False:
+            if self.journal is not None:
+                self.journal.port_delete(dp.id, port_no)
+            flowmods = self.valve.port_delete(dp.id, port_no)
+
         self.send_flow_msgs(dp, flowmods)
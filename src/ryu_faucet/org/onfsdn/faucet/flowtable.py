@@ -0,0 +1,419 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import time
+
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+
+# masks that switches may report as an unmasked field.
+EXACT_MASKS = frozenset([
+    'ff:ff:ff:ff:ff:ff',
+    '255.255.255.255',
+    'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff',
+])
+
+# attributes that differ between an object we construct and the same object
+# parsed from a switch (eg. in a flow stats reply).
+UNPARSED_ATTRS = frozenset(['len', 'field'])
+
+
+def match_key(match):
+    """Return a hashable key for an OFPMatch."""
+    fields = []
+    for field, value in match.items():
+        if isinstance(value, tuple) and value[1] in EXACT_MASKS:
+            value = value[0]
+        fields.append((field, value))
+    return tuple(sorted(fields))
+
+
+def attrs_key(obj):
+    return tuple(sorted([
+        (attr, value) for attr, value in vars(obj).iteritems()
+        if attr not in UNPARSED_ATTRS]))
+
+
+def instructions_key(instructions):
+    """Return a hashable key for a list of instructions.
+
+    Much cheaper than comparing str() of the instructions."""
+    inst_keys = []
+    for inst in instructions:
+        if hasattr(inst, 'actions'):
+            inst_keys.append((inst.__class__, inst.type, tuple(
+                [(action.__class__, attrs_key(action))
+                 for action in inst.actions])))
+        else:
+            inst_keys.append((inst.__class__, attrs_key(inst)))
+    return tuple(inst_keys)
+
+
+def buckets_key(buckets):
+    """Return a hashable key for a list of group buckets."""
+    return tuple([
+        (bucket.weight, bucket.watch_port, bucket.watch_group, tuple(
+            [(action.__class__, attrs_key(action))
+             for action in bucket.actions]))
+        for bucket in buckets])
+
+
+def instructions_out_ports(instructions):
+    out_ports = set()
+    for inst in instructions:
+        if hasattr(inst, 'actions'):
+            for action in inst.actions:
+                if isinstance(action, parser.OFPActionOutput):
+                    out_ports.add(action.port)
+    return out_ports
+
+
+class FlowEntry(object):
+    """A flow Valve has installed."""
+
+    # hard timed out flows are considered expired this long after their
+    # timeout, to allow for the delay in the switch installing them.
+    EXPIRY_GRACE = 1
+
+    def __init__(self, flowmod, now):
+        self.priority = flowmod.priority
+        self.cookie = flowmod.cookie
+        self.match = dict(match_key(flowmod.match))
+        self.inst_key = instructions_key(flowmod.instructions)
+        self.out_ports = instructions_out_ports(flowmod.instructions)
+        self.hard_timeout = flowmod.hard_timeout
+        self.idle_timeout = flowmod.idle_timeout
+        self.installed = now
+        self.expiry = None
+        if self.hard_timeout:
+            self.expiry = now + self.hard_timeout + self.EXPIRY_GRACE
+
+    def expired(self, now):
+        return self.expiry is not None and now > self.expiry
+
+    def timed(self):
+        return bool(self.hard_timeout or self.idle_timeout)
+
+    def same_flow(self, flowmod, inst_key):
+        return (self.inst_key == inst_key and
+                self.cookie == flowmod.cookie and
+                self.hard_timeout == flowmod.hard_timeout and
+                self.idle_timeout == flowmod.idle_timeout)
+
+    def cookie_matches(self, cookie, cookie_mask):
+        return self.cookie & cookie_mask == cookie & cookie_mask
+
+    def matched_by(self, del_match, out_port):
+        """Return True if a non-strict delete would remove this flow."""
+        for field, value in del_match:
+            if self.match.get(field, None) != value:
+                return False
+        if out_port != ofp.OFPP_ANY and out_port not in self.out_ports:
+            return False
+        return True
+
+
+class ValveFlowTable(object):
+    """Model of the flows installed on a datapath, indexed by table_id and
+    then by (priority, match), and of the groups installed.
+
+    Batches of ofmsgs are filtered against the model so that adds of flows
+    already installed, duplicate adds within a batch and deletes that would
+    match no installed flows are not sent. Group adds are sent as an add or
+    a modify as needed, only if the group has changed.
+
+    The model can't know when an idle timeout fires, so timed flows are
+    always re-added (refreshing their timeouts on the switch), and hard
+    timed out flows are forgotten after their timeout."""
+
+    # index key for flows by output port, for deletes by out_port.
+    OUT_PORT = '_out_port'
+
+    def __init__(self):
+        self.tables = {}
+        # keys of flows in each table by (field, value) and (OUT_PORT, port),
+        # so non-strict deletes need not scan the whole table.
+        self.indexes = {}
+        # keys of flows in each table by cookie, for cookie/mask deletes.
+        self.cookies = {}
+        # (buckets_key, OFPGroupMod) of each group, by group_id.
+        self.groups = {}
+        # heap of (expiry, table_id, key) of hard timed flows, so expire()
+        # need not scan every flow. Flows removed or replaced since are
+        # skipped when their expiry comes up.
+        self.expiries = []
+
+    def reset(self):
+        self.tables = {}
+        self.indexes = {}
+        self.cookies = {}
+        self.groups = {}
+        self.expiries = []
+
+    def table(self, table_id):
+        return self.tables.setdefault(table_id, {})
+
+    def table_ids(self, table_id):
+        if table_id == ofp.OFPTT_ALL:
+            return self.tables.keys()
+        return [table_id]
+
+    def entries(self, table_id):
+        """Return the number of flows installed in a table."""
+        return len(self.tables.get(table_id, {}))
+
+    def index_keys(self, entry):
+        index_keys = entry.match.items()
+        for out_port in entry.out_ports:
+            index_keys.append((self.OUT_PORT, out_port))
+        return index_keys
+
+    def insert(self, table_id, key, entry):
+        table = self.table(table_id)
+        if key in table:
+            self.remove(table_id, key)
+        table[key] = entry
+        index = self.indexes.setdefault(table_id, {})
+        for index_key in self.index_keys(entry):
+            index.setdefault(index_key, set()).add(key)
+        self.cookies.setdefault(table_id, {}).setdefault(
+            entry.cookie, set()).add(key)
+        if entry.expiry is not None:
+            heapq.heappush(self.expiries, (entry.expiry, table_id, key))
+
+    def remove(self, table_id, key):
+        entry = self.tables[table_id].pop(key)
+        index = self.indexes[table_id]
+        for index_key in self.index_keys(entry):
+            keys = index[index_key]
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+        cookies = self.cookies[table_id]
+        keys = cookies[entry.cookie]
+        keys.discard(key)
+        if not keys:
+            del cookies[entry.cookie]
+        return entry
+
+    def clear(self, table_id):
+        self.tables[table_id] = {}
+        self.indexes[table_id] = {}
+        self.cookies[table_id] = {}
+
+    def candidates(self, table_id, del_match, out_port, cookie, cookie_mask):
+        """Return the keys of flows a non-strict delete could match."""
+        index = self.indexes.get(table_id, {})
+        index_keys = list(del_match)
+        if out_port != ofp.OFPP_ANY:
+            index_keys.append((self.OUT_PORT, out_port))
+        candidates = None
+        if cookie_mask:
+            # there are few distinct cookies, so they can be scanned.
+            candidates = set()
+            for entry_cookie, keys in self.cookies.get(
+                    table_id, {}).iteritems():
+                if entry_cookie & cookie_mask == cookie & cookie_mask:
+                    candidates.update(keys)
+        for index_key in index_keys:
+            keys = index.get(index_key, None)
+            if not keys:
+                return set()
+            if candidates is None or len(keys) < len(candidates):
+                candidates = keys
+        if candidates is None:
+            return set(self.tables.get(table_id, {}))
+        return set(candidates)
+
+    def removed(self, table_id, priority, match, installed_time):
+        """Forget a flow the datapath has removed, unless it has been
+        replaced since the removed flow was installed."""
+        key = (priority, match_key(match))
+        entry = self.tables.get(table_id, {}).get(key, None)
+        if entry is not None:
+            if entry.installed <= installed_time + FlowEntry.EXPIRY_GRACE:
+                self.remove(table_id, key)
+
+    def installed(self, table_id, priority, match, now=None):
+        """Return True if the flow is believed to be on the datapath."""
+        if now is None:
+            now = time.time()
+        entry = self.tables.get(table_id, {}).get(
+            (priority, match_key(match)), None)
+        return entry is not None and not entry.expired(now)
+
+    def forget_missing(self, table_id, present_keys):
+        """Forget timed flows in a table that are not in present_keys (the
+        (priority, match_key) of the flows actually on the datapath)."""
+        for key, entry in self.tables.get(table_id, {}).items():
+            if entry.timed() and key not in present_keys:
+                self.remove(table_id, key)
+
+    def expire(self, now=None):
+        """Forget flows whose hard timeout has passed."""
+        if now is None:
+            now = time.time()
+        while self.expiries and self.expiries[0][0] < now:
+            _, table_id, key = heapq.heappop(self.expiries)
+            entry = self.tables.get(table_id, {}).get(key, None)
+            if entry is not None and entry.expired(now):
+                self.remove(table_id, key)
+
+    def add(self, flowmod, now, last_adds, index, batch_adds):
+        table = self.table(flowmod.table_id)
+        key = (flowmod.priority, match_key(flowmod.match))
+        batch_key = (flowmod.table_id, key)
+        if last_adds.get(batch_key, -1) > index:
+            # the flow is replaced by an add later in this batch.
+            return False
+        inst_key = instructions_key(flowmod.instructions)
+        entry = table.get(key, None)
+        if entry is not None and entry.expired(now):
+            entry = None
+        new_entry = FlowEntry(flowmod, now)
+        if (entry is not None and
+                flowmod.command == ofp.OFPFC_MODIFY_STRICT):
+            # a modify leaves the flow's cookie unchanged.
+            new_entry.cookie = entry.cookie
+        if entry is not None and entry.same_flow(new_entry, inst_key):
+            # a duplicate in this batch, or an untimed flow already installed.
+            if batch_key in batch_adds or not entry.timed():
+                return False
+        if (entry is None and
+                flowmod.command == ofp.OFPFC_MODIFY_STRICT):
+            # modifying a flow that doesn't exist does nothing.
+            return False
+        self.insert(flowmod.table_id, key, new_entry)
+        batch_adds.add(batch_key)
+        return True
+
+    def delete(self, flowmod, now, last_adds, index):
+        del_match = match_key(flowmod.match)
+        strict = flowmod.command == ofp.OFPFC_DELETE_STRICT
+        cookie_mask = flowmod.cookie_mask
+        if (not strict and not del_match and not cookie_mask and
+                flowmod.out_port == ofp.OFPP_ANY):
+            # deleting whole tables is always sent, and resets the model.
+            for table_id in self.table_ids(flowmod.table_id):
+                self.clear(table_id)
+            return True
+        matched = []
+        for table_id in self.table_ids(flowmod.table_id):
+            table = self.table(table_id)
+            if strict:
+                keys = [(flowmod.priority, del_match)]
+            else:
+                keys = self.candidates(
+                    table_id, del_match, flowmod.out_port,
+                    flowmod.cookie, cookie_mask)
+            for key in keys:
+                entry = table.get(key, None)
+                if entry is None:
+                    continue
+                if not entry.cookie_matches(flowmod.cookie, cookie_mask):
+                    continue
+                if strict or entry.matched_by(del_match, flowmod.out_port):
+                    matched.append((table_id, key))
+        live = []
+        for table_id, key in matched:
+            if self.tables[table_id][key].expired(now):
+                self.remove(table_id, key)
+            else:
+                live.append((table_id, key))
+        if not live:
+            # masked fields may match flows our exact comparison can't.
+            return any(
+                isinstance(value, tuple) for _, value in del_match)
+        if all([last_adds.get(live_key, -1) > index for live_key in live]):
+            # every flow deleted would be replaced by an add later in this
+            # batch, so leave them to be replaced (or found unchanged).
+            return False
+        for table_id, key in live:
+            self.remove(table_id, key)
+        return True
+
+    def group_mod(self, group_mod, last_group_adds, batch_groups):
+        group_id = group_mod.group_id
+        if group_mod.command == ofp.OFPGC_DELETE:
+            if group_id == ofp.OFPG_ALL:
+                self.groups = {}
+                batch_groups.clear()
+            else:
+                self.groups.pop(group_id, None)
+                batch_groups.discard(group_id)
+            return group_mod
+        if group_mod.command != ofp.OFPGC_ADD:
+            self.groups[group_id] = (buckets_key(group_mod.buckets), group_mod)
+            return group_mod
+        if group_id in batch_groups:
+            # already sent with its buckets from the last add in this batch.
+            return None
+        batch_groups.add(group_id)
+        # buckets have no dependencies, so the group can have its final
+        # buckets from when it is first needed.
+        group_mod = last_group_adds[group_id]
+        key = buckets_key(group_mod.buckets)
+        current = self.groups.get(group_id, None)
+        if current is not None and current[0] == key:
+            return None
+        command = ofp.OFPGC_ADD
+        if current is not None:
+            command = ofp.OFPGC_MODIFY
+        group_mod = parser.OFPGroupMod(
+            datapath=None,
+            command=command,
+            type_=group_mod.type,
+            group_id=group_id,
+            buckets=group_mod.buckets)
+        self.groups[group_id] = (key, group_mod)
+        return group_mod
+
+    def filter_ofmsgs(self, ofmsgs, now=None):
+        """Return ofmsgs without the flowmods that would not change the
+        datapath, updating the model with the flowmods that remain."""
+        if now is None:
+            now = time.time()
+        # index of the last add of each flow in the batch, as earlier adds of
+        # the same flow would just be replaced.
+        last_adds = {}
+        last_group_adds = {}
+        for i, ofmsg in enumerate(ofmsgs):
+            if isinstance(ofmsg, parser.OFPFlowMod):
+                if ofmsg.command == ofp.OFPFC_ADD:
+                    last_adds[(
+                        ofmsg.table_id,
+                        (ofmsg.priority, match_key(ofmsg.match)))] = i
+            elif isinstance(ofmsg, parser.OFPGroupMod):
+                if ofmsg.command == ofp.OFPGC_ADD:
+                    last_group_adds[ofmsg.group_id] = ofmsg
+        batch_adds = set()
+        batch_groups = set()
+        filtered_ofmsgs = []
+        for i, ofmsg in enumerate(ofmsgs):
+            if isinstance(ofmsg, parser.OFPGroupMod):
+                ofmsg = self.group_mod(ofmsg, last_group_adds, batch_groups)
+                if ofmsg is None:
+                    continue
+            elif isinstance(ofmsg, parser.OFPFlowMod):
+                if ofmsg.command in (ofp.OFPFC_ADD, ofp.OFPFC_MODIFY_STRICT):
+                    if not self.add(ofmsg, now, last_adds, i, batch_adds):
+                        continue
+                elif ofmsg.command in (
+                        ofp.OFPFC_DELETE, ofp.OFPFC_DELETE_STRICT):
+                    if not self.delete(ofmsg, now, last_adds, i):
+                        continue
+            filtered_ofmsgs.append(ofmsg)
+        return filtered_ofmsgs
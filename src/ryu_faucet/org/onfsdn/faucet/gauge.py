@@ -13,13 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import time, os, random, json
+import time, os, random, json, socket
+from functools import partial
 
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
 from dp import DP
-from util import kill_on_exception
+from metrics import MetricsServer, escape_label_value, format_value
+from util import kill_on_exception, threading
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
@@ -29,7 +31,11 @@ from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib import hub
 
-from influxdb import InfluxDBClient
+try:
+    from influxdb import InfluxDBClient
+except ImportError:
+    # only needed with influxdb_stats.
+    InfluxDBClient = None
 
 
 # TODO: configurable
@@ -41,6 +47,8 @@ INFLUXDB_PASS = ""
 
 
 def ship_points_to_influxdb(points):
+    if InfluxDBClient is None:
+        return False
     client = InfluxDBClient(
         host=INFLUXDB_HOST, port=INFLUXDB_PORT,
         username=INFLUXDB_USER, password=INFLUXDB_PASS,
@@ -48,6 +56,127 @@ def ship_points_to_influxdb(points):
     return client.write_points(points=points, time_precision='s')
 
 
+# Metrics kept for Prometheus, in the order they are rendered.
+PROMETHEUS_METRICS = (
+    ('gauge_dp_connected', 'gauge', 'Whether the datapath is connected.'),
+    ('of_port_up', 'gauge', 'Whether the port is up.'),
+    ('of_port_rx_packets', 'counter', 'Packets received on the port.'),
+    ('of_port_tx_packets', 'counter', 'Packets sent on the port.'),
+    ('of_port_rx_bytes', 'counter', 'Bytes received on the port.'),
+    ('of_port_tx_bytes', 'counter', 'Bytes sent on the port.'),
+    ('of_port_rx_dropped', 'counter', 'Packets dropped on receipt.'),
+    ('of_port_tx_dropped', 'counter', 'Packets dropped on sending.'),
+    ('of_port_rx_errors', 'counter', 'Receive errors on the port.'),
+    ('of_flows', 'gauge', 'Flows in each table of the datapath.'),
+)
+
+
+class GaugePrometheusStore(object):
+    """The latest stats of each datapath, for Prometheus to scrape.
+
+    Values are set from the eventlet hub, and rendered by the metrics
+    server in a native thread. Each series' sample line is kept rendered,
+    and only rendered again when its value changes, so unchanged series cost
+    a scrape nothing; label sets are rendered once. The whole rendering is
+    kept until a value changes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # metric name -> dp_id -> series key -> (value, sample line)
+        self.series = {}
+        # (metric name, dp_id) -> the dp's sample lines, or None if changed
+        self.blocks = {}
+        # series key -> rendered labels
+        self.label_sets = {}
+        self.text = None
+
+    def labels(self, key, labels):
+        """Return the rendered labels of key, rendering them the first time.
+
+        labels is a sequence of (name, value), or a function returning one."""
+        label_set = self.label_sets.get(key, None)
+        if label_set is None:
+            if callable(labels):
+                labels = labels()
+            label_set = ','.join([
+                '%s="%s"' % (name, escape_label_value(value))
+                for name, value in labels])
+            self.label_sets[key] = label_set
+        return label_set
+
+    def set(self, name, dp_id, key, labels, value):
+        """Set the value of metric name's series key on dp_id."""
+        with self.lock:
+            dp_series = self.series.setdefault(name, {}).setdefault(dp_id, {})
+            sample = dp_series.get(key, None)
+            if sample is not None and sample[0] == value:
+                return
+            dp_series[key] = (value, '%s{%s} %s\n' % (
+                name, self.labels(key, labels), format_value(value)))
+            self.blocks[(name, dp_id)] = None
+            self.text = None
+
+    def remove(self, dp_id, key=None):
+        """Remove dp_id's series with key, or all of dp_id's series."""
+        with self.lock:
+            for name, dps in self.series.iteritems():
+                dp_series = dps.get(dp_id, None)
+                if not dp_series:
+                    continue
+                if key is None:
+                    dp_series.clear()
+                elif dp_series.pop(key, None) is None:
+                    continue
+                if dp_series:
+                    self.blocks[(name, dp_id)] = None
+                else:
+                    del dps[dp_id]
+                    self.blocks.pop((name, dp_id), None)
+                self.text = None
+            # series keys start with the dp_id.
+            for label_key in self.label_sets.keys():
+                if label_key[0] == dp_id and key in (None, label_key):
+                    del self.label_sets[label_key]
+
+    def set_dp_connected(self, dp, connected):
+        if not connected:
+            # the datapath's stats are stale, so only report it down.
+            self.remove(dp.dp_id)
+        self.set(
+            'gauge_dp_connected', dp.dp_id, (dp.dp_id,), dp_labels(dp),
+            int(connected))
+
+    def render(self):
+        with self.lock:
+            if self.text is None:
+                parts = []
+                for name, metric_type, help_text in PROMETHEUS_METRICS:
+                    dps = self.series.get(name, None)
+                    if not dps:
+                        continue
+                    parts.append('# HELP %s %s\n# TYPE %s %s\n' % (
+                        name, help_text, name, metric_type))
+                    for dp_id in sorted(dps):
+                        block = self.blocks.get((name, dp_id), None)
+                        if block is None:
+                            dp_series = dps[dp_id]
+                            block = ''.join([
+                                dp_series[key][1]
+                                for key in sorted(dp_series)])
+                            self.blocks[(name, dp_id)] = block
+                        parts.append(block)
+                self.text = ''.join(parts)
+            return self.text
+
+
+def dp_labels(dp):
+    return (('dp_id', '0x%x' % dp.dp_id), ('dp_name', dp.name))
+
+
+def port_labels(dp, port_no, port_name):
+    return dp_labels(dp) + (('port', port_no), ('port_name', port_name))
+
+
 class GaugePortStateLogger(object):
 
     def __init__(self, dp, ryudp, logname):
@@ -97,6 +226,38 @@ class GaugePortStateInfluxDBLogger(GaugePortStateLogger):
                 self.logger.warning("error shipping port_state_reason points")
 
 
+class GaugePortStatePrometheusLogger(GaugePortStateLogger):
+
+    def __init__(self, dp, ryudp, logname, store):
+        super(GaugePortStatePrometheusLogger, self).__init__(
+            dp, ryudp, logname)
+        self.store = store
+
+    def set_port_up(self, port_no, up):
+        if port_no in self.dp.ports:
+            port_name = self.dp.ports[port_no].name
+            self.store.set(
+                'of_port_up', self.dp.dp_id, (self.dp.dp_id, port_no),
+                partial(port_labels, self.dp, port_no, port_name), int(up))
+
+    def set_ports(self, ports):
+        """Set the states of the ports reported when the datapath connected."""
+        ofp = self.ryudp.ofproto
+        for port in ports:
+            self.set_port_up(
+                port.port_no, not port.state & ofp.OFPPS_LINK_DOWN)
+
+    def update(self, rcv_time, msg):
+        super(GaugePortStatePrometheusLogger, self).update(rcv_time, msg)
+        ofp = msg.datapath.ofproto
+        port_no = msg.desc.port_no
+        if msg.reason == ofp.OFPPR_DELETE:
+            # the port's state and stats series all have the same key.
+            self.store.remove(self.dp.dp_id, (self.dp.dp_id, port_no))
+            return
+        self.set_port_up(port_no, not msg.desc.state & ofp.OFPPS_LINK_DOWN)
+
+
 class GaugePoller(object):
     """A ryu thread object for sending and receiving openflow stats requests.
 
@@ -285,6 +446,43 @@ class GaugePortStatsInfluxDBPoller(GaugeInfluxDBPoller):
             "port stats request timed out for {0}".format(self.dp.name))
 
 
+class GaugePortStatsPrometheusPoller(GaugePortStatsPoller):
+    """Periodically sends a port stats request to the datapath, keeping the
+    latest stats for Prometheus."""
+    def __init__(self, dp, ryudp, logname, store):
+        super(GaugePortStatsPrometheusPoller, self).__init__(
+            dp, ryudp, logname)
+        self.store = store
+
+    def update(self, rcv_time, msg):
+        self.reply_pending = False
+        ofp = msg.datapath.ofproto
+        dp_id = self.dp.dp_id
+        store = self.store
+        for stat in msg.body:
+            port_no = stat.port_no
+            if port_no == ofp.OFPP_CONTROLLER:
+                port_name = "CONTROLLER"
+            elif port_no == ofp.OFPP_LOCAL:
+                port_name = "LOCAL"
+            elif port_no not in self.dp.ports:
+                self.logger.info("stats for unknown port %s", port_no)
+                continue
+            else:
+                port_name = self.dp.ports[port_no].name
+            key = (dp_id, port_no)
+            labels = partial(port_labels, self.dp, port_no, port_name)
+            for stat_name, stat_value in (
+                ("of_port_rx_packets", stat.rx_packets),
+                ("of_port_tx_packets", stat.tx_packets),
+                ("of_port_rx_bytes", stat.rx_bytes),
+                ("of_port_tx_bytes", stat.tx_bytes),
+                ("of_port_rx_dropped", stat.rx_dropped),
+                ("of_port_tx_dropped", stat.tx_dropped),
+                ("of_port_rx_errors", stat.rx_errors)):
+                store.set(stat_name, dp_id, key, labels, stat_value)
+
+
 class GaugeFlowTablePoller(GaugePoller):
     """Periodically dumps the current datapath flow table as a yaml object.
 
@@ -323,6 +521,36 @@ class GaugeFlowTablePoller(GaugePoller):
             "flow dump request timed out for {0}".format(self.dp.name))
 
 
+class GaugeFlowTablePrometheusPoller(GaugeFlowTablePoller):
+    """Periodically requests the datapath's flows, keeping the number of
+    flows in each table for Prometheus."""
+    def __init__(self, dp, ryudp, logname, store):
+        super(GaugeFlowTablePrometheusPoller, self).__init__(
+            dp, ryudp, logname)
+        self.store = store
+        # flows counted so far in a reply split over several messages
+        self.table_flows = {}
+        self.seen_tables = set()
+
+    def update(self, rcv_time, msg):
+        table_flows = self.table_flows
+        for stat in msg.body:
+            table_flows[stat.table_id] = table_flows.get(stat.table_id, 0) + 1
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+        self.reply_pending = False
+        dp_id = self.dp.dp_id
+        # tables previously seen with flows now have none.
+        for table_id in self.seen_tables:
+            table_flows.setdefault(table_id, 0)
+        for table_id, flows in table_flows.iteritems():
+            self.store.set(
+                'of_flows', dp_id, (dp_id, 'table', table_id),
+                dp_labels(self.dp) + (('table_id', table_id),), flows)
+        self.seen_tables = set(table_flows)
+        self.table_flows = {}
+
+
 class Gauge(app_manager.RyuApp):
     """Ryu app for polling Faucet controlled datapaths for stats/state.
 
@@ -345,6 +573,10 @@ class Gauge(app_manager.RyuApp):
         self.exc_logfile = os.getenv(
             'GAUGE_EXCEPTION_LOG', '/var/log/ryu/faucet/gauge_exception.log')
         self.logfile = os.getenv('GAUGE_LOG', '/var/log/ryu/faucet/gauge.log')
+        # Address and port to serve the stats of datapaths with
+        # prometheus_stats on
+        self.prometheus_addr = os.getenv('GAUGE_PROMETHEUS_ADDR', '127.0.0.1')
+        self.prometheus_port = int(os.getenv('GAUGE_PROMETHEUS_PORT', 9303))
 
         # Setup logging
         self.logger = logging.getLogger(__name__)
@@ -391,6 +623,19 @@ class Gauge(app_manager.RyuApp):
         # dict of async event handlers
         self.handlers = {}
 
+        # latest stats of datapaths with prometheus_stats
+        self.prometheus_store = GaugePrometheusStore()
+        self.metrics_server = None
+        if any([dp.prometheus_stats for dp in self.dps.itervalues()]):
+            try:
+                self.metrics_server = MetricsServer(
+                    self.prometheus_addr, self.prometheus_port,
+                    self.prometheus_store.render, self.logname)
+            except socket.error:
+                self.logger.exception(
+                    'Could not serve stats on %s:%u',
+                    self.prometheus_addr, self.prometheus_port)
+
     @set_ev_cls(dpset.EventDP, dpset.DPSET_EV_DISPATCHER)
     @kill_on_exception(exc_logname)
     def handler_connect_or_disconnect(self, ev):
@@ -411,6 +656,8 @@ class Gauge(app_manager.RyuApp):
                 del self.pollers[dp.dp_id]
             self.logger.info("datapath down %x", dp.dp_id)
             dp.running = False
+            if dp.prometheus_stats:
+                self.prometheus_store.set_dp_connected(dp, False)
 
     @set_ev_cls(dpset.EventDPReconnected, dpset.DPSET_EV_DISPATCHER)
     @kill_on_exception(exc_logname)
@@ -430,7 +677,12 @@ class Gauge(app_manager.RyuApp):
             self.pollers[dp.dp_id] = {}
             self.handlers[dp.dp_id] = {}
 
-        if dp.influxdb_stats:
+        if dp.prometheus_stats:
+            self.prometheus_store.set_dp_connected(dp, True)
+            port_state_handler = GaugePortStatePrometheusLogger(
+                dp, ryudp, self.logname, self.prometheus_store)
+            port_state_handler.set_ports(ev.ports)
+        elif dp.influxdb_stats:
             port_state_handler = GaugePortStateInfluxDBLogger(
                 dp, ryudp, self.logname)
         else:
@@ -439,7 +691,10 @@ class Gauge(app_manager.RyuApp):
         self.handlers[dp.dp_id]['port_state'] = port_state_handler
 
         if dp.monitor_ports:
-            if dp.influxdb_stats:
+            if dp.prometheus_stats:
+                port_stats_poller = GaugePortStatsPrometheusPoller(
+                    dp, ryudp, self.logname, self.prometheus_store)
+            elif dp.influxdb_stats:
                 port_stats_poller = GaugePortStatsInfluxDBPoller(
                    dp, ryudp, self.logname)
             else:
@@ -449,8 +704,12 @@ class Gauge(app_manager.RyuApp):
             port_stats_poller.start()
 
         if dp.monitor_flow_table:
-            flow_table_poller = GaugeFlowTablePoller(
-                dp, ryudp, self.logname)
+            if dp.prometheus_stats:
+                flow_table_poller = GaugeFlowTablePrometheusPoller(
+                    dp, ryudp, self.logname, self.prometheus_store)
+            else:
+                flow_table_poller = GaugeFlowTablePoller(
+                    dp, ryudp, self.logname)
             self.pollers[dp.dp_id]['flow_table'] = flow_table_poller
             flow_table_poller.start()
 
@@ -0,0 +1,148 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from functools import wraps
+
+from ryu.lib import hub
+
+
+# Upper bounds of latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+
+class LatencyHistogram(object):
+    """Cumulative histogram of latencies, in seconds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, latency):
+        self.count += 1
+        self.sum += latency
+        if latency > self.max:
+            self.max = latency
+        for i, bucket in enumerate(self.buckets):
+            if latency <= bucket:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, quantile):
+        """Return the upper bound of the bucket containing quantile."""
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for bucket, bucket_count in zip(self.buckets, self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                if bucket == float('inf'):
+                    return self.max
+                return bucket
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.sum / self.count
+
+
+class HandlerStats(object):
+    """Call count, latency and ofmsgs sent for one FAUCET handler."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.ofmsgs = 0
+
+    def observe(self, latency, ofmsgs):
+        self.latency.observe(latency)
+        self.ofmsgs += ofmsgs
+
+    def __str__(self):
+        calls = self.latency.count
+        ofmsgs_per_call = 0.0
+        if calls:
+            ofmsgs_per_call = float(self.ofmsgs) / calls
+        return (
+            '%s: calls %u mean %.6fs p50 <%gs p99 <%gs max %.6fs '
+            'ofmsgs/call %.1f' % (
+                self.name, calls, self.latency.mean(),
+                self.latency.quantile(0.5), self.latency.quantile(0.99),
+                self.latency.max, ofmsgs_per_call))
+
+
+class Instrumentation(object):
+    """Handler latencies, ofmsgs sent and eventlet hub scheduling lag.
+
+    Since ryu runs all handlers on one eventlet hub, handler latencies and
+    the lag of a greenthread sleeping on the hub together show when the
+    controller is saturated."""
+
+    def __init__(self):
+        self.handlers = {}
+        self.ofmsgs_sent = 0
+        self.hub_lag = LatencyHistogram()
+        self.watchdog_thread = None
+
+    def handler_stats(self, name):
+        if name not in self.handlers:
+            self.handlers[name] = HandlerStats(name)
+        return self.handlers[name]
+
+    def sent_ofmsgs(self, count):
+        self.ofmsgs_sent += count
+
+    def hub_lag_watchdog(self, interval):
+        """Sleep for interval in a loop, recording how late we wake up."""
+        while True:
+            start = time.time()
+            hub.sleep(interval)
+            self.hub_lag.observe(max(0, time.time() - start - interval))
+
+    def start_watchdog(self, interval=0.1):
+        self.watchdog_thread = hub.spawn(self.hub_lag_watchdog, interval)
+
+    def summary(self):
+        lines = [str(self.handlers[name]) for name in sorted(self.handlers)]
+        lines.append(
+            'hub lag: mean %.6fs p99 <%gs max %.6fs, ofmsgs sent %u' % (
+                self.hub_lag.mean(), self.hub_lag.quantile(0.99),
+                self.hub_lag.max, self.ofmsgs_sent))
+        return lines
+
+
+def instrument_handler(func):
+    """decorator to record latency and ofmsgs sent by a handler.
+
+    The decorated method's object must have an instrumentation attribute,
+    to which ofmsgs sent are reported with sent_ofmsgs()."""
+    @wraps(func)
+    def __instrument(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        ofmsgs_sent = instrumentation.ofmsgs_sent
+        start = time.time()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            instrumentation.handler_stats(func.__name__).observe(
+                time.time() - start,
+                instrumentation.ofmsgs_sent - ofmsgs_sent)
+    return __instrument
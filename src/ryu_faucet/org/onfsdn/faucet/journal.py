@@ -0,0 +1,329 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record and replay the inputs to a Valve.
+
+When the environment variable FAUCET_JOURNAL is set, Faucet appends every
+input it passes to its Valve to that file: the config, packet-ins, port
+status changes, flow removals, flow stats, group desc and table features
+replies, datapath connects/disconnects, reloads and timer ticks.
+
+The journal can be replayed into a fresh Valve, as fast as possible or at the
+recorded rate, optionally under cProfile. Either way, the Valve's clock is
+the time each record was received, so timeouts and expiry happen as they
+did live:
+
+    python journal.py faucet.journal --profile replay.pstats
+
+The pstats output can be turned into a call graph or flame graph with the
+usual tools (eg. gprof2dot, flameprof).
+"""
+
+import argparse
+import cProfile
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from dp import DP
+from valve import valve_factory
+
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_protocol
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+
+JOURNAL_MAGIC = 'FAUCETJ2'
+
+# Record header: record type, time received, payload length.
+RECORD_HEADER = struct.Struct('!BdI')
+
+CONFIG = 1
+CONNECT = 2
+DISCONNECT = 3
+PORT_ADD = 4
+PORT_DELETE = 5
+PACKET_IN = 6
+RELOAD = 7
+RESOLVE_GATEWAYS = 8
+HOST_EXPIRE = 9
+FLOW_REMOVED = 10
+# a multipart reply: flow stats, group desc or table features.
+STATS_REPLY = 11
+
+RECORD_NAMES = {
+    CONFIG: 'config',
+    CONNECT: 'connect',
+    DISCONNECT: 'disconnect',
+    PORT_ADD: 'port_add',
+    PORT_DELETE: 'port_delete',
+    PACKET_IN: 'packet_in',
+    RELOAD: 'reload',
+    RESOLVE_GATEWAYS: 'resolve_gateways',
+    HOST_EXPIRE: 'host_expire',
+    FLOW_REMOVED: 'flow_removed',
+    STATS_REPLY: 'stats_reply',
+}
+
+DP_ID = struct.Struct('!Q')
+DP_PORT = struct.Struct('!QI')
+PORT = struct.Struct('!I')
+# packet-in header, with the cookie of the flow that sent the packet.
+PACKET_IN_HEADER = struct.Struct('!QIHQ')
+
+
+class ValveJournal(object):
+    """Append only journal of the inputs to a Valve.
+
+    Records are buffered, and flushed to disk on every timer tick, so at
+    most a few seconds of input is lost if the controller dies."""
+
+    def __init__(self, journal_file):
+        new_file = (not os.path.exists(journal_file) or
+                    os.path.getsize(journal_file) == 0)
+        self.journal = open(journal_file, 'ab')
+        if new_file:
+            self.journal.write(JOURNAL_MAGIC)
+
+    def record(self, record_type, payload=''):
+        self.journal.write(
+            RECORD_HEADER.pack(record_type, time.time(), len(payload)))
+        self.journal.write(payload)
+
+    def config(self, config_file, record_type=CONFIG):
+        with open(config_file, 'rb') as config:
+            self.record(record_type, config.read())
+
+    def reload(self, config_file):
+        self.config(config_file, RELOAD)
+
+    def connect(self, dp_id, port_nums):
+        self.record(CONNECT, DP_ID.pack(dp_id) + ''.join(
+            [PORT.pack(port_num) for port_num in port_nums]))
+
+    def disconnect(self, dp_id):
+        self.record(DISCONNECT, DP_ID.pack(dp_id))
+
+    def port_add(self, dp_id, port_num):
+        self.record(PORT_ADD, DP_PORT.pack(dp_id, port_num))
+
+    def port_delete(self, dp_id, port_num):
+        self.record(PORT_DELETE, DP_PORT.pack(dp_id, port_num))
+
+    def packet_in(self, dp_id, in_port, vlan_vid, data, cookie):
+        self.record(
+            PACKET_IN, PACKET_IN_HEADER.pack(
+                dp_id, in_port, vlan_vid, cookie) + data)
+
+    def flow_removed(self, dp_id, data):
+        self.record(FLOW_REMOVED, DP_ID.pack(dp_id) + data)
+
+    def stats_reply(self, dp_id, data):
+        self.record(STATS_REPLY, DP_ID.pack(dp_id) + data)
+
+    def resolve_gateways(self):
+        self.record(RESOLVE_GATEWAYS)
+        self.journal.flush()
+
+    def host_expire(self):
+        self.record(HOST_EXPIRE)
+        self.journal.flush()
+
+    def close(self):
+        self.journal.close()
+
+
+def read_journal(journal_file):
+    """Yield (record_type, record_time, payload) from a journal file."""
+    with open(journal_file, 'rb') as journal:
+        if journal.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError('%s is not a FAUCET journal' % journal_file)
+        while True:
+            header = journal.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # a truncated trailing record means the writer died.
+                return
+            record_type, record_time, length = RECORD_HEADER.unpack(header)
+            payload = journal.read(length)
+            if len(payload) < length:
+                return
+            yield record_type, record_time, payload
+
+
+class ValveJournalReplay(object):
+    """Feed the records of a journal to a fresh Valve."""
+
+    def __init__(self, logname='faucet'):
+        self.logname = logname
+        self.valve = None
+        # the time the record being replayed was received.
+        self.record_time = None
+        # flow stats from the parts of a reply received so far.
+        self.flow_stats = []
+        # number of records and total time spent in Valve, by record type
+        self.counts = dict([(name, 0) for name in RECORD_NAMES.values()])
+        self.times = dict([(name, 0.0) for name in RECORD_NAMES.values()])
+        self.ofmsgs = 0
+
+    def parse_config(self, config):
+        config_fd, config_file = tempfile.mkstemp(suffix='.yaml')
+        try:
+            with os.fdopen(config_fd, 'wb') as config_tmp:
+                config_tmp.write(config)
+            new_dp = DP.parser(config_file, self.logname)
+        finally:
+            os.remove(config_file)
+        new_dp.sanity_check()
+        # don't restore or overwrite the live controller's snapshot.
+        new_dp.snapshot_file = None
+        return new_dp
+
+    def clock(self):
+        return self.record_time
+
+    @staticmethod
+    def parse_ofmsg(payload):
+        """Return (dp_id, msg) from an OpenFlow message record."""
+        dp_id, = DP_ID.unpack_from(payload)
+        data = payload[DP_ID.size:]
+        version, msg_type, msg_len, xid = ofproto_parser.header(data)
+        msg = ofproto_parser.msg(
+            ofproto_protocol.ProtocolDesc(version),
+            version, msg_type, msg_len, xid, data)
+        return dp_id, msg
+
+    def stats_reply(self, dp_id, msg):
+        valve = self.valve
+        if isinstance(msg, parser.OFPFlowStatsReply):
+            self.flow_stats.extend(msg.body)
+            if msg.flags & ofp.OFPMPF_REPLY_MORE:
+                return []
+            flow_stats = self.flow_stats
+            self.flow_stats = []
+            return valve.flow_stats_reply(dp_id, flow_stats)
+        if isinstance(msg, parser.OFPGroupDescStatsReply):
+            valve.group_desc(dp_id, msg.body)
+        elif isinstance(msg, parser.OFPTableFeaturesStatsReply):
+            valve.table_features(dp_id, msg.body)
+        return []
+
+    def replay_record(self, record_type, payload, record_time=None):
+        if record_time is None:
+            record_time = time.time()
+        self.record_time = record_time
+        valve = self.valve
+        if record_type == CONFIG:
+            self.valve = valve_factory(self.parse_config(payload))
+            if self.valve is not None:
+                self.valve.clock = self.clock
+            return []
+        if valve is None:
+            # the journal must start with the config for the valve.
+            return []
+        if record_type == PACKET_IN:
+            dp_id, in_port, vlan_vid, cookie = (
+                PACKET_IN_HEADER.unpack_from(payload))
+            pkt = valve.parse_packet_in(
+                payload[PACKET_IN_HEADER.size:], cookie)
+            return valve.rcv_packet(dp_id, in_port, vlan_vid, pkt, cookie)
+        if record_type == CONNECT:
+            dp_id, = DP_ID.unpack_from(payload)
+            port_nums = [
+                PORT.unpack_from(payload, offset)[0] for offset in range(
+                    DP_ID.size, len(payload), PORT.size)]
+            # flow stats requested before the connect won't be answered.
+            self.flow_stats = []
+            return valve.datapath_reconnect(dp_id, port_nums)
+        if record_type == DISCONNECT:
+            dp_id, = DP_ID.unpack(payload)
+            return valve.datapath_disconnect(dp_id)
+        if record_type == PORT_ADD:
+            return valve.port_add(*DP_PORT.unpack(payload))
+        if record_type == PORT_DELETE:
+            return valve.port_delete(*DP_PORT.unpack(payload))
+        if record_type == RELOAD:
+            return valve.reload_config(self.parse_config(payload))
+        if record_type == RESOLVE_GATEWAYS:
+            return valve.resolve_gateways()
+        if record_type == HOST_EXPIRE:
+            return valve.host_expire()
+        if record_type == FLOW_REMOVED:
+            return valve.flow_removed(*self.parse_ofmsg(payload))
+        if record_type == STATS_REPLY:
+            return self.stats_reply(*self.parse_ofmsg(payload))
+        return []
+
+    def replay(self, records, realtime=False):
+        first_record_time = None
+        replay_start = time.time()
+        for record_type, record_time, payload in records:
+            if realtime:
+                if first_record_time is None:
+                    first_record_time = record_time
+                delay = ((record_time - first_record_time) -
+                         (time.time() - replay_start))
+                if delay > 0:
+                    time.sleep(delay)
+            start = time.time()
+            ofmsgs = self.replay_record(record_type, payload, record_time)
+            name = RECORD_NAMES.get(record_type, 'unknown')
+            self.times[name] = self.times.get(name, 0.0) + time.time() - start
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if ofmsgs:
+                self.ofmsgs += len(ofmsgs)
+        return time.time() - replay_start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Replay a FAUCET journal into a fresh Valve.')
+    parser.add_argument('journal', help='journal file recorded by FAUCET')
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay at the recorded rate, '
+                             'rather than as fast as possible')
+    parser.add_argument('--profile',
+                        help='run under cProfile, saving stats to this file')
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger('faucet')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = 0
+
+    replayer = ValveJournalReplay()
+    records = read_journal(args.journal)
+    if args.profile:
+        profiler = cProfile.Profile()
+        elapsed = profiler.runcall(replayer.replay, records, args.realtime)
+        profiler.dump_stats(args.profile)
+    else:
+        elapsed = replayer.replay(records, args.realtime)
+
+    total = sum(replayer.counts.values())
+    print 'replayed %u records in %.3fs (%.1f records/s), %u ofmsgs' % (
+        total, elapsed, total / max(elapsed, 1e-9), replayer.ofmsgs)
+    for name in sorted(replayer.counts):
+        count = replayer.counts[name]
+        if count:
+            valve_time = replayer.times[name]
+            print '%-20s %10u %10.3fs %12.1f/s' % (
+                name, count, valve_time, count / max(valve_time, 1e-9))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,267 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Metrics in the Prometheus text format, served over HTTP.
+
+Metrics are counted on the eventlet hub, and rendered in a native thread
+so that a scrape never delays OpenFlow messages. Rendering only reads
+FAUCET's state, taking copies of dicts with single C level operations such
+as items() and keys(), which can't see a dict change part way through."""
+
+import logging
+
+from eventlet import tpool, wsgi
+
+from cookie import OWNER_NAMES
+from instrumentation import LatencyHistogram
+
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of config reload duration buckets, in seconds.
+RELOAD_BUCKETS = (
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, float('inf'))
+
+FLOW_MOD_COMMANDS = {
+    ofp.OFPFC_ADD: 'add',
+    ofp.OFPFC_MODIFY: 'modify',
+    ofp.OFPFC_MODIFY_STRICT: 'modify_strict',
+    ofp.OFPFC_DELETE: 'delete',
+    ofp.OFPFC_DELETE_STRICT: 'delete_strict',
+}
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsText(object):
+    """A Prometheus text format exposition, built a metric at a time.
+
+    Samples are given as (labels, value), with labels a sequence of
+    (name, value) pairs."""
+
+    def __init__(self):
+        self.lines = []
+
+    def header(self, name, metric_type, help_text):
+        self.lines.append('# HELP %s %s' % (name, help_text))
+        self.lines.append('# TYPE %s %s' % (name, metric_type))
+
+    def sample(self, name, labels, value):
+        if labels:
+            self.lines.append('%s{%s} %s' % (name, ','.join([
+                '%s="%s"' % (label, escape_label_value(label_value))
+                for label, label_value in labels]), format_value(value)))
+        else:
+            self.lines.append('%s %s' % (name, format_value(value)))
+
+    def metric(self, name, metric_type, help_text, samples):
+        self.header(name, metric_type, help_text)
+        for labels, value in samples:
+            self.sample(name, labels, value)
+
+    def histogram(self, name, help_text, histograms):
+        """Add LatencyHistograms, given as (labels, histogram)."""
+        self.header(name, 'histogram', help_text)
+        for labels, histogram in histograms:
+            labels = tuple(labels)
+            cumulative = 0
+            for bucket, bucket_count in zip(
+                    histogram.buckets, list(histogram.bucket_counts)):
+                cumulative += bucket_count
+                self.sample(
+                    name + '_bucket', labels + (('le', bucket),), cumulative)
+            self.sample(name + '_sum', labels, histogram.sum)
+            self.sample(name + '_count', labels, cumulative)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+class FaucetMetrics(object):
+    """Counters of FAUCET's activity, and rendering of its state."""
+
+    def __init__(self):
+        # packet-ins by what they were sent to the controller for
+        self.packet_ins = {}
+        # flowmods sent by (table_id, command)
+        self.flowmods_sent = {}
+        # other OpenFlow messages sent, by message class name
+        self.ofmsgs_sent = {}
+        self.reloads = LatencyHistogram(RELOAD_BUCKETS)
+
+    def packet_in(self, owner):
+        owner_name = OWNER_NAMES.get(owner, 'unknown')
+        self.packet_ins[owner_name] = self.packet_ins.get(owner_name, 0) + 1
+
+    def sent(self, ofmsgs):
+        flowmods_sent = self.flowmods_sent
+        ofmsgs_sent = self.ofmsgs_sent
+        for ofmsg in ofmsgs:
+            if isinstance(ofmsg, parser.OFPFlowMod):
+                key = (ofmsg.table_id, ofmsg.command)
+                flowmods_sent[key] = flowmods_sent.get(key, 0) + 1
+            else:
+                key = ofmsg.__class__.__name__
+                ofmsgs_sent[key] = ofmsgs_sent.get(key, 0) + 1
+
+    def reloaded(self, duration):
+        self.reloads.observe(duration)
+
+    def render(self, valve=None, instrumentation=None, event_queues=None):
+        """Return all metrics in the Prometheus text format."""
+        text = MetricsText()
+        dp_labels = ()
+        if valve is not None:
+            dp_labels = (('dp_id', '0x%x' % valve.dp.dp_id),)
+        text.metric(
+            'faucet_packet_ins_total', 'counter',
+            'Packet-ins received, by what they were sent for.',
+            [(dp_labels + (('type', owner_name),), count)
+             for owner_name, count in sorted(self.packet_ins.items())])
+        text.metric(
+            'faucet_flowmods_sent_total', 'counter',
+            'Flowmods sent, by table and command.',
+            [(dp_labels + (
+                ('table_id', table_id),
+                ('command', FLOW_MOD_COMMANDS.get(command, command))), count)
+             for (table_id, command), count in sorted(
+                 self.flowmods_sent.items())])
+        text.metric(
+            'faucet_ofmsgs_sent_total', 'counter',
+            'OpenFlow messages other than flowmods sent, by type.',
+            [(dp_labels + (('type', msg_type),), count)
+             for msg_type, count in sorted(self.ofmsgs_sent.items())])
+        text.histogram(
+            'faucet_config_reload_seconds', 'Time taken to reload config.',
+            [(dp_labels, self.reloads)])
+        if valve is not None:
+            self.render_dp(text, valve.dp, dp_labels)
+        if instrumentation is not None:
+            text.histogram(
+                'faucet_handler_seconds', 'Latency of FAUCET handlers.',
+                [((('handler', name),), stats.latency)
+                 for name, stats in sorted(
+                     instrumentation.handlers.items())])
+            text.histogram(
+                'faucet_hub_lag_seconds',
+                'Lateness of a greenthread waking on the eventlet hub.',
+                [((), instrumentation.hub_lag)])
+        if event_queues is not None:
+            queues = [((('class', queue.name),), queue)
+                      for queue in event_queues.queues]
+            text.metric(
+                'faucet_events_queued_total', 'counter',
+                'Events queued for handling, by event class.',
+                [(labels, queue.queued) for labels, queue in queues])
+            text.metric(
+                'faucet_events_dropped_total', 'counter',
+                'Events dropped as their queue was full, by event class.',
+                [(labels, queue.dropped) for labels, queue in queues])
+            text.metric(
+                'faucet_event_queue_depth', 'gauge',
+                'Events waiting to be handled, by event class.',
+                [(labels, len(queue.events)) for labels, queue in queues])
+        return text.text()
+
+    @staticmethod
+    def render_dp(text, dp, dp_labels):
+        vlans = []
+        for vid, vlan in sorted(dp.vlans.items()):
+            vlans.append((dp_labels + (('vlan', vid),), vlan))
+        text.metric(
+            'faucet_vlan_hosts_learned', 'gauge',
+            'Hosts learned on each VLAN.',
+            [(labels, len(vlan.host_cache)) for labels, vlan in vlans])
+        text.metric(
+            'faucet_vlan_host_moves_total', 'counter',
+            'Times hosts moved between ports on each VLAN.',
+            [(labels, vlan.host_moves) for labels, vlan in vlans])
+        text.metric(
+            'faucet_vlan_max_hosts_bans_total', 'counter',
+            'Times learning was banned on each VLAN, as max_hosts was '
+            'reached.',
+            [(labels, vlan.max_hosts_bans) for labels, vlan in vlans])
+        neighbors = []
+        gateways = []
+        for labels, vlan in vlans:
+            for ipv, routes, neighbor_cache in (
+                    (4, vlan.ipv4_routes, vlan.arp_cache),
+                    (6, vlan.ipv6_routes, vlan.nd_cache)):
+                ipv_labels = labels + (('ipv', ipv),)
+                resolved = set(neighbor_cache.keys())
+                ip_gws = set(routes.values())
+                neighbors.append((ipv_labels, len(resolved)))
+                gateways.append((
+                    ipv_labels + (('state', 'resolved'),),
+                    len(ip_gws & resolved)))
+                gateways.append((
+                    ipv_labels + (('state', 'unresolved'),),
+                    len(ip_gws - resolved)))
+        text.metric(
+            'faucet_vlan_neighbors', 'gauge',
+            'Neighbors in the ARP (ipv 4) and ND (ipv 6) cache of each VLAN.',
+            neighbors)
+        text.metric(
+            'faucet_vlan_route_gateways', 'gauge',
+            'Gateways of routes on each VLAN, by whether they are resolved.',
+            gateways)
+
+
+class MetricsServer(object):
+    """Serves render() over HTTP.
+
+    Requests are handled by an eventlet WSGI server on the hub, and each
+    scrape is rendered by eventlet's pool of native threads."""
+
+    def __init__(self, addr, port, render, logname):
+        self.render = render
+        self.logger = logging.getLogger(logname)
+        self.sock = hub.listen((addr, port))
+        # don't log every scrape.
+        self.thread = hub.spawn(
+            wsgi.server, self.sock, self.handle, log_output=False)
+
+    def handle(self, environ, start_response):
+        if environ['PATH_INFO'] not in ('/', '/metrics'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not Found\n']
+        try:
+            body = tpool.execute(self.render)
+        except Exception:
+            self.logger.exception('Could not render metrics')
+            start_response(
+                '500 Internal Server Error', [('Content-Type', 'text/plain')])
+            return ['Could not render metrics\n']
+        start_response('200 OK', [
+            ('Content-Type', CONTENT_TYPE),
+            ('Content-Length', str(len(body)))])
+        return [body]
+
+    def shutdown(self):
+        hub.kill(self.thread)
+        self.sock.close()
@@ -0,0 +1,163 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary OpenFlow channel log.
+
+Messages are logged as raw OpenFlow wire bytes with a timestamp, by a writer
+thread fed from a bounded queue, so logging costs the controller no more than
+a queue put. When the queue is full messages are dropped and counted.
+
+To render a log:
+
+    python ofchannel.py ofchannel.log
+"""
+
+import logging
+import os
+import struct
+import sys
+import time
+
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_protocol
+
+from util import Queue, start_native_thread
+
+
+OFCHANNEL_MAGIC = 'FAUCETOF'
+
+# Record header: time, direction, message length.
+RECORD_HEADER = struct.Struct('!dBH')
+
+RECEIVED = 0
+SENT = 1
+
+DIRECTION_NAMES = {RECEIVED: 'received', SENT: 'sent'}
+
+
+class OFChannelLogWriter(object):
+    """Write OpenFlow messages to a binary log from a native thread.
+
+    The log is rotated at midnight, keeping the same naming as
+    TimedRotatingFileHandler."""
+
+    def __init__(self, filename, logname, queue_size=10000, batch_size=100):
+        self.filename = filename
+        self.logger = logging.getLogger(logname)
+        self.queue = Queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.dropped_reported = 0
+        self.log_file = None
+        self.log_day = None
+        self.thread = start_native_thread(self.writer)
+
+    def log(self, direction, data):
+        """Queue one OpenFlow message's wire bytes, dropping it if full."""
+        try:
+            self.queue.put_nowait((time.time(), direction, data))
+        except Queue.Full:
+            self.dropped += 1
+
+    def open_log(self, now):
+        day = time.strftime('%Y-%m-%d', time.localtime(now))
+        if self.log_file is not None:
+            if day == self.log_day:
+                return
+            self.log_file.close()
+            os.rename(self.filename, '.'.join((self.filename, self.log_day)))
+        self.log_day = day
+        new_file = (not os.path.exists(self.filename) or
+                    os.path.getsize(self.filename) == 0)
+        self.log_file = open(self.filename, 'ab')
+        if new_file:
+            self.log_file.write(OFCHANNEL_MAGIC)
+
+    def writer(self):
+        while True:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.batch_size:
+                    records.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            try:
+                self.open_log(records[0][0])
+                self.log_file.write(''.join(
+                    [RECORD_HEADER.pack(
+                        record_time, direction, len(data)) + data
+                     for record_time, direction, data in records]))
+                self.log_file.flush()
+            finally:
+                for _ in records:
+                    self.queue.task_done()
+            dropped = self.dropped
+            if dropped != self.dropped_reported:
+                self.logger.warning(
+                    'ofchannel log queue full, %u messages dropped',
+                    dropped - self.dropped_reported)
+                self.dropped_reported = dropped
+
+    def flush(self):
+        """Wait until all queued messages are written."""
+        self.queue.join()
+
+
+def decode_msg(data):
+    """Return a ryu message object for raw OpenFlow wire bytes.
+
+    ryu has no parser for some controller to switch messages (e.g. barrier
+    requests), so those are returned as a bare MsgBase with the raw bytes.
+    """
+    version, msg_type, msg_len, xid = ofproto_parser.header(data)
+    datapath = ofproto_protocol.ProtocolDesc(version)
+    if msg_type in datapath.ofproto_parser._MSG_PARSERS:
+        return ofproto_parser.msg(
+            datapath, version, msg_type, msg_len, xid, data)
+    msg = ofproto_parser.MsgBase(datapath)
+    msg.version, msg.msg_type, msg.msg_len, msg.xid = (
+        version, msg_type, msg_len, xid)
+    msg.buf = data
+    return msg
+
+
+def read_ofchannel_log(filename):
+    """Yield (time, direction, msg) from a binary ofchannel log."""
+    with open(filename, 'rb') as log_file:
+        if log_file.read(len(OFCHANNEL_MAGIC)) != OFCHANNEL_MAGIC:
+            raise ValueError('%s is not a FAUCET ofchannel log' % filename)
+        while True:
+            header = log_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            record_time, direction, length = RECORD_HEADER.unpack(header)
+            data = log_file.read(length)
+            if len(data) < length:
+                return
+            yield record_time, direction, decode_msg(data)
+
+
+def main(argv):
+    if len(argv) != 1:
+        print 'usage: ofchannel.py ofchannel.log'
+        return 1
+    for record_time, direction, msg in read_ofchannel_log(argv[0]):
+        print '%s.%06u %-8s %s' % (
+            time.strftime('%b %d %H:%M:%S', time.localtime(record_time)),
+            int((record_time % 1) * 1e6), DIRECTION_NAMES[direction], msg)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,237 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profile a running controller for a bounded window.
+
+CPUProfiler samples the stack of whatever is running every interval of CPU
+time, using SIGPROF, so it costs little and sees every greenthread on the
+eventlet hub. MemoryProfiler counts the objects tracked by the garbage
+collector by type at the start and end of the window, since there is no
+tracemalloc in python 2: growth in HostCacheEntry, LinkNeighbor or ryu
+message objects shows what is holding memory."""
+
+import gc
+import os
+import resource
+import signal
+import sys
+import time
+
+# Stack frames kept per CPU sample.
+MAX_STACK_DEPTH = 64
+# Lines written to each report.
+REPORT_TOP = 50
+# Object types always reported by MemoryProfiler, with any from these modules.
+WATCHED_TYPES = ('valve.HostCacheEntry', 'valve.LinkNeighbor')
+WATCHED_MODULES = ('ryu.ofproto.', 'ryu.lib.packet.', 'ryu.controller.')
+
+
+def report_file(output_dir, kind, suffix):
+    return os.path.join(output_dir, 'faucet_%s_%s.%s' % (
+        kind, time.strftime('%Y%m%d-%H%M%S'), suffix))
+
+
+def code_name(code):
+    return '%s:%s:%u' % (
+        os.path.basename(code.co_filename), code.co_name,
+        code.co_firstlineno)
+
+
+class CPUProfiler(object):
+    """Sampling CPU profiler, driven by the SIGPROF interval timer."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = {}
+        self.sample_count = 0
+        self.start_time = None
+        self.previous_handler = None
+
+    def running(self):
+        return self.start_time is not None
+
+    def sample(self, sigid, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(stack)
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+        self.sample_count += 1
+
+    def start(self):
+        """Start sampling, returning False if already running."""
+        if self.running():
+            return False
+        self.samples = {}
+        self.sample_count = 0
+        self.start_time = time.time()
+        self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        # don't interrupt system calls in progress when sampling.
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+        elapsed = time.time() - self.start_time
+        self.start_time = None
+        return elapsed
+
+    def function_counts(self):
+        """Return samples by function, as (self, total) counts."""
+        own = {}
+        total = {}
+        for stack, count in self.samples.iteritems():
+            own[stack[0]] = own.get(stack[0], 0) + count
+            # recursive functions count once per sample.
+            for code in set(stack):
+                total[code] = total.get(code, 0) + count
+        return own, total
+
+    def write(self, output_dir, elapsed):
+        """Write the top functions, and all stacks in folded format.
+
+        Folded stacks (outermost function first, one stack per line with its
+        sample count) can be made into a flame graph with flamegraph.pl."""
+        own, total = self.function_counts()
+        samples = max(self.sample_count, 1)
+        report_name = report_file(output_dir, 'cpu', 'txt')
+        with open(report_name, 'w') as report:
+            report.write(
+                'CPU profile: %u samples every %gs of CPU in %.1fs\n' % (
+                    self.sample_count, self.interval, elapsed))
+            report.write('%8s %8s  %s\n' % ('self %', 'total %', 'function'))
+            top = sorted(total, key=lambda code: total[code], reverse=True)
+            for code in top[:REPORT_TOP]:
+                report.write('%8.2f %8.2f  %s\n' % (
+                    100.0 * own.get(code, 0) / samples,
+                    100.0 * total[code] / samples, code_name(code)))
+        folded_name = report_file(output_dir, 'cpu', 'folded')
+        with open(folded_name, 'w') as folded:
+            for stack, count in self.samples.iteritems():
+                folded.write('%s %u\n' % (
+                    ';'.join([code_name(code) for code in reversed(stack)]),
+                    count))
+        return [report_name, folded_name]
+
+
+def type_name(obj_type):
+    module = getattr(obj_type, '__module__', None)
+    if module in (None, '__builtin__'):
+        return obj_type.__name__
+    return '%s.%s' % (module, obj_type.__name__)
+
+
+def object_size(obj):
+    size = sys.getsizeof(obj, 0)
+    obj_dict = getattr(obj, '__dict__', None)
+    if isinstance(obj_dict, dict):
+        size += sys.getsizeof(obj_dict, 0)
+    return size
+
+
+def current_rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / 1024
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class MemoryProfiler(object):
+    """Growth in objects by type over a window.
+
+    Only objects tracked by the garbage collector are counted: containers
+    and class instances, but not strings or numbers themselves. Sizes are
+    shallow, the object plus its __dict__."""
+
+    def __init__(self):
+        self.start_counts = None
+        self.start_rss_kb = None
+        self.start_time = None
+
+    def running(self):
+        return self.start_time is not None
+
+    @staticmethod
+    def type_counts(with_sizes=False):
+        counts = {}
+        sizes = {}
+        for obj in gc.get_objects():
+            name = type_name(type(obj))
+            counts[name] = counts.get(name, 0) + 1
+            if with_sizes:
+                sizes[name] = sizes.get(name, 0) + object_size(obj)
+        return counts, sizes
+
+    def start(self):
+        """Count objects, returning False if already running."""
+        if self.running():
+            return False
+        gc.collect()
+        self.start_counts, _ = self.type_counts()
+        self.start_rss_kb = current_rss_kb()
+        self.start_time = time.time()
+        return True
+
+    def stop(self):
+        elapsed = time.time() - self.start_time
+        self.start_time = None
+        return elapsed
+
+    @staticmethod
+    def watched(name):
+        return name in WATCHED_TYPES or name.startswith(WATCHED_MODULES)
+
+    def write(self, output_dir, elapsed):
+        gc.collect()
+        counts, sizes = self.type_counts(with_sizes=True)
+        start_counts = self.start_counts
+        growth = dict([
+            (name, counts.get(name, 0) - start_counts.get(name, 0))
+            for name in set(counts) | set(start_counts)])
+        report_name = report_file(output_dir, 'memory', 'txt')
+        with open(report_name, 'w') as report:
+            report.write(
+                'Memory profile over %.1fs: rss %s kB -> %s kB, '
+                'peak rss %u kB\n' % (
+                    elapsed, self.start_rss_kb, current_rss_kb(),
+                    peak_rss_kb()))
+
+            def write_types(title, names):
+                report.write('\n%s\n' % title)
+                report.write('%10s %10s %12s  %s\n' % (
+                    'objects', 'change', 'bytes', 'type'))
+                for name in names:
+                    report.write('%10u %+10d %12u  %s\n' % (
+                        counts.get(name, 0), growth[name],
+                        sizes.get(name, 0), name))
+
+            by_growth = sorted(
+                growth, key=lambda name: growth[name], reverse=True)
+            write_types('Most grown types', by_growth[:REPORT_TOP])
+            by_size = sorted(
+                sizes, key=lambda name: sizes[name], reverse=True)
+            write_types('Largest types', by_size[:REPORT_TOP])
+            write_types('FAUCET and ryu types', [
+                name for name in by_size if self.watched(name)][:REPORT_TOP])
+        self.start_counts = None
+        return [report_name]
@@ -0,0 +1,165 @@
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Snapshots of the hosts and neighbors learned by a Valve.
+
+A snapshot holds the host cache and the ARP/ND neighbor caches of every
+VLAN, as fixed size binary records. Snapshots are written to a temporary
+file that is renamed over the previous snapshot, so a snapshot on disk is
+always complete even if the controller dies while writing one. Snapshots
+are serialized by the caller, and written by a SnapshotWriter thread.
+"""
+
+import io
+import logging
+import os
+import struct
+import tempfile
+
+import ipaddr
+
+from ryu.lib import addrconv
+
+from util import start_native_thread, threading
+
+
+SNAPSHOT_MAGIC = 'FAUCETS1'
+
+# Snapshot header: number of host records, number of neighbor records.
+SNAPSHOT_HEADER = struct.Struct('!II')
+
+# vid, eth_src, port, permanent, cache time.
+HOST = struct.Struct('!H6sI?d')
+
+# vid, IP version, IP address (padded), eth_src, cache time.
+NEIGHBOR = struct.Struct('!HB16s6sd')
+
+
+def serialize_snapshot(vlans):
+    """Return a snapshot of the caches of vlans."""
+    hosts = []
+    neighbors = []
+    for vlan in vlans:
+        for eth_src, host_cache_entry in vlan.host_cache.iteritems():
+            hosts.append(HOST.pack(
+                vlan.vid, addrconv.mac.text_to_bin(eth_src),
+                host_cache_entry.port_num, host_cache_entry.permanent,
+                host_cache_entry.cache_time))
+        for neighbor_cache in (vlan.arp_cache, vlan.nd_cache):
+            for ip_gw, link_neighbor in neighbor_cache.iteritems():
+                neighbors.append(NEIGHBOR.pack(
+                    vlan.vid, ip_gw.version, ip_gw.packed,
+                    addrconv.mac.text_to_bin(link_neighbor.eth_src),
+                    link_neighbor.cache_time))
+    return ''.join(
+        [SNAPSHOT_MAGIC, SNAPSHOT_HEADER.pack(len(hosts), len(neighbors))] +
+        hosts + neighbors)
+
+
+def write_snapshot(snapshot_file, data):
+    """Atomically replace snapshot_file with a serialized snapshot."""
+    snapshot_dir = os.path.dirname(os.path.abspath(snapshot_file))
+    snapshot_fd, snapshot_tmp = tempfile.mkstemp(
+        dir=snapshot_dir, prefix='.snapshot')
+    try:
+        with io.open(snapshot_fd, 'wb') as snapshot:
+            snapshot.write(data)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.rename(snapshot_tmp, snapshot_file)
+    except:
+        os.remove(snapshot_tmp)
+        raise
+
+
+class SnapshotWriter(object):
+    """Write serialized snapshots from a native thread.
+
+    The eventlet hub does not wait for the snapshot to be written and synced
+    to disk. If a snapshot is still pending when the next arrives, only the
+    latest is written."""
+
+    def __init__(self, logname):
+        self.logger = logging.getLogger(logname)
+        self.condition = threading.Condition()
+        self.pending = None
+        self.writing = False
+        self.thread = start_native_thread(self.writer)
+
+    def write(self, snapshot_file, data):
+        """Queue a serialized snapshot to replace snapshot_file."""
+        with self.condition:
+            self.pending = (snapshot_file, data)
+            self.condition.notify_all()
+
+    def writer(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                snapshot_file, data = self.pending
+                self.pending = None
+                self.writing = True
+            try:
+                write_snapshot(snapshot_file, data)
+            except (IOError, OSError) as err:
+                self.logger.error(
+                    'Could not write snapshot %s: %s', snapshot_file, err)
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def flush(self):
+        """Wait until the latest snapshot queued is written."""
+        with self.condition:
+            while self.pending is not None or self.writing:
+                self.condition.wait()
+
+
+def read_snapshot(snapshot_file):
+    """Return (hosts, neighbors) from a snapshot file.
+
+    hosts is a list of (vid, eth_src, port_num, permanent, cache_time), and
+    neighbors a list of (vid, ip_gw, eth_src, cache_time)."""
+    with open(snapshot_file, 'rb') as snapshot:
+        data = snapshot.read()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError('%s is not a FAUCET snapshot' % snapshot_file)
+    offset = len(SNAPSHOT_MAGIC)
+    host_count, neighbor_count = SNAPSHOT_HEADER.unpack_from(data, offset)
+    offset += SNAPSHOT_HEADER.size
+    if len(data) != (offset + host_count * HOST.size +
+                     neighbor_count * NEIGHBOR.size):
+        raise ValueError('%s is truncated' % snapshot_file)
+    hosts = []
+    for _ in range(host_count):
+        vid, eth_src, port_num, permanent, cache_time = HOST.unpack_from(
+            data, offset)
+        offset += HOST.size
+        hosts.append((
+            vid, addrconv.mac.bin_to_text(eth_src), port_num, permanent,
+            cache_time))
+    neighbors = []
+    for _ in range(neighbor_count):
+        vid, version, ip_gw, eth_src, cache_time = NEIGHBOR.unpack_from(
+            data, offset)
+        offset += NEIGHBOR.size
+        if version == 4:
+            ip_gw = ipaddr.IPv4Address(ipaddr.Bytes(ip_gw[:4]))
+        else:
+            ip_gw = ipaddr.IPv6Address(ipaddr.Bytes(ip_gw))
+        neighbors.append((
+            vid, ip_gw, addrconv.mac.bin_to_text(eth_src), cache_time))
+    return hosts, neighbors
@@ -16,6 +16,15 @@
 import os, signal, logging
 from functools import wraps
 
+from eventlet import patcher
+
+# ryu-manager's hub.patch() replaces socket, select, os and time with
+# eventlet's green versions, and with --enable-debugger threading, thread
+# and Queue as well. These are the unpatched modules, for work that has to
+# happen outside the eventlet hub.
+threading = patcher.original('threading')
+Queue = patcher.original('Queue')
+
 def dump(obj, level=0):
     prefix = level*'*'+' ' if level > 0 else ''
 
@@ -58,3 +67,17 @@ def kill_on_exception(logname):
                 os.kill(os.getpid(), signal.SIGKILL)
         return __koe
     return _koe
+
+def start_native_thread(target, *args):
+    """Start a daemon OS thread running target(*args), and return it.
+
+    The thread runs alongside the eventlet hub rather than as a greenthread
+    on it, so it can block on disk I/O without delaying OpenFlow messages.
+    It must not use sockets, select or os.fdopen, which may be green, and
+    it should share state with the hub only through this module's unpatched
+    Queue and threading objects. The hub blocks while it waits for one of
+    their locks, so the thread must hold them only briefly."""
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -16,14 +16,23 @@
 
 import ipaddr
 import logging
+import random
+import struct
 import time
 import os
 
-from collections import namedtuple
-
-from logging.handlers import TimedRotatingFileHandler
+from collections import namedtuple, OrderedDict
+from functools import wraps
 
 from util import mac_addr_is_unicast
+from ofchannel import OFChannelLogWriter, RECEIVED, SENT
+from flowtable import ValveFlowTable, FlowEntry
+from flowtable import match_key, instructions_key, buckets_key
+from snapshot import SnapshotWriter, read_snapshot, serialize_snapshot
+from cookie import flow_cookie, owner_cookie, cookie_owner, port_in_cookie
+from cookie import OWNER_PORT, OWNER_VLAN, OWNER_ACL, OWNER_ROUTE, OWNER_HOST
+from cookie import OWNER_LEARN, OWNER_CONTROLLER_ARP, OWNER_CONTROLLER_ICMP
+from cookie import OWNER_CONTROLLER_ICMPV6
 
 from ryu.lib import ofctl_v1_3 as ofctl
 from ryu.lib import mac
@@ -46,10 +55,46 @@ class LinkNeighbor(object):
 
 class HostCacheEntry(object):
 
-    def __init__(self, eth_src, permanent, now):
+    def __init__(self, eth_src, port_num, permanent, now):
         self.eth_src = eth_src
+        self.port_num = port_num
+        self.permanent = permanent
+        self.cache_time = now
+        # when the host's eth_dst flow was last seen to be used.
+        self.last_used = now
+        self.packet_count = 0
+        # packets seen by the host's eth_src flow, at the last flow stats.
+        self.src_packet_count = 0
+        # times the host has moved between ports, in total and since
+        # move_window_start.
+        self.moves = 0
+        self.window_moves = 0
+        self.move_window_start = now
+
+    def relearn(self, port_num, permanent, now):
+        """Update the entry for the host being learned again."""
+        self.port_num = port_num
         self.permanent = permanent
         self.cache_time = now
+        self.last_used = now
+
+
+def filter_by_flow_table(func):
+    """decorator to filter the ofmsgs returned by a Valve method against the
+    flows already installed, see ValveFlowTable.
+
+    Valve methods may call each other, so only the outermost call filters."""
+    @wraps(func)
+    def __filter(self, *args, **kwargs):
+        self.flow_table_depth += 1
+        try:
+            ofmsgs = func(self, *args, **kwargs)
+        finally:
+            self.flow_table_depth -= 1
+        if ofmsgs and self.flow_table_depth == 0:
+            ofmsgs = self.flow_table.filter_ofmsgs(ofmsgs, self.clock())
+        return ofmsgs
+    return __filter
 
 
 def valve_factory(dp):
@@ -82,10 +127,44 @@ class Valve(object):
 
     FAUCET_MAC = '0e:00:00:00:00:01'
 
+    # request host flow stats when a host table is this full.
+    TABLE_USAGE_THRESHOLD = 0.75
+    # and no more often than this (seconds).
+    HOST_USAGE_INTERVAL = 30
+    # connect from scratch if the flows requested to reconcile a datapath
+    # haven't arrived after this long (seconds).
+    RECONCILE_TIMEOUT = 30
+    # max_host_moves is the number of moves allowed in this many seconds.
+    HOST_MOVE_INTERVAL = 60
+
     def __init__(self, dp, logname='faucet', *args, **kwargs):
         self.dp = dp
-        self.logger = logging.getLogger(logname)
+        self.logname = logname
+        self.logger = logging.getLogger(logname + '.valve')
+        # host learning and expiry, and routing, log a lot and so can have
+        # their own levels.
+        self.learn_logger = logging.getLogger(logname + '.valve.learn')
+        self.route_logger = logging.getLogger(logname + '.valve.route')
         self.ofchannel_logger = None
+        self.snapshot_writer = None
+        # the source of the current time, which a journal replay sets to the
+        # time each input was recorded.
+        self.clock = time.time
+        self.flow_table = ValveFlowTable()
+        self.flow_table_depth = 0
+        self.reconcile_port_nums = None
+        self.reconcile_groups = None
+        self.reconcile_time = None
+        self.snapshot_time = self.clock()
+        # the snapshot is restored only on the first connect after FAUCET
+        # starts, as the caches are newer after that.
+        self.snapshot_restored = False
+        # flow table capacities reported by the datapath, by table_id.
+        self.table_features_capacity = {}
+        # learned hosts that may be evicted, least recently used first,
+        # by (vid, eth_src).
+        self.host_lru = OrderedDict()
+        self.host_usage_time = 0
 
     def switch_features(self, dp_id, msg):
         """Send configuration flows necessary for the switch implementation.
@@ -94,27 +173,70 @@ class Valve(object):
         dp_id -- the Datapath unique ID (64bit int)
         msg -- OFPSwitchFeatures msg sent from switch.
 
-        Vendor specific configuration should be implemented here.
+        Vendor specific configuration should be implemented here. If
+        request_table_features is configured, the table features are
+        requested, for their capacities.
         """
-        return []
+        ofmsgs = self.switch_config()
+        if self.dp.request_table_features:
+            ofmsgs.append(parser.OFPTableFeaturesStatsRequest(datapath=None))
+        return ofmsgs
+
+    def switch_config(self):
+        """Return a set config message if miss_send_len is configured."""
+        if self.dp.miss_send_len is None:
+            return []
+        return [parser.OFPSetConfig(
+            datapath=None,
+            flags=ofp.OFPC_FRAG_NORMAL,
+            miss_send_len=self.dp.miss_send_len)]
+
+    def table_features(self, dp_id, table_features):
+        """Record the capacity of each table from a table features reply.
 
-    def ofchannel_log(self, flowmods):
+        Arguments:
+        dp_id -- the Datapath unique ID (64bit int)
+        table_features -- a list of OFPTableFeaturesStats."""
+        if self.ignore_dpid(dp_id):
+            return
+        for table_feature in table_features:
+            if table_feature.table_id in self.all_valve_tables():
+                self.table_features_capacity[table_feature.table_id] = (
+                    table_feature.max_entries)
+
+    def table_capacity(self, table_id):
+        """Return the maximum number of flows in a table, or None if unknown.
+
+        Sizes in the config override those reported by the datapath."""
+        if table_id in self.dp.table_sizes:
+            return self.dp.table_sizes[table_id]
+        return self.table_features_capacity.get(table_id, None)
+
+    def host_tables_full(self, threshold=1.0):
+        """Return True if either host table is at threshold of capacity."""
+        for table_id in (self.dp.eth_src_table, self.dp.eth_dst_table):
+            capacity = self.table_capacity(table_id)
+            if (capacity is not None and
+                    self.flow_table.entries(table_id) >= capacity * threshold):
+                return True
+        return False
+
+    def ofchannel_log(self, ofmsgs, received=False):
+        """Log the wire bytes of OpenFlow messages, if ofchannel_log is set.
+
+        Sent messages must already have been serialized (by sending them).
+        Logging is done by a separate thread, see ofchannel.py."""
         if self.dp is not None:
             if self.dp.ofchannel_log is not None:
                 if self.ofchannel_logger is None:
-                    self.ofchannel_logger = logging.getLogger(
-                        self.dp.ofchannel_log)
-                    logger_handler = TimedRotatingFileHandler(
-                        self.dp.ofchannel_log,
-                        when='midnight')
-                    log_fmt = '%(asctime)s %(name)-6s %(levelname)-8s %(message)s'
-                    logger_handler.setFormatter(
-                        logging.Formatter(log_fmt, '%b %d %H:%M:%S'))
-                    self.ofchannel_logger.addHandler(logger_handler)
-                    self.ofchannel_logger.propagate = 0
-                    self.ofchannel_logger.setLevel(logging.DEBUG)
-                for flowmod in flowmods:
-                    self.ofchannel_logger.debug(flowmod)
+                    self.ofchannel_logger = OFChannelLogWriter(
+                        self.dp.ofchannel_log, self.logname)
+                direction = SENT
+                if received:
+                    direction = RECEIVED
+                for ofmsg in ofmsgs:
+                    if ofmsg.buf is not None:
+                        self.ofchannel_logger.log(direction, str(ofmsg.buf))
 
     @staticmethod
     def ignore_port(port_num):
@@ -143,14 +265,19 @@ class Valve(object):
         return parser.OFPActionDecNwTtl()
 
     @staticmethod
-    def valve_packetout(out_port, data):
+    def valve_packetout_ports(out_ports, data):
+        """Return a packet out sending data to each of out_ports."""
         return parser.OFPPacketOut(
             datapath=None,
             buffer_id=ofp.OFP_NO_BUFFER,
             in_port=ofp.OFPP_CONTROLLER,
-            actions=[parser.OFPActionOutput(out_port, 0)],
+            actions=[
+                parser.OFPActionOutput(out_port, 0) for out_port in out_ports],
             data=data)
 
+    def valve_packetout(self, out_port, data):
+        return self.valve_packetout_ports([out_port], data)
+
     @staticmethod
     def valve_in_match(in_port=None, vlan=None,
                        eth_type=None, eth_src=None,
@@ -209,10 +336,46 @@ class Valve(object):
             self.dp.eth_dst_table,
             self.dp.flood_table)
 
+    def valve_cookie(self, owner=None, vid=0, port_num=0):
+        """Return the cookie for a flow belonging to owner, see cookie.py."""
+        if owner is None:
+            return flow_cookie(self.dp.cookie)
+        return flow_cookie(self.dp.cookie, owner, vid, port_num)
+
+    def owns_cookie(self, cookie):
+        """Return True if cookie is one of FAUCET's flow cookies."""
+        base_cookie, base_mask = owner_cookie(self.dp.cookie)
+        return cookie & base_mask == base_cookie
+
+    def packet_in_owner(self, cookie):
+        """Return the owner type of the flow that sent a packet-in, which
+        says what the packet was sent for, or None if unknown."""
+        if cookie is None or not self.owns_cookie(cookie):
+            return None
+        return cookie_owner(cookie)
+
+    def parse_packet_in(self, data, cookie=None):
+        """Return a Packet from the data of a packet-in.
+
+        Packets sent only to learn their source need just their Ethernet
+        and VLAN headers parsed."""
+        if self.packet_in_owner(cookie) != OWNER_LEARN:
+            return packet.Packet(data)
+        pkt = packet.Packet()
+        eth_pkt, _, rest = ethernet.ethernet.parser(data)
+        pkt.add_protocol(eth_pkt)
+        if eth_pkt.ethertype == ether.ETH_TYPE_8021Q:
+            vlan_pkt, _, _ = packet_vlan.vlan.parser(rest)
+            pkt.add_protocol(vlan_pkt)
+        return pkt
+
     def valve_flowmod(self, table_id, match=None, priority=None,
                       inst=None, command=ofp.OFPFC_ADD, out_port=0,
-                      out_group=0, hard_timeout=0, idle_timeout=0):
+                      out_group=0, hard_timeout=0, idle_timeout=0, flags=0,
+                      cookie=None, cookie_mask=0):
         """Helper function to construct a flow mod message with cookie."""
+        if cookie is None:
+            cookie = self.valve_cookie()
         if match is None:
             match = self.valve_in_match()
         if priority is None:
@@ -221,7 +384,8 @@ class Valve(object):
             inst = []
         return parser.OFPFlowMod(
             datapath=None,
-            cookie=self.dp.cookie,
+            cookie=cookie,
+            cookie_mask=cookie_mask,
             command=command,
             table_id=table_id,
             priority=priority,
@@ -230,10 +394,11 @@ class Valve(object):
             match=match,
             instructions=inst,
             hard_timeout=hard_timeout,
-            idle_timeout=idle_timeout)
+            idle_timeout=idle_timeout,
+            flags=flags)
 
     def valve_flowdel(self, table_id, match=None, priority=None,
-                      out_port=ofp.OFPP_ANY):
+                      out_port=ofp.OFPP_ANY, cookie=None, cookie_mask=0):
         """Delete matching flows from a table."""
         return self.valve_flowmod(
             table_id,
@@ -241,36 +406,81 @@ class Valve(object):
             priority=priority,
             command=ofp.OFPFC_DELETE,
             out_port=out_port,
-            out_group=ofp.OFPG_ANY)
+            out_group=ofp.OFPG_ANY,
+            cookie=cookie,
+            cookie_mask=cookie_mask)
+
+    def valve_flowdel_owner(self, owner=None, vid=None, port_num=None,
+                            table_id=ofp.OFPTT_ALL, match=None):
+        """Delete the flows belonging to owner, vid and port_num (any owner,
+        VLAN or port if None), from all tables by default."""
+        cookie, cookie_mask = owner_cookie(
+            self.dp.cookie, owner, vid, port_num)
+        return self.valve_flowdel(
+            table_id, match=match, cookie=cookie, cookie_mask=cookie_mask)
+
+    def valve_flowdel_port(self, port_num, keep_hosts=False):
+        """Delete the flows belonging to port_num, from all tables. With
+        keep_hosts, the flows of hosts learned on the port are kept.
+
+        Ports too large to be recorded in cookies have their flows deleted
+        by in_port from each table instead, as they all match in_port."""
+        if port_in_cookie(port_num):
+            if keep_hosts:
+                return [
+                    self.valve_flowdel_owner(owner, port_num=port_num)
+                    for owner in (OWNER_PORT, OWNER_ACL)]
+            return [self.valve_flowdel_owner(port_num=port_num)]
+        table_ids = self.all_valve_tables()
+        if keep_hosts:
+            # only learned hosts' flows match in_port in the eth_src table.
+            table_ids = [
+                table_id for table_id in table_ids
+                if table_id != self.dp.eth_src_table]
+        return [
+            self.valve_flowdel(table_id, self.valve_in_match(in_port=port_num))
+            for table_id in table_ids]
 
     def valve_flowdrop(self, table_id, match=None, priority=None,
-                       hard_timeout=0):
+                       hard_timeout=0, cookie=None):
         """Add drop matching flow to a table."""
         return self.valve_flowmod(
             table_id,
             match=match,
             priority=priority,
             hard_timeout=hard_timeout,
-            inst=[])
+            inst=[],
+            cookie=cookie)
 
     def valve_flowcontroller(self, table_id, match=None, priority=None,
-                             inst=None):
+                             inst=None, cookie=None, max_len=256):
         if inst is None:
             inst = []
         return self.valve_flowmod(
             table_id,
             match=match,
             priority=priority,
+            cookie=cookie,
             inst=[self.apply_actions([parser.OFPActionOutput(
-                ofp.OFPP_CONTROLLER, max_len=256)])] + inst)
+                ofp.OFPP_CONTROLLER, max_len=max_len)])] + inst)
 
     def delete_all_valve_flows(self):
         """Delete all flows from all FAUCET tables."""
         ofmsgs = []
         for table_id in self.all_valve_tables():
             ofmsgs.append(self.valve_flowdel(table_id))
+        if self.dp.group_table:
+            ofmsgs.append(self.valve_groupdel(ofp.OFPG_ALL))
         return ofmsgs
 
+    @staticmethod
+    def valve_groupdel(group_id):
+        return parser.OFPGroupMod(
+            datapath=None,
+            command=ofp.OFPGC_DELETE,
+            type_=ofp.OFPGT_ALL,
+            group_id=group_id)
+
     def add_default_drop_flows(self):
         """Add default drop rules on all FAUCET tables."""
 
@@ -317,11 +527,17 @@ class Valve(object):
             inst=[self.goto_table(self.dp.flood_table)])]
 
     def add_controller_learn_flow(self):
-        """Add a flow for controller to learn and add flows for destinations."""
+        """Add a flow for controller to learn and add flows for destinations.
+
+        Only the first packet_in_max_len bytes of each packet are sent, since
+        learning needs only the Ethernet and VLAN headers, and the packet
+        itself continues through the pipeline."""
         return [self.valve_flowcontroller(
             self.dp.eth_src_table,
             priority=self.dp.low_priority,
-            inst=[self.goto_table(self.dp.eth_dst_table)])]
+            inst=[self.goto_table(self.dp.eth_dst_table)],
+            cookie=self.valve_cookie(OWNER_LEARN),
+            max_len=self.dp.packet_in_max_len)]
 
     def add_default_flows(self):
         """Configure datapath with necessary default tables and rules."""
@@ -375,7 +591,41 @@ class Valve(object):
             ports.append(port)
         return ports
 
+    @staticmethod
+    def flood_group_id(vlan, eth_dst):
+        """Return the ID of the group to flood packets to eth_dst on a VLAN.
+
+        Unicast destinations are not flooded to ports without unicast_flood,
+        so there are two groups per VLAN."""
+        if eth_dst is None or mac_addr_is_unicast(eth_dst):
+            return vlan.vid + ofp.OFPVID_PRESENT
+        return vlan.vid
+
+    def build_flood_group(self, vlan, eth_dst):
+        """Return an ALL group to flood packets to eth_dst on a VLAN.
+
+        Tagged ports have a bucket that just outputs, and untagged ports a
+        bucket that pops the VLAN tag first."""
+        buckets = []
+        tagged_ports = self.build_flood_ports_for_vlan(vlan.tagged, eth_dst)
+        for port in tagged_ports:
+            buckets.append(parser.OFPBucket(
+                actions=[parser.OFPActionOutput(port.number)]))
+        untagged_ports = self.build_flood_ports_for_vlan(vlan.untagged, eth_dst)
+        for port in untagged_ports:
+            buckets.append(parser.OFPBucket(actions=[
+                parser.OFPActionPopVlan(),
+                parser.OFPActionOutput(port.number)]))
+        return parser.OFPGroupMod(
+            datapath=None,
+            command=ofp.OFPGC_ADD,
+            type_=ofp.OFPGT_ALL,
+            group_id=self.flood_group_id(vlan, eth_dst),
+            buckets=buckets)
+
     def build_flood_rule_actions(self, vlan, eth_dst):
+        if self.dp.group_table:
+            return [parser.OFPActionGroup(self.flood_group_id(vlan, eth_dst))]
         flood_acts = []
         tagged_ports = self.build_flood_ports_for_vlan(vlan.tagged, eth_dst)
         for port in tagged_ports:
@@ -403,6 +653,15 @@ class Valve(object):
             (mac.BROADCAST_STR, None), # flood on ethernet broadcasts
         ])
         ofmsgs = []
+        if self.dp.group_table:
+            # the groups must exist before flows that use them. Flows are
+            # unchanged when ports change, as only the groups are modified.
+            group_ids = set()
+            for eth_dst, _ in flood_eth_dst_matches:
+                group_id = self.flood_group_id(vlan, eth_dst)
+                if group_id not in group_ids:
+                    group_ids.add(group_id)
+                    ofmsgs.append(self.build_flood_group(vlan, eth_dst))
         for eth_dst, eth_dst_mask in flood_eth_dst_matches:
             flood_acts = self.build_flood_rule_actions(vlan, eth_dst)
             ofmsgs.append(self.valve_flowmod(
@@ -411,14 +670,16 @@ class Valve(object):
                     vlan=vlan, eth_dst=eth_dst, eth_dst_mask=eth_dst_mask),
                 command=command,
                 inst=[self.apply_actions(flood_acts)],
-                priority=flood_priority))
+                priority=flood_priority,
+                cookie=self.valve_cookie(OWNER_VLAN, vlan.vid)))
             flood_priority += 1
         for port in vlan.tagged + vlan.untagged:
             if port.number in self.dp.mirror_from_port:
                 mirror_port = self.dp.mirror_from_port[port.number]
-                mirror_acts = [parser.OFPActionOutput(mirror_port)] + flood_acts
                 for eth_dst, eth_dst_mask in flood_eth_dst_matches:
                     flood_acts = self.build_flood_rule_actions(vlan, eth_dst)
+                    mirror_acts = [
+                        parser.OFPActionOutput(mirror_port)] + flood_acts
                     ofmsgs.append(self.valve_flowmod(
                         self.dp.flood_table,
                         match=self.valve_in_match(
@@ -426,10 +687,13 @@ class Valve(object):
                             eth_dst=eth_dst, eth_dst_mask=eth_dst_mask),
                         command=command,
                         inst=[self.apply_actions(mirror_acts)],
-                        priority=flood_priority))
+                        priority=flood_priority,
+                        cookie=self.valve_cookie(
+                            OWNER_PORT, vlan.vid, port.number)))
                     flood_priority += 1
         return ofmsgs
 
+    @filter_by_flow_table
     def datapath_connect(self, dp_id, discovered_port_nums):
         """Generate the default openflow msgs for a datapath upon connection.
 
@@ -453,13 +717,194 @@ class Valve(object):
         ofmsgs = []
         ofmsgs.extend(self.add_default_flows())
         ofmsgs.extend(self.add_ports_and_vlans(discovered_port_nums))
+        self.restore_snapshot()
+        ofmsgs.extend(self.learned_host_flows())
+        ofmsgs.extend(self.resolved_route_flows())
         self.dp.running = True
         return ofmsgs
 
+    def valve_flowstats_request(self, table_id=ofp.OFPTT_ALL, owner=None):
+        """Request flows with FAUCET's cookie (belonging to owner, if not
+        None), from all tables by default."""
+        cookie, cookie_mask = owner_cookie(self.dp.cookie, owner)
+        return parser.OFPFlowStatsRequest(
+            datapath=None,
+            table_id=table_id,
+            out_port=ofp.OFPP_ANY,
+            out_group=ofp.OFPG_ANY,
+            cookie=cookie,
+            cookie_mask=cookie_mask)
+
+    @filter_by_flow_table
+    def datapath_reconnect(self, dp_id, discovered_port_nums):
+        """Generate openflow msgs for a datapath that has connected again.
+
+        If this datapath was already configured and warm_reconnect is set,
+        its flows are requested for datapath_reconcile(), rather than
+        deleting and reinstalling all flows (which would flush learned hosts).
+
+        Arguments:
+        dp_id -- the Datapath unique ID (64bit int)
+        discovered_port_nums -- a list containing the port numbers of each
+            port on the datapath.
+
+        Returns:
+        A list of openflow msgs to send to the datapath."""
+        if self.ignore_dpid(dp_id):
+            return []
+        if not (self.dp.running and self.dp.warm_reconnect):
+            return self.datapath_connect(dp_id, discovered_port_nums)
+        self.logger.info('Requesting flows to reconcile datapath')
+        self.reconcile_port_nums = discovered_port_nums
+        self.reconcile_time = self.clock()
+        ofmsgs = []
+        if self.dp.group_table:
+            # the barrier makes sure the groups arrive before the flows.
+            self.reconcile_groups = {}
+            ofmsgs.append(parser.OFPGroupDescStatsRequest(None))
+            ofmsgs.append(parser.OFPBarrierRequest(None))
+        ofmsgs.append(self.valve_flowstats_request())
+        return ofmsgs
+
+    def group_desc(self, dp_id, group_descs):
+        """Record the groups on a datapath being reconciled.
+
+        Arguments:
+        dp_id -- the Datapath unique ID (64bit int)
+        group_descs -- OFPGroupDescStats requested by datapath_reconnect()."""
+        if self.ignore_dpid(dp_id) or self.reconcile_groups is None:
+            return
+        for group_desc in group_descs:
+            self.reconcile_groups[group_desc.group_id] = buckets_key(
+                group_desc.buckets)
+
+    def datapath_reconcile(self, dp_id, flow_stats):
+        """Generate openflow msgs to correct the flows on a datapath.
+
+        The flows Valve would install on connect are compared with the
+        flows on the datapath, requested by datapath_reconnect(). Flows that
+        are missing or differ are added, and flows that aren't expected are
+        deleted, except for timed (learned host) flows which are kept.
+        Permanently learned hosts' flows have no timeout, so are expected.
+
+        Arguments:
+        dp_id -- the Datapath unique ID (64bit int)
+        flow_stats -- OFPFlowStats for all FAUCET's flows on the datapath.
+
+        Returns:
+        A list of openflow msgs to send to the datapath."""
+        if self.ignore_dpid(dp_id) or self.reconcile_port_nums is None:
+            return []
+        discovered_port_nums = self.reconcile_port_nums
+        self.reconcile_port_nums = None
+        self.reconcile_time = None
+
+        # build a model of the flows we would install on connect, without
+        # filtering against (or updating) the current model.
+        self.flow_table_depth += 1
+        try:
+            connect_ofmsgs = (
+                self.add_default_flows() +
+                self.add_ports_and_vlans(discovered_port_nums) +
+                self.learned_host_flows(permanent_only=True) +
+                self.resolved_route_flows())
+        finally:
+            self.flow_table_depth -= 1
+        now = self.clock()
+        expected_table = ValveFlowTable()
+        expected_ofmsgs = expected_table.filter_ofmsgs(connect_ofmsgs, now)
+        expected_flowmods = {}
+        for ofmsg in expected_ofmsgs:
+            if (isinstance(ofmsg, parser.OFPFlowMod) and
+                    ofmsg.command == ofp.OFPFC_ADD):
+                expected_flowmods[(
+                    ofmsg.table_id,
+                    (ofmsg.priority, match_key(ofmsg.match)))] = ofmsg
+
+        ofmsgs = []
+        # groups must be correct before flows that use them.
+        deleted_group_ids = []
+        if self.reconcile_groups is not None:
+            for group_id, (key, group_mod) in expected_table.groups.items():
+                current = self.reconcile_groups.get(group_id, None)
+                if current is None:
+                    ofmsgs.append(group_mod)
+                elif current != key:
+                    ofmsgs.append(parser.OFPGroupMod(
+                        datapath=None,
+                        command=ofp.OFPGC_MODIFY,
+                        type_=group_mod.type,
+                        group_id=group_id,
+                        buckets=group_mod.buckets))
+            deleted_group_ids = [
+                group_id for group_id in self.reconcile_groups
+                if group_id not in expected_table.groups]
+            self.reconcile_groups = None
+        learned_hosts = set()
+        for flow_stat in flow_stats:
+            if (flow_stat.table_id == self.dp.eth_src_table and
+                    flow_stat.hard_timeout):
+                learned_hosts.add((
+                    flow_stat.match.get('vlan_vid', None),
+                    flow_stat.match.get('eth_src', None)))
+            key = (flow_stat.priority, match_key(flow_stat.match))
+            table_key = (flow_stat.table_id, key)
+            if table_key in expected_flowmods:
+                entry = expected_table.tables[flow_stat.table_id][key]
+                if entry.same_flow(
+                        flow_stat, instructions_key(flow_stat.instructions)):
+                    del expected_flowmods[table_key]
+            elif flow_stat.hard_timeout or flow_stat.idle_timeout:
+                # keep learned flows, and remember them.
+                expected_table.insert(
+                    flow_stat.table_id, key,
+                    FlowEntry(flow_stat, now - flow_stat.duration_sec))
+            else:
+                ofmsgs.append(self.valve_flowmod(
+                    flow_stat.table_id,
+                    match=flow_stat.match,
+                    priority=flow_stat.priority,
+                    command=ofp.OFPFC_DELETE_STRICT,
+                    out_port=ofp.OFPP_ANY,
+                    out_group=ofp.OFPG_ANY))
+        # add flows that are missing or differ, in the order we generated them.
+        for ofmsg in expected_ofmsgs:
+            if isinstance(ofmsg, parser.OFPFlowMod):
+                table_key = (
+                    ofmsg.table_id, (ofmsg.priority, match_key(ofmsg.match)))
+                if expected_flowmods.get(table_key, None) is ofmsg:
+                    ofmsgs.append(ofmsg)
+
+        for group_id in deleted_group_ids:
+            ofmsgs.append(self.valve_groupdel(group_id))
+
+        # flows removed while we were disconnected were not reported.
+        for vlan in self.dp.vlans.itervalues():
+            vlan_vid = vlan.vid | ofp.OFPVID_PRESENT
+            for eth_src, host_cache_entry in vlan.host_cache.items():
+                if (not host_cache_entry.permanent and
+                        (vlan_vid, eth_src) not in learned_hosts):
+                    self.expire_host(vlan, eth_src)
+
+        self.logger.info(
+            'Reconciled datapath: %u flows found, %u corrections',
+            len(flow_stats), len(ofmsgs))
+        self.flow_table = expected_table
+        self.dp.running = True
+        return ofmsgs
+
+    def cancel_reconcile(self):
+        """Stop waiting for the flows requested by datapath_reconnect()."""
+        self.reconcile_port_nums = None
+        self.reconcile_groups = None
+        self.reconcile_time = None
+
     def datapath_disconnect(self, dp_id):
         """Update n/w state db upon disconnection of datapath with id dp_id."""
         if not self.ignore_dpid(dp_id):
             self.logger.critical('Datapath disconnected')
+            # the flows requested won't arrive.
+            self.cancel_reconcile()
         return []
 
     def datapath_down(self, dp_id):
@@ -504,12 +949,16 @@ class Valve(object):
                     self.dp.acl_table,
                     acl_match,
                     priority=acl_rule_priority,
-                    inst=acl_inst))
+                    inst=acl_inst,
+                    cookie=self.valve_cookie(OWNER_ACL, port_num=port_num)))
                 acl_rule_priority -= 1
         return ofmsgs, forwarding_table
 
     def add_controller_ips(self, controller_ips, vlan):
         ofmsgs = []
+        arp_cookie = self.valve_cookie(OWNER_CONTROLLER_ARP, vlan.vid)
+        icmp_cookie = self.valve_cookie(OWNER_CONTROLLER_ICMP, vlan.vid)
+        icmpv6_cookie = self.valve_cookie(OWNER_CONTROLLER_ICMPV6, vlan.vid)
         for controller_ip in controller_ips:
             controller_ip_host = ipaddr.IPNetwork(
                 '/'.join((str(controller_ip.ip),
@@ -521,7 +970,8 @@ class Valve(object):
                          eth_type=ether.ETH_TYPE_ARP,
                          nw_dst=controller_ip_host,
                          vlan=vlan),
-                    priority=self.dp.highest_priority))
+                    priority=self.dp.highest_priority,
+                    cookie=arp_cookie))
                 ofmsgs.append(self.valve_flowcontroller(
                     self.dp.eth_src_table,
                     self.valve_in_match(
@@ -531,7 +981,8 @@ class Valve(object):
                         nw_proto=inet.IPPROTO_ICMP,
                         nw_src=controller_ip,
                         nw_dst=controller_ip_host),
-                    priority=self.dp.highest_priority))
+                    priority=self.dp.highest_priority,
+                    cookie=icmp_cookie))
             else:
                 ofmsgs.append(self.valve_flowcontroller(
                     self.dp.eth_src_table,
@@ -541,7 +992,8 @@ class Valve(object):
                          nw_proto=inet.IPPROTO_ICMPV6,
                          ipv6_nd_target=controller_ip_host,
                          icmpv6_type=icmpv6.ND_NEIGHBOR_SOLICIT),
-                    priority=self.dp.highest_priority))
+                    priority=self.dp.highest_priority,
+                    cookie=icmpv6_cookie))
                 ofmsgs.append(self.valve_flowcontroller(
                     self.dp.eth_src_table,
                     self.valve_in_match(
@@ -550,7 +1002,8 @@ class Valve(object):
                          vlan=vlan,
                          nw_proto=inet.IPPROTO_ICMPV6,
                          icmpv6_type=icmpv6.ND_NEIGHBOR_ADVERT),
-                    priority=self.dp.highest_priority))
+                    priority=self.dp.highest_priority,
+                    cookie=icmpv6_cookie))
                 ofmsgs.append(self.valve_flowcontroller(
                     self.dp.eth_src_table,
                     self.valve_in_match(
@@ -559,7 +1012,8 @@ class Valve(object):
                          nw_proto=inet.IPPROTO_ICMPV6,
                          nw_dst=controller_ip_host,
                          icmpv6_type=icmpv6.ICMPV6_ECHO_REQUEST),
-                    priority=self.dp.highest_priority))
+                    priority=self.dp.highest_priority,
+                    cookie=icmpv6_cookie))
         return ofmsgs
 
     def port_add_vlan_untagged(self, port, vlan, forwarding_table, mirror_act):
@@ -578,7 +1032,8 @@ class Valve(object):
             self.dp.vlan_table,
             self.valve_in_match(in_port=port.number, vlan=null_vlan),
             priority=self.dp.low_priority,
-            inst=push_vlan_inst))
+            inst=push_vlan_inst,
+            cookie=self.valve_cookie(OWNER_PORT, vlan.vid, port.number)))
         ofmsgs.extend(self.build_flood_rules(vlan))
         return ofmsgs
 
@@ -594,7 +1049,8 @@ class Valve(object):
             self.dp.vlan_table,
             self.valve_in_match(in_port=port.number, vlan=vlan),
             priority=self.dp.low_priority,
-            inst=vlan_inst))
+            inst=vlan_inst,
+            cookie=self.valve_cookie(OWNER_PORT, vlan.vid, port.number)))
         ofmsgs.extend(self.build_flood_rules(vlan))
         return ofmsgs
 
@@ -613,6 +1069,7 @@ class Valve(object):
                 port, vlan, forwarding_table, mirror_act))
         return ofmsgs
 
+    @filter_by_flow_table
     def port_add(self, dp_id, port_num):
         """Generate openflow msgs to update the datapath upon addition of port.
 
@@ -641,8 +1098,9 @@ class Valve(object):
         ofmsgs = []
         self.logger.info('Sending config for port {0}'.format(port))
 
-        for table in self.all_valve_tables():
-            ofmsgs.append(self.valve_flowdel(table, in_port_match))
+        # delete all the port's flows, in all tables, except those of hosts
+        # learned on the port, which are still valid.
+        ofmsgs.extend(self.valve_flowdel_port(port_num, keep_hosts=True))
 
         # if this port is used as mirror port in any acl - drop input packets
         for acl in self.dp.acls.values():
@@ -653,13 +1111,16 @@ class Valve(object):
                              port_no = attrib_value['mirror']
                              ofmsgs.append(self.valve_flowdrop(
                                  self.dp.vlan_table,
-                                 self.valve_in_match(in_port=port_no)))
+                                 self.valve_in_match(in_port=port_no),
+                                 cookie=self.valve_cookie(
+                                     OWNER_PORT, port_num=port_no)))
 
         if port_num in self.dp.mirror_from_port.values():
             # this is a mirror port - drop all input packets
             ofmsgs.append(self.valve_flowdrop(
                 self.dp.vlan_table,
-                in_port_match))
+                in_port_match,
+                cookie=self.valve_cookie(OWNER_PORT, port_num=port_num)))
             return ofmsgs
 
         mirror_act = []
@@ -673,6 +1134,7 @@ class Valve(object):
         ofmsgs.extend(self.port_add_vlans(port, forwarding_table, mirror_act))
         return ofmsgs
 
+    @filter_by_flow_table
     def port_delete(self, dp_id, port_num):
         """Generate openflow msgs to update the datapath upon deletion of port.
 
@@ -691,21 +1153,24 @@ class Valve(object):
 
         ofmsgs = []
 
-        # delete all rules matching this port in all tables.
-        for table in self.all_valve_tables():
-            ofmsgs.append(self.valve_flowdel(table,
-                self.valve_in_match(in_port=port_num)))
+        # delete all the port's flows (including its learned hosts' eth_src
+        # flows) in all tables.
+        ofmsgs.extend(self.valve_flowdel_port(port_num))
 
-        # delete eth_dst rules
+        # delete eth_dst rules, which move with their hosts so can't record
+        # the port in their cookie.
         ofmsgs.append(self.valve_flowdel(
             self.dp.eth_dst_table,
             out_port=port_num))
 
         ofmsgs.append(parser.OFPBarrierRequest(None))
 
+        # the hosts' flows are gone, so they won't be reported as expiring.
+        self.expire_port_hosts(port_num)
+
         for vlan in self.dp.vlans.values():
-            if port_num in vlan.tagged or port_num in vlan.untagged:
-                ofmsgs.extend(self.build_flood_rules(vlan), modify=True)
+            if vlan.contains_port(port_num):
+                ofmsgs.extend(self.build_flood_rules(vlan, modify=True))
 
         return ofmsgs
 
@@ -713,15 +1178,15 @@ class Valve(object):
         ofmsgs = []
         # delete any existing ofmsgs for this vlan/mac combination on the
         # src mac table
-        ofmsgs.append(self.valve_flowdel(
-            self.dp.eth_src_table,
-            self.valve_in_match(vlan=vlan, eth_src=eth_src)))
+        ofmsgs.append(self.valve_flowdel_owner(
+            OWNER_HOST, vlan.vid, table_id=self.dp.eth_src_table,
+            match=self.valve_in_match(vlan=vlan, eth_src=eth_src)))
 
         # delete any existing ofmsgs for this vlan/mac combination on the dst
         # mac table
-        ofmsgs.append(self.valve_flowdel(
-            self.dp.eth_dst_table,
-            self.valve_in_match(vlan=vlan, eth_dst=eth_src)))
+        ofmsgs.append(self.valve_flowdel_owner(
+            OWNER_HOST, vlan.vid, table_id=self.dp.eth_dst_table,
+            match=self.valve_in_match(vlan=vlan, eth_dst=eth_src)))
 
         ofmsgs.append(parser.OFPBarrierRequest(None))
         return ofmsgs
@@ -741,35 +1206,56 @@ class Valve(object):
             pkt.add_protocol(eth_pkt)
         return pkt
 
+    def resolved_route_match(self, eth_type, vlan, ip_dst):
+        return self.valve_in_match(
+            vlan=vlan, eth_type=eth_type,
+            nw_dst=ip_dst, eth_dst=self.FAUCET_MAC)
+
+    def resolved_route_flowmod(self, eth_type, vlan, ip_dst, eth_dst):
+        return self.valve_flowmod(
+            self.dp.eth_src_table,
+            self.resolved_route_match(eth_type, vlan, ip_dst),
+            priority=self.dp.highest_priority + 1,
+            cookie=self.valve_cookie(OWNER_ROUTE, vlan.vid),
+            inst=[self.apply_actions(
+                [self.set_eth_src(self.FAUCET_MAC),
+                 self.set_eth_dst(eth_dst),
+                 self.dec_ip_ttl()])] +
+                [self.goto_table(self.dp.eth_dst_table)])
+
+    def resolved_route_flows(self):
+        """Return flows for all routes with a resolved gateway."""
+        ofmsgs = []
+        for vlan in self.dp.vlans.itervalues():
+            for eth_type, routes, neighbor_cache in (
+                    (ether.ETH_TYPE_IP, vlan.ipv4_routes, vlan.arp_cache),
+                    (ether.ETH_TYPE_IPV6, vlan.ipv6_routes, vlan.nd_cache)):
+                for ip_dst, ip_gw in routes.iteritems():
+                    if ip_gw in neighbor_cache:
+                        ofmsgs.append(self.resolved_route_flowmod(
+                            eth_type, vlan, ip_dst,
+                            neighbor_cache[ip_gw].eth_src))
+        return ofmsgs
+
     def add_resolved_route(self, eth_type, vlan, neighbor_cache,
                            ip_gw, ip_dst, eth_dst, is_updated=None):
         ofmsgs = []
         if is_updated is not None:
-            in_match = self.valve_in_match(
-                vlan=vlan, eth_type=eth_type,
-                nw_dst=ip_dst, eth_dst=self.FAUCET_MAC)
-            priority = self.dp.highest_priority + 1
             if is_updated:
-                self.logger.info('Updating next hop for route %s via %s (%s)',
-                        ip_dst, ip_gw, eth_dst)
+                self.route_logger.info(
+                    'Updating next hop for route %s via %s (%s)',
+                    ip_dst, ip_gw, eth_dst)
                 ofmsgs.append(self.valve_flowdel(
                     self.dp.eth_src_table,
-                    in_match,
-                    priority=priority))
+                    self.resolved_route_match(eth_type, vlan, ip_dst),
+                    priority=self.dp.highest_priority + 1))
             else:
-                self.logger.info('Adding new route %s via %s (%s)',
+                self.route_logger.info('Adding new route %s via %s (%s)',
                         ip_dst, ip_gw, eth_dst)
 
-            ofmsgs.append(self.valve_flowmod(
-                self.dp.eth_src_table,
-                in_match,
-                priority=priority,
-                inst=[self.apply_actions(
-                    [self.set_eth_src(self.FAUCET_MAC),
-                     self.set_eth_dst(eth_dst),
-                     self.dec_ip_ttl()])] +
-                    [self.goto_table(self.dp.eth_dst_table)]))
-        now = time.time()
+            ofmsgs.append(self.resolved_route_flowmod(
+                eth_type, vlan, ip_dst, eth_dst))
+        now = self.clock()
         link_neighbor = LinkNeighbor(eth_dst, now)
         neighbor_cache[ip_gw] = link_neighbor
         return ofmsgs
@@ -786,11 +1272,12 @@ class Valve(object):
             pkt.add_protocol(arp_pkt)
             pkt.serialize()
             ofmsgs.append(self.valve_packetout(in_port, pkt.data))
-            self.logger.info('Responded to ARP request for %s from %s',
+            self.route_logger.info('Responded to ARP request for %s from %s',
                 arp_pkt.src_ip, arp_pkt.dst_ip)
         elif arp_pkt.opcode == arp.ARP_REPLY:
             resolved_ip_gw = ipaddr.IPv4Address(arp_pkt.src_ip)
-            self.logger.info('ARP response %s for %s', eth_src, resolved_ip_gw)
+            self.route_logger.info(
+                'ARP response %s for %s', eth_src, resolved_ip_gw)
             is_updated = None
             if resolved_ip_gw in vlan.arp_cache:
                 cached_eth_dst = vlan.arp_cache[resolved_ip_gw].eth_src
@@ -852,7 +1339,8 @@ class Valve(object):
             flowmods.extend([self.valve_packetout(in_port, pkt.data)])
         elif icmpv6_pkt.type_ == icmpv6.ND_NEIGHBOR_ADVERT:
             resolved_ip_gw = ipaddr.IPv6Address(icmpv6_pkt.data.dst)
-            self.logger.info('ND response %s for %s', eth_src, resolved_ip_gw)
+            self.route_logger.info(
+                'ND response %s for %s', eth_src, resolved_ip_gw)
             is_updated = None
             if resolved_ip_gw in vlan.nd_cache:
                 cached_eth_dst = vlan.nd_cache[resolved_ip_gw].eth_src
@@ -893,9 +1381,16 @@ class Valve(object):
                 return True
         return False
 
-    def learn_host_on_vlan_port(self, port, vlan, eth_src):
+    def learn_host_on_vlan_port(self, port, vlan, eth_src,
+                                learn_timeout=None, old_port_num=None):
+        """Return flows to learn eth_src on port.
+
+        If the host has moved from old_port_num, its eth_dst flow is
+        modified in place to output to the new port, so there is no window
+        in which packets to the host are dropped or flooded."""
         ofmsgs = []
         in_port = port.number
+        eth_dst_command = ofp.OFPFC_ADD
 
         # hosts learned on this port never relearned
         if port.permanent_learn:
@@ -905,10 +1400,28 @@ class Valve(object):
             ofmsgs.append(self.valve_flowdrop(
                 self.dp.eth_src_table,
                 self.valve_in_match(vlan=vlan, eth_src=eth_src),
-                priority=(self.dp.highest_priority-2)))
+                priority=(self.dp.highest_priority-2),
+                cookie=self.valve_cookie(OWNER_HOST, vlan.vid, in_port)))
         else:
-            learn_timeout = self.dp.timeout
-            ofmsgs.extend(self.delete_host_from_vlan(eth_src, vlan))
+            if learn_timeout is None:
+                learn_timeout = self.host_learn_timeout()
+            if old_port_num is not None:
+                ofmsgs.append(self.valve_flowmod(
+                    self.dp.eth_src_table,
+                    self.valve_in_match(
+                        in_port=old_port_num, vlan=vlan, eth_src=eth_src),
+                    priority=self.dp.highest_priority-1,
+                    command=ofp.OFPFC_DELETE_STRICT,
+                    out_port=ofp.OFPP_ANY,
+                    out_group=ofp.OFPG_ANY))
+                # the eth_dst flow may have idle timed out.
+                if self.flow_table.installed(
+                        self.dp.eth_dst_table, self.dp.high_priority,
+                        self.valve_in_match(vlan=vlan, eth_dst=eth_src),
+                        self.clock()):
+                    eth_dst_command = ofp.OFPFC_MODIFY_STRICT
+            elif eth_src not in vlan.host_cache:
+                ofmsgs.extend(self.delete_host_from_vlan(eth_src, vlan))
 
         mirror_acts = []
         if in_port in self.dp.mirror_from_port:
@@ -923,12 +1436,19 @@ class Valve(object):
         # will flood packets to that dst and not realise it needs to relearn
         # the rule
         # NB: Must be lower than highest priority otherwise it can match flows destined to controller
+        # The switch tells us when the source rule times out, so we can expire
+        # the host at the same time (see flow_removed()).
+        flags = 0
+        if learn_timeout:
+            flags = ofp.OFPFF_SEND_FLOW_REM
         ofmsgs.append(self.valve_flowmod(
             self.dp.eth_src_table,
             self.valve_in_match(in_port=in_port, vlan=vlan, eth_src=eth_src),
             priority=self.dp.highest_priority-1,
             inst=[self.goto_table(self.dp.eth_dst_table)],
-            hard_timeout=learn_timeout))
+            hard_timeout=learn_timeout,
+            flags=flags,
+            cookie=self.valve_cookie(OWNER_HOST, vlan.vid, in_port)))
 
         # update datapath to output packets to this mac via the associated port
         if vlan.port_is_tagged(in_port):
@@ -940,20 +1460,74 @@ class Valve(object):
         if mirror_acts:
             dst_act.extend(mirror_acts)
         inst = [self.apply_actions(dst_act)]
-        ofmsgs.append(self.valve_flowmod(
+        eth_dst_flowmod = self.valve_flowmod(
             self.dp.eth_dst_table,
             self.valve_in_match(vlan=vlan, eth_dst=eth_src),
             priority=self.dp.high_priority,
             inst=inst,
-            idle_timeout=learn_timeout))
+            command=eth_dst_command,
+            idle_timeout=learn_timeout,
+            flags=flags,
+            cookie=self.valve_cookie(OWNER_HOST, vlan.vid))
+        if eth_dst_command == ofp.OFPFC_MODIFY_STRICT:
+            # redirect packets to the host before removing the old source
+            # flow, so the host is never unreachable.
+            ofmsgs.insert(0, eth_dst_flowmod)
+        else:
+            ofmsgs.append(eth_dst_flowmod)
         return ofmsgs
 
-    def handle_control_plane(self, in_port, vlan, eth_src, eth_dst, pkt):
+    def host_learn_timeout(self):
+        """Return the timeout for a learned host's flows.
+
+        Up to learn_jitter seconds are taken off the timeout at random, so
+        hosts learned at the same time (eg. after a restart) don't all
+        expire, and send packet-ins to be relearned, at the same time."""
+        if not self.dp.learn_jitter:
+            return self.dp.timeout
+        jitter = min(self.dp.learn_jitter, self.dp.timeout - 1)
+        return self.dp.timeout - random.randint(0, jitter)
+
+    def host_moved(self, vlan, host_cache_entry, in_port, now):
+        """Count a host moving to in_port.
+
+        Returns:
+        True if the host has moved more than max_host_moves times in
+        HOST_MOVE_INTERVAL, and so should be held on its current port."""
+        host_cache_entry.moves += 1
+        vlan.host_moves += 1
+        self.learn_logger.info(
+            'host %s moved from port %u to port %u on vlan %u',
+            host_cache_entry.eth_src, host_cache_entry.port_num, in_port,
+            vlan.vid)
+        if self.dp.max_host_moves is None:
+            return False
+        if now - host_cache_entry.move_window_start > self.HOST_MOVE_INTERVAL:
+            host_cache_entry.move_window_start = now
+            host_cache_entry.window_moves = 0
+        host_cache_entry.window_moves += 1
+        return host_cache_entry.window_moves > self.dp.max_host_moves
+
+    def handle_control_plane(self, in_port, vlan, eth_src, eth_dst, pkt,
+                             owner=None):
+        """Handle a packet for FAUCET itself (eg. ARP for a controller IP).
+
+        owner is the owner type of the flow that sent the packet, which
+        says which protocol it is, or None to look at the packet."""
         flowmods = []
+        if owner == OWNER_LEARN:
+            # sent only to learn its source.
+            return flowmods
         if eth_dst == self.FAUCET_MAC or not mac_addr_is_unicast(eth_dst):
-            arp_pkt = pkt.get_protocol(arp.arp)
-            ipv4_pkt = pkt.get_protocol(ipv4.ipv4)
-            ipv6_pkt = pkt.get_protocol(ipv6.ipv6)
+            arp_pkt = None
+            ipv4_pkt = None
+            ipv6_pkt = None
+            if owner in (None, OWNER_CONTROLLER_ARP):
+                arp_pkt = pkt.get_protocol(arp.arp)
+            if owner in (None, OWNER_CONTROLLER_ICMP):
+                ipv4_pkt = pkt.get_protocol(ipv4.ipv4)
+            if owner in (None, OWNER_CONTROLLER_ICMPV6):
+                ipv6_pkt = pkt.get_protocol(ipv6.ipv6)
 
             if arp_pkt is not None:
                 src_ip = ipaddr.IPv4Address(arp_pkt.src_ip)
@@ -985,7 +1559,8 @@ class Valve(object):
 
         return flowmods
 
-    def rcv_packet(self, dp_id, in_port, vlan_vid, pkt):
+    @filter_by_flow_table
+    def rcv_packet(self, dp_id, in_port, vlan_vid, pkt, cookie=None):
         """Generate openflow msgs to update datapath upon receipt of packet.
         This involves asssociating the ethernet source address of the packet
         with the given in_port (ethernet switching) ideally so that no packets
@@ -1001,6 +1576,7 @@ class Valve(object):
         in_port -- the port number of the port that received the packet
         vlan_vid -- the vlan_vid tagged to the packet.
         pkt -- the packet send to us (Ryu ethernet object).
+        cookie -- the cookie of the flow that sent the packet, if known.
 
         Returns
         A list of flow mod messages to be sent to the datpath."""
@@ -1014,38 +1590,78 @@ class Valve(object):
             port = self.dp.ports[in_port]
 
             if mac_addr_is_unicast(eth_src):
-                self.logger.debug(
+                self.learn_logger.debug(
                     'Packet_in dp_id: %x src:%s in_port:%d vid:%s',
                     dp_id, eth_src, in_port, vlan_vid)
 
                 flowmods.extend(self.handle_control_plane(
-                    in_port, vlan, eth_src, eth_dst, pkt))
+                    in_port, vlan, eth_src, eth_dst, pkt,
+                    self.packet_in_owner(cookie)))
 
                 # ban learning new hosts if max_hosts reached on a VLAN.
                 if (vlan.max_hosts is not None and
                     len(vlan.host_cache) == vlan.max_hosts and
                     eth_src not in vlan.host_cache):
-                    self.logger.info(
+                    self.learn_logger.info(
                         'max hosts %u reached on vlan %u, ' +
                         'temporarily banning learning on this vlan',
                         vlan.max_hosts, vlan.vid)
+                    vlan.max_hosts_bans += 1
                     flowmods.extend([self.valve_flowdrop(
                         self.dp.eth_src_table,
                         self.valve_in_match(vlan=vlan),
                         priority=self.dp.low_priority+1,
-                        hard_timeout=self.dp.timeout)])
+                        hard_timeout=self.dp.timeout,
+                        cookie=self.valve_cookie(OWNER_VLAN, vlan.vid))])
                 else:
+                    now = self.clock()
+                    host_cache_entry = vlan.host_cache.get(eth_src, None)
+                    old_port_num = None
+                    if host_cache_entry is None:
+                        if self.host_tables_full():
+                            evict_flowmods = self.evict_host()
+                            if evict_flowmods is None:
+                                # every learned host is permanent, so
+                                # there's no room for this host's flows.
+                                self.learn_logger.warning(
+                                    'host tables full and no host to evict, '
+                                    'not learning %s on vlan %u',
+                                    eth_src, vlan.vid)
+                                return flowmods
+                            flowmods.extend(evict_flowmods)
+                    elif host_cache_entry.port_num != in_port:
+                        old_port_num = host_cache_entry.port_num
+                        if self.host_moved(
+                                vlan, host_cache_entry, in_port, now):
+                            # probably a loop - drop the host's packets on
+                            # other ports rather than sending them to us.
+                            self.learn_logger.warning(
+                                'host %s moving too often, holding it on '
+                                'port %u on vlan %u',
+                                eth_src, old_port_num, vlan.vid)
+                            flowmods.append(self.valve_flowdrop(
+                                self.dp.eth_src_table,
+                                self.valve_in_match(vlan=vlan, eth_src=eth_src),
+                                priority=self.dp.low_priority+2,
+                                hard_timeout=self.dp.timeout,
+                                cookie=self.valve_cookie(
+                                    OWNER_HOST, vlan.vid)))
+                            return flowmods
                     flowmods.extend(self.learn_host_on_vlan_port(
-                        port, vlan, eth_src))
-                    host_cache_entry = HostCacheEntry(
-                        eth_src,
-                        port.permanent_learn,
-                        time.time())
-                    vlan.host_cache[eth_src] = host_cache_entry
-                    self.logger.info('learned %u hosts on vlan %u',
+                        port, vlan, eth_src, old_port_num=old_port_num))
+                    if host_cache_entry is None:
+                        host_cache_entry = HostCacheEntry(
+                            eth_src, in_port, port.permanent_learn, now)
+                        vlan.host_cache[eth_src] = host_cache_entry
+                    else:
+                        host_cache_entry.relearn(
+                            in_port, port.permanent_learn, now)
+                    self.host_used(vlan, host_cache_entry)
+                    self.learn_logger.info('learned %u hosts on vlan %u',
                         len(vlan.host_cache), vlan.vid)
         return flowmods
 
+    @filter_by_flow_table
     def reload_config(self, new_dp):
         """Reload the config from new_dp
 
@@ -1054,6 +1670,7 @@ class Valve(object):
         flowmods = []
         if self.dp.running:
             self.dp = new_dp
+            self.host_lru = OrderedDict()
             flowmods = self.datapath_connect(
                 self.dp.dp_id, self.dp.ports.keys())
         return flowmods
@@ -1061,7 +1678,7 @@ class Valve(object):
     def arp_for_ip_gw(self, ip_gw, controller_ip, vlan, ports):
         flowmods = []
         if ports:
-            self.logger.info('Resolving %s', ip_gw)
+            self.route_logger.info('Resolving %s', ip_gw)
             arp_pkt = arp.arp(
                 opcode=arp.ARP_REQUEST, src_mac=self.FAUCET_MAC,
                 src_ip=str(controller_ip.ip), dst_mac=mac.DONTCARE_STR,
@@ -1071,8 +1688,9 @@ class Valve(object):
                 mac.BROADCAST_STR, port_num, vlan, ether.ETH_TYPE_ARP)
             pkt.add_protocol(arp_pkt)
             pkt.serialize()
-            for port in ports:
-                flowmods.append(self.valve_packetout(port.number, pkt.data))
+            # ports are all tagged or all untagged, so get the same packet.
+            flowmods.append(self.valve_packetout_ports(
+                [port.number for port in ports], pkt.data))
         return flowmods
 
     @staticmethod
@@ -1092,7 +1710,7 @@ class Valve(object):
     def nd_solicit_ip_gw(self, ip_gw, controller_ip, vlan, ports):
         flowmods = []
         if ports:
-            self.logger.info('Resolving %s', ip_gw)
+            self.route_logger.info('Resolving %s', ip_gw)
             nd_mac = self.ipv6_link_eth_mcast(ip_gw)
             ip_gw_mcast = self.ipv6_link_mcast_from_ucast(ip_gw)
             port_num = ports[0].number
@@ -1108,16 +1726,17 @@ class Valve(object):
             pkt.add_protocol(ipv6_pkt)
             pkt.add_protocol(icmpv6_pkt)
             pkt.serialize()
-            for port in ports:
-                flowmods.append(self.valve_packetout(port.number, pkt.data))
+            flowmods.append(self.valve_packetout_ports(
+                [port.number for port in ports], pkt.data))
         return flowmods
 
+    @filter_by_flow_table
     def resolve_gateways(self):
         # TODO: implement longest prefix match priority
         if not self.dp.running:
             return []
         flowmods = []
-        now = time.time()
+        now = self.clock()
         for vlan in self.dp.vlans.itervalues():
             untagged_ports = self.build_flood_ports_for_vlan(
                 vlan.untagged, None)
@@ -1140,33 +1759,328 @@ class Valve(object):
                                         ip_gw, controller_ip, vlan, ports))
         return flowmods
 
+    def evict_host(self):
+        """Delete the least recently used learned host, to make room in the
+        host tables for a new host.
+
+        Returns:
+        A list of flow mod messages, or None if no host can be evicted."""
+        while self.host_lru:
+            (vid, eth_src), host_cache_entry = self.host_lru.popitem(
+                last=False)
+            vlan = self.dp.vlans.get(vid, None)
+            if (vlan is None or host_cache_entry.permanent or
+                    vlan.host_cache.get(eth_src, None) is not host_cache_entry):
+                # forgotten or made permanent since it was last used.
+                continue
+            self.learn_logger.info(
+                'host tables full, evicting host %s from vlan %u',
+                eth_src, vid)
+            del vlan.host_cache[eth_src]
+            return self.delete_host_from_vlan(eth_src, vlan)
+        return None
+
+    def host_used(self, vlan, host_cache_entry):
+        """Make a host the most recently used, for evict_host()."""
+        key = (vlan.vid, host_cache_entry.eth_src)
+        self.host_lru.pop(key, None)
+        if not host_cache_entry.permanent:
+            self.host_lru[key] = host_cache_entry
+
+    def host_usage_request(self, now):
+        """Return a request for the learned hosts' flows, to find the least
+        used hosts if the host tables are filling up, or to refresh active
+        hosts if host_refresh_interval is set."""
+        if self.reconcile_port_nums is not None:
+            # the reply would be taken for the reconcile reply.
+            return []
+        if self.dp.host_refresh_interval:
+            interval = self.dp.host_refresh_interval
+        elif self.host_tables_full(self.TABLE_USAGE_THRESHOLD):
+            interval = self.HOST_USAGE_INTERVAL
+        else:
+            return []
+        if now - self.host_usage_time < interval:
+            return []
+        self.host_usage_time = now
+        return [self.valve_flowstats_request(owner=OWNER_HOST)]
+
+    def flow_host(self, match, eth_field):
+        """Return (vlan, host_cache_entry) for the host a flow's match
+        field eth_field is the address of, or (None, None)."""
+        eth_addr = match.get(eth_field, None)
+        vlan_vid = match.get('vlan_vid', None)
+        if not isinstance(eth_addr, str) or vlan_vid is None:
+            return None, None
+        vlan = self.dp.vlans.get(vlan_vid & ~ofp.OFPVID_PRESENT, None)
+        if vlan is None or eth_addr not in vlan.host_cache:
+            return None, None
+        return vlan, vlan.host_cache[eth_addr]
+
+    def refresh_host(self, flow_stat, now):
+        """Return flows to relearn a host whose eth_src flow is about to
+        time out, if the host has sent packets since the last flow stats,
+        so active hosts are not expired and relearned from packet-ins."""
+        vlan, host_cache_entry = self.flow_host(flow_stat.match, 'eth_src')
+        if host_cache_entry is None or host_cache_entry.permanent:
+            return []
+        if host_cache_entry.port_num != flow_stat.match.get('in_port', None):
+            return []
+        active = flow_stat.packet_count != host_cache_entry.src_packet_count
+        host_cache_entry.src_packet_count = flow_stat.packet_count
+        remaining = flow_stat.hard_timeout - flow_stat.duration_sec
+        # the flow may expire before the next flow stats.
+        if not active or remaining > 2 * self.dp.host_refresh_interval:
+            return []
+        port = self.dp.ports.get(host_cache_entry.port_num, None)
+        if port is None or not port.running():
+            return []
+        self.learn_logger.debug(
+            'refreshing host %s on vlan %u', host_cache_entry.eth_src, vlan.vid)
+        host_cache_entry.relearn(port.number, port.permanent_learn, now)
+        return self.learn_host_on_vlan_port(
+            port, vlan, host_cache_entry.eth_src)
+
+    @filter_by_flow_table
+    def host_usage(self, dp_id, flow_stats):
+        """Update when each host was last used, from the host flow stats
+        requested by host_usage_request(), and refresh active hosts.
+
+        Timed flows no longer on the datapath (eg. idle timed out) are also
+        removed from the flow table model, so it counts only flows that are
+        actually taking up space.
+
+        Arguments:
+        dp_id -- the Datapath unique ID (64bit int)
+        flow_stats -- OFPFlowStats for the learned hosts' flows.
+
+        Returns:
+        A list of flow mod messages to refresh hosts."""
+        if self.ignore_dpid(dp_id):
+            return []
+        now = self.clock()
+        present_keys = set()
+        ofmsgs = []
+        for flow_stat in flow_stats:
+            if flow_stat.table_id == self.dp.eth_dst_table:
+                present_keys.add(
+                    (flow_stat.priority, match_key(flow_stat.match)))
+                vlan, host_cache_entry = self.flow_host(
+                    flow_stat.match, 'eth_dst')
+                if host_cache_entry is None:
+                    continue
+                if flow_stat.packet_count != host_cache_entry.packet_count:
+                    host_cache_entry.packet_count = flow_stat.packet_count
+                    host_cache_entry.last_used = now
+                    self.host_used(vlan, host_cache_entry)
+            elif (flow_stat.table_id == self.dp.eth_src_table and
+                  flow_stat.hard_timeout and self.dp.host_refresh_interval):
+                ofmsgs.extend(self.refresh_host(flow_stat, now))
+        self.flow_table.forget_missing(self.dp.eth_dst_table, present_keys)
+        return ofmsgs
+
+    def flow_stats_reply(self, dp_id, flow_stats):
+        """Handle the flows requested by datapath_reconnect() or
+        host_usage_request(), whichever is waiting for them.
+
+        Arguments:
+        dp_id -- the Datapath unique ID (64bit int)
+        flow_stats -- OFPFlowStats from all parts of the reply.
+
+        Returns:
+        A list of openflow msgs to send to the datapath."""
+        if self.reconcile_port_nums is not None:
+            return self.datapath_reconcile(dp_id, flow_stats)
+        return self.host_usage(dp_id, flow_stats)
+
+    def expire_host(self, vlan, eth_src):
+        del vlan.host_cache[eth_src]
+        self.host_lru.pop((vlan.vid, eth_src), None)
+        self.learn_logger.info(
+            'expiring host %s from vlan %u', eth_src, vlan.vid)
+        self.learn_logger.info('%u recently active hosts on vlan %u',
+            len(vlan.host_cache), vlan.vid)
+
+    def expire_port_hosts(self, port_num):
+        """Expire the hosts learned on a port, whose flows were deleted."""
+        for vlan in self.dp.vlans.itervalues():
+            for eth_src, host_cache_entry in vlan.host_cache.items():
+                if host_cache_entry.port_num == port_num:
+                    self.expire_host(vlan, eth_src)
+
+    def flow_removed(self, dp_id, msg):
+        """Update state when the datapath removes one of our flows.
+
+        Learned hosts' eth_src flows are sent with OFPFF_SEND_FLOW_REM, so
+        hosts are expired exactly when the datapath times out their flows.
+
+        Arguments:
+        dp_id -- the Datapath unique ID (64bit int)
+        msg -- the OFPFlowRemoved msg sent from the datapath."""
+        if self.ignore_dpid(dp_id) or not self.owns_cookie(msg.cookie):
+            return
+        now = self.clock()
+        installed_time = now - msg.duration_sec
+        self.flow_table.removed(
+            msg.table_id, msg.priority, msg.match, installed_time)
+        if msg.table_id != self.dp.eth_src_table:
+            return
+        if msg.reason == ofp.OFPRR_DELETE:
+            # we deleted the flow, so already know.
+            return
+        eth_src = msg.match.get('eth_src', None)
+        vlan_vid = msg.match.get('vlan_vid', None)
+        if eth_src is None or vlan_vid is None:
+            return
+        vlan = self.dp.vlans.get(vlan_vid & ~ofp.OFPVID_PRESENT, None)
+        if vlan is None or eth_src not in vlan.host_cache:
+            return
+        host_cache_entry = vlan.host_cache[eth_src]
+        if (host_cache_entry.permanent or
+                host_cache_entry.port_num != msg.match.get('in_port', None)):
+            return
+        if host_cache_entry.cache_time > (
+                installed_time + FlowEntry.EXPIRY_GRACE):
+            # relearned since the removed flow was installed.
+            return
+        self.expire_host(vlan, eth_src)
+
     def host_expire(self):
+        """Forget flows whose hard timeout has passed, save a snapshot and
+        request host usage if needed.
+
+        Hosts are expired by flow_removed(), rather than here. If the flows
+        requested to reconcile the datapath have not arrived in time, it is
+        connected from scratch instead.
+
+        Returns:
+        A list of openflow msgs to send to the datapath."""
         if not self.dp.running:
-            return
-        now = time.time()
+            return []
+        now = self.clock()
+        if (self.reconcile_time is not None and
+                now - self.reconcile_time >= self.RECONCILE_TIMEOUT):
+            self.logger.warning(
+                'No flows to reconcile datapath after %us, '
+                'reconfiguring it', self.RECONCILE_TIMEOUT)
+            discovered_port_nums = self.reconcile_port_nums
+            self.cancel_reconcile()
+            return self.datapath_connect(self.dp.dp_id, discovered_port_nums)
+        self.flow_table.expire(now)
+        if (self.dp.snapshot_file is not None and
+                now - self.snapshot_time >= self.dp.snapshot_interval):
+            self.write_snapshot(now)
+        return self.host_usage_request(now)
+
+    def learned_host_flows(self, permanent_only=False):
+        """Return flows for all hosts in the host caches (or only the
+        permanently learned hosts), with the time remaining before they
+        would have expired as their timeouts."""
+        ofmsgs = []
+        now = self.clock()
         for vlan in self.dp.vlans.itervalues():
-            expired_hosts = []
-            for eth_src, host_cache_entry in vlan.host_cache.iteritems():
+            for eth_src, host_cache_entry in vlan.host_cache.items():
+                if permanent_only and not host_cache_entry.permanent:
+                    continue
+                port = self.dp.ports.get(host_cache_entry.port_num, None)
+                if (port is None or not port.running() or
+                        not vlan.contains_port(port.number)):
+                    # the host's flows can't be installed, so it won't be
+                    # reported as expiring.
+                    self.expire_host(vlan, eth_src)
+                    continue
+                learn_timeout = None
                 if not host_cache_entry.permanent:
-                    host_cache_entry_age = now - host_cache_entry.cache_time
-                    if host_cache_entry_age > self.dp.timeout:
-                        expired_hosts.append(eth_src)
-            if expired_hosts:
-                for eth_src in expired_hosts:
-                    del vlan.host_cache[eth_src]
-                    self.logger.info('expiring host %s from vlan %u',
-                        eth_src, vlan.vid)
-                self.logger.info('%u recently active hosts on vlan %u',
-                        len(vlan.host_cache), vlan.vid)
+                    learn_timeout = int(
+                        self.dp.timeout - (now - host_cache_entry.cache_time))
+                    if learn_timeout <= 0:
+                        self.expire_host(vlan, eth_src)
+                        continue
+                ofmsgs.extend(self.learn_host_on_vlan_port(
+                    port, vlan, eth_src, learn_timeout))
+        return ofmsgs
+
+    def write_snapshot(self, now=None):
+        """Write the host and neighbor caches to the snapshot file.
+
+        The caches are serialized now, and written by a separate thread,
+        see snapshot.py."""
+        if now is None:
+            now = self.clock()
+        self.snapshot_time = now
+        if self.snapshot_writer is None:
+            self.snapshot_writer = SnapshotWriter(self.logger.name)
+        self.snapshot_writer.write(
+            self.dp.snapshot_file,
+            serialize_snapshot(self.dp.vlans.values()))
+
+    def restore_snapshot(self):
+        """Add the hosts and neighbors in the snapshot file to the caches,
+        if this is the first connect since FAUCET started.
+
+        Entries already in the caches are newer, so they are kept. Hosts
+        learned on ports no longer in their VLAN, neighbors that are no
+        longer a route's gateway and entries that would have expired are
+        ignored."""
+        if self.snapshot_restored:
+            return
+        self.snapshot_restored = True
+        snapshot_file = self.dp.snapshot_file
+        if snapshot_file is None or not os.path.exists(snapshot_file):
+            return
+        try:
+            hosts, neighbors = read_snapshot(snapshot_file)
+        except (IOError, ValueError, struct.error) as err:
+            self.logger.error(
+                'Could not read snapshot %s: %s', snapshot_file, err)
+            return
+        now = self.clock()
+        restored_hosts = 0
+        for vid, eth_src, port_num, permanent, cache_time in hosts:
+            vlan = self.dp.vlans.get(vid, None)
+            if vlan is None or eth_src in vlan.host_cache:
+                continue
+            if not vlan.contains_port(port_num):
+                continue
+            permanent = self.dp.ports[port_num].permanent_learn
+            if not permanent and now - cache_time >= self.dp.timeout:
+                continue
+            if (vlan.max_hosts is not None and
+                    len(vlan.host_cache) >= vlan.max_hosts):
+                continue
+            host_cache_entry = HostCacheEntry(
+                eth_src, port_num, permanent, cache_time)
+            vlan.host_cache[eth_src] = host_cache_entry
+            self.host_used(vlan, host_cache_entry)
+            restored_hosts += 1
+        restored_neighbors = 0
+        for vid, ip_gw, eth_src, cache_time in neighbors:
+            vlan = self.dp.vlans.get(vid, None)
+            if vlan is None:
+                continue
+            if ip_gw.version == 4:
+                routes, neighbor_cache = vlan.ipv4_routes, vlan.arp_cache
+            else:
+                routes, neighbor_cache = vlan.ipv6_routes, vlan.nd_cache
+            if ip_gw in neighbor_cache or ip_gw not in routes.values():
+                continue
+            if now - cache_time > self.dp.arp_neighbor_timeout:
+                continue
+            neighbor_cache[ip_gw] = LinkNeighbor(eth_src, cache_time)
+            restored_neighbors += 1
+        self.logger.info(
+            'Restored %u hosts and %u neighbors from snapshot %s',
+            restored_hosts, restored_neighbors, snapshot_file)
 
 
 class ArubaValve(Valve):
 
     def switch_features(self, dp_id, msg):
-        ryu_table_loader = aruba.LoadRyuTables()
-        ryu_table_loader.load_tables(
+        ryu_tables, body_bytes = aruba.compiled_pipeline(
             os.path.join(aruba.CFG_PATH, 'aruba_pipeline.json'), parser)
-        ofmsgs = [parser.OFPTableFeaturesStatsRequest(
+        ofmsgs = self.switch_config()
+        ofmsgs.append(aruba.CompiledTableFeaturesStatsRequest(
             datapath=None,
-            body=ryu_table_loader.ryu_tables)]
+            body=ryu_tables,
+            body_bytes=body_bytes))
         return ofmsgs
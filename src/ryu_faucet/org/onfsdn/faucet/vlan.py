@@ -52,6 +52,10 @@ class VLAN(object):
         self.nd_cache = {}
         self.max_hosts = conf.setdefault('max_hosts', None)
         self.host_cache = {}
+        # number of times hosts have moved between ports
+        self.host_moves = 0
+        # number of times learning was banned as max_hosts was reached
+        self.max_hosts_bans = 0
 
     def __str__(self):
         port_list = [str(x) for x in self.get_ports()]
@@ -0,0 +1,628 @@
+# A simulated OpenFlow 1.3 datapath, for testing and benchmarking FAUCET
+# end to end without OVS or mininet.
+#
+# FakeDatapath applies the flowmods and groupmods it is sent to a model of
+# its flow tables, and forwards packets through the tables as a switch would,
+# queueing packet-ins, flow removed messages, port status messages and
+# replies for the controller. ValveDriver passes messages between a Valve
+# and a FakeDatapath in the same way as Faucet does between a Valve and a
+# datapath connected through ryu.
+#
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import struct
+import time
+
+import ipaddr
+
+from ryu.lib import mac
+from ryu.lib.packet import arp, ethernet
+from ryu.lib.packet import vlan as packet_vlan
+from ryu.ofproto import ether
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+
+MAC_FIELDS = frozenset([
+    'eth_src', 'eth_dst', 'arp_sha', 'arp_tha', 'ipv6_nd_sll', 'ipv6_nd_tll'])
+IP_FIELDS = frozenset([
+    'ipv4_src', 'ipv4_dst', 'arp_spa', 'arp_tpa', 'ipv6_src', 'ipv6_dst',
+    'ipv6_nd_target'])
+
+# mask of a field matched exactly.
+EXACT = -1
+
+
+def field_value(field, value):
+    """Return the value of a match field as an int, so it can be masked."""
+    if field in MAC_FIELDS:
+        return int(value.replace(':', ''), 16)
+    if field in IP_FIELDS:
+        return int(ipaddr.IPAddress(value))
+    return value
+
+
+def compile_match(match):
+    """Return the fields of an OFPMatch as a sorted tuple of
+    (field, masked value, mask)."""
+    fields = []
+    for field, value in match.items():
+        mask = EXACT
+        if isinstance(value, tuple):
+            value, mask = value
+            mask = field_value(field, mask)
+        fields.append((field, field_value(field, value) & mask, mask))
+    return tuple(sorted(fields))
+
+
+def mac_bytes(value):
+    return struct.pack('!HI', value >> 32, value & 0xffffffff)
+
+
+class FakePacket(object):
+    """A packet, as the fields a datapath matches on.
+
+    Only the Ethernet and VLAN headers are built from the fields (for
+    packet-ins), the rest of the packet is carried as an opaque payload."""
+
+    def __init__(self, eth_src, eth_dst, eth_type, payload='', vid=None,
+                 **fields):
+        self.fields = {
+            'eth_src': field_value('eth_src', eth_src),
+            'eth_dst': field_value('eth_dst', eth_dst),
+            'eth_type': eth_type,
+            'vlan_vid': ofp.OFPVID_NONE,
+        }
+        if vid is not None:
+            self.fields['vlan_vid'] = vid | ofp.OFPVID_PRESENT
+        for field, value in fields.iteritems():
+            self.fields[field] = field_value(field, value)
+        self.payload = payload
+
+    @classmethod
+    def parse(cls, data):
+        """Return a FakePacket from the Ethernet and VLAN headers of data
+        (eg. a packet-out from the controller)."""
+        eth_pkt, _, rest = ethernet.ethernet.parser(str(data))
+        vid = None
+        eth_type = eth_pkt.ethertype
+        if eth_type == ether.ETH_TYPE_8021Q:
+            vlan_pkt, _, rest = packet_vlan.vlan.parser(rest)
+            vid = vlan_pkt.vid
+            eth_type = vlan_pkt.ethertype
+        return cls(eth_pkt.src, eth_pkt.dst, eth_type, str(rest), vid)
+
+    def copy(self):
+        pkt = FakePacket.__new__(FakePacket)
+        pkt.fields = dict(self.fields)
+        pkt.payload = self.payload
+        return pkt
+
+    def vid(self):
+        """Return the packet's VLAN, or None if untagged."""
+        vlan_vid = self.fields['vlan_vid']
+        if vlan_vid & ofp.OFPVID_PRESENT:
+            return vlan_vid & ~ofp.OFPVID_PRESENT
+        return None
+
+    def data(self):
+        fields = self.fields
+        header = mac_bytes(fields['eth_dst']) + mac_bytes(fields['eth_src'])
+        vid = self.vid()
+        if vid is not None:
+            header += struct.pack('!HH', ether.ETH_TYPE_8021Q, vid)
+        header += struct.pack('!H', fields['eth_type'])
+        return header + self.payload
+
+
+def arp_request(eth_src, src_ip, dst_ip, vid=None):
+    """Return a broadcast ARP request for dst_ip from src_ip."""
+    arp_pkt = arp.arp(
+        opcode=arp.ARP_REQUEST, src_mac=eth_src, src_ip=src_ip,
+        dst_mac='00:00:00:00:00:00', dst_ip=dst_ip)
+    return FakePacket(
+        eth_src, mac.BROADCAST_STR, ether.ETH_TYPE_ARP,
+        str(arp_pkt.serialize(bytearray(), None)), vid,
+        arp_op=arp.ARP_REQUEST, arp_sha=eth_src, arp_spa=src_ip,
+        arp_tpa=dst_ip)
+
+
+def unicast_packet(eth_src, eth_dst, vid=None):
+    """Return an IPv4 packet (with no IP header) from eth_src to eth_dst."""
+    return FakePacket(eth_src, eth_dst, ether.ETH_TYPE_IP, vid=vid)
+
+
+def flow_outputs(instructions):
+    """Return the ports and groups instructions output to."""
+    out_ports = set()
+    out_groups = set()
+    for inst in instructions:
+        for action in getattr(inst, 'actions', []):
+            if isinstance(action, parser.OFPActionOutput):
+                out_ports.add(action.port)
+            elif isinstance(action, parser.OFPActionGroup):
+                out_groups.add(action.group_id)
+    return out_ports, out_groups
+
+
+class FakeFlow(object):
+    """A flow in a FakeDatapath's table."""
+
+    def __init__(self, table_id, flowmod, now):
+        self.table_id = table_id
+        self.priority = flowmod.priority
+        self.cookie = flowmod.cookie
+        self.match = flowmod.match
+        self.fields = compile_match(flowmod.match)
+        self.field_masks = dict([
+            (field, (value, mask)) for field, value, mask in self.fields])
+        self.shape = tuple([(field, mask) for field, _, mask in self.fields])
+        self.key = tuple([value for _, value, _ in self.fields])
+        self.idle_timeout = flowmod.idle_timeout
+        self.hard_timeout = flowmod.hard_timeout
+        self.flags = flowmod.flags
+        self.installed = now
+        self.last_used = now
+        self.packet_count = 0
+        self.byte_count = 0
+        self.set_instructions(flowmod.instructions)
+
+    def set_instructions(self, instructions):
+        self.instructions = instructions
+        self.out_ports, self.out_groups = flow_outputs(instructions)
+
+    def matched_by(self, fields):
+        """Return True if a non-strict match on fields includes this flow."""
+        for field, value, mask in fields:
+            if field not in self.field_masks:
+                return False
+            flow_value, flow_mask = self.field_masks[field]
+            if flow_mask & mask != mask or flow_value & mask != value:
+                return False
+        return True
+
+    def selected(self, msg, outputs=True):
+        """Return True if the cookie, and unless outputs is False the
+        out_port and out_group, of a flowmod or flow stats request select
+        this flow."""
+        if self.cookie & msg.cookie_mask != msg.cookie & msg.cookie_mask:
+            return False
+        if not outputs:
+            return True
+        if msg.out_port != ofp.OFPP_ANY and msg.out_port not in self.out_ports:
+            return False
+        if (msg.out_group != ofp.OFPG_ANY and
+                msg.out_group not in self.out_groups):
+            return False
+        return True
+
+    def expiry_reason(self, now):
+        """Return why this flow has timed out, or None if it hasn't."""
+        if self.hard_timeout and now - self.installed >= self.hard_timeout:
+            return ofp.OFPRR_HARD_TIMEOUT
+        if self.idle_timeout and now - self.last_used >= self.idle_timeout:
+            return ofp.OFPRR_IDLE_TIMEOUT
+        return None
+
+    def flow_removed(self, reason, now):
+        return parser.OFPFlowRemoved(
+            None, cookie=self.cookie, priority=self.priority, reason=reason,
+            table_id=self.table_id, duration_sec=int(now - self.installed),
+            duration_nsec=0, idle_timeout=self.idle_timeout,
+            hard_timeout=self.hard_timeout, packet_count=self.packet_count,
+            byte_count=self.byte_count, match=self.match)
+
+    def flow_stats(self, now):
+        return parser.OFPFlowStats(
+            self.table_id, int(now - self.installed), 0, self.priority,
+            self.idle_timeout, self.hard_timeout, self.flags, self.cookie,
+            self.packet_count, self.byte_count, self.match, self.instructions)
+
+
+class FakeFlowTable(object):
+    """The flows of one table, indexed by priority and then by which fields
+    (with which masks) each flow matches, so a lookup costs a hash per
+    distinct set of fields rather than a scan of every flow."""
+
+    def __init__(self, table_id):
+        self.table_id = table_id
+        # priority -> (field, mask)s -> masked values -> flow
+        self.index = {}
+        self.priorities = []
+
+    def __len__(self):
+        return sum([
+            len(flows) for shapes in self.index.itervalues()
+            for flows in shapes.itervalues()])
+
+    def flows(self):
+        return [
+            flow for shapes in self.index.itervalues()
+            for flows in shapes.itervalues() for flow in flows.itervalues()]
+
+    def get(self, priority, fields):
+        shape = tuple([(field, mask) for field, _, mask in fields])
+        key = tuple([value for _, value, _ in fields])
+        return self.index.get(priority, {}).get(shape, {}).get(key, None)
+
+    def add(self, flow):
+        """Add flow, replacing any flow with the same priority and match."""
+        if flow.priority not in self.index:
+            self.index[flow.priority] = {}
+            self.priorities = sorted(self.index, reverse=True)
+        self.index[flow.priority].setdefault(flow.shape, {})[flow.key] = flow
+
+    def remove(self, flow):
+        shapes = self.index[flow.priority]
+        flows = shapes[flow.shape]
+        del flows[flow.key]
+        if not flows:
+            del shapes[flow.shape]
+            if not shapes:
+                del self.index[flow.priority]
+                self.priorities = sorted(self.index, reverse=True)
+
+    def lookup(self, pkt_fields):
+        """Return the highest priority flow matching a packet's fields."""
+        for priority in self.priorities:
+            for shape, flows in self.index[priority].iteritems():
+                key = []
+                for field, mask in shape:
+                    value = pkt_fields.get(field, None)
+                    if value is None:
+                        break
+                    key.append(value & mask)
+                else:
+                    flow = flows.get(tuple(key), None)
+                    if flow is not None:
+                        return flow
+        return None
+
+
+class FakeDatapath(object):
+    """A simulated OpenFlow 1.3 datapath.
+
+    Messages for the controller are queued in msgs. Only the instructions
+    and actions FAUCET uses are modelled: apply actions and goto table,
+    output, VLAN push/pop/set and (ALL) groups. Packets missing all flows in
+    a table are dropped, and the pipeline starts at table 0.
+    """
+
+    def __init__(self, dp_id, port_nums, table_size=None, n_tables=8):
+        self.dp_id = dp_id
+        self.ports = dict([(port_num, True) for port_num in port_nums])
+        self.table_size = table_size
+        self.n_tables = n_tables
+        self.tables = {}
+        self.groups = {}
+        self.miss_send_len = ofp.OFPCML_MAX
+        self.msgs = collections.deque()
+
+    def up_port_nums(self):
+        return [port_num for port_num, up in self.ports.iteritems() if up]
+
+    def table(self, table_id):
+        if table_id not in self.tables:
+            self.tables[table_id] = FakeFlowTable(table_id)
+        return self.tables[table_id]
+
+    def flow_count(self, table_id=None):
+        if table_id is not None:
+            return len(self.table(table_id))
+        return sum([len(table) for table in self.tables.itervalues()])
+
+    def send_msg(self, msg, now=None):
+        """Handle a message from the controller."""
+        if now is None:
+            now = time.time()
+        if isinstance(msg, parser.OFPFlowMod):
+            self.flow_mod(msg, now)
+        elif isinstance(msg, parser.OFPGroupMod):
+            self.group_mod(msg, now)
+        elif isinstance(msg, parser.OFPPacketOut):
+            self.packet_out(msg, now)
+        elif isinstance(msg, parser.OFPSetConfig):
+            self.miss_send_len = msg.miss_send_len
+        elif isinstance(msg, parser.OFPBarrierRequest):
+            self.msgs.append(parser.OFPBarrierReply(None))
+        elif isinstance(msg, parser.OFPFlowStatsRequest):
+            self.msgs.append(parser.OFPFlowStatsReply(
+                None, body=self.flow_stats(msg, now), flags=0))
+        elif isinstance(msg, parser.OFPGroupDescStatsRequest):
+            self.msgs.append(parser.OFPGroupDescStatsReply(None, body=[
+                parser.OFPGroupDescStats(type_, group_id, buckets)
+                for group_id, (type_, buckets) in self.groups.iteritems()],
+                flags=0))
+        elif isinstance(msg, parser.OFPTableFeaturesStatsRequest):
+            if self.table_size is not None:
+                self.msgs.append(parser.OFPTableFeaturesStatsReply(None, body=[
+                    parser.OFPTableFeaturesStats(
+                        table_id, max_entries=self.table_size)
+                    for table_id in range(self.n_tables)], flags=0))
+
+    def select_flows(self, msg, strict=False, outputs=True):
+        """Return the flows a flowmod or flow stats request applies to."""
+        if msg.table_id == ofp.OFPTT_ALL:
+            tables = self.tables.values()
+        else:
+            tables = [self.table(msg.table_id)]
+        fields = compile_match(msg.match)
+        selected = []
+        for table in tables:
+            if strict:
+                flows = [table.get(msg.priority, fields)]
+            else:
+                flows = [
+                    flow for flow in table.flows() if flow.matched_by(fields)]
+            selected.extend([
+                flow for flow in flows
+                if flow is not None and flow.selected(msg, outputs)])
+        return selected
+
+    def remove_flow(self, flow, reason, now):
+        self.tables[flow.table_id].remove(flow)
+        if flow.flags & ofp.OFPFF_SEND_FLOW_REM:
+            self.msgs.append(flow.flow_removed(reason, now))
+
+    def flow_mod(self, flowmod, now):
+        command = flowmod.command
+        if command == ofp.OFPFC_ADD:
+            table = self.table(flowmod.table_id)
+            flow = FakeFlow(flowmod.table_id, flowmod, now)
+            if (self.table_size is not None and
+                    len(table) >= self.table_size and
+                    table.get(flow.priority, flow.fields) is None):
+                self.msgs.append(parser.OFPErrorMsg(
+                    None, type_=ofp.OFPET_FLOW_MOD_FAILED,
+                    code=ofp.OFPFMFC_TABLE_FULL))
+                return
+            table.add(flow)
+        elif command in (ofp.OFPFC_MODIFY, ofp.OFPFC_MODIFY_STRICT):
+            strict = command == ofp.OFPFC_MODIFY_STRICT
+            # modifies ignore out_port and out_group.
+            for flow in self.select_flows(flowmod, strict, outputs=False):
+                flow.set_instructions(flowmod.instructions)
+        elif command in (ofp.OFPFC_DELETE, ofp.OFPFC_DELETE_STRICT):
+            strict = command == ofp.OFPFC_DELETE_STRICT
+            for flow in self.select_flows(flowmod, strict):
+                self.remove_flow(flow, ofp.OFPRR_DELETE, now)
+
+    def group_mod(self, group_mod, now):
+        command = group_mod.command
+        if command in (ofp.OFPGC_ADD, ofp.OFPGC_MODIFY):
+            self.groups[group_mod.group_id] = (
+                group_mod.type, group_mod.buckets)
+        elif command == ofp.OFPGC_DELETE:
+            if group_mod.group_id == ofp.OFPG_ALL:
+                group_ids = self.groups.keys()
+            else:
+                group_ids = [group_mod.group_id]
+            for group_id in group_ids:
+                if self.groups.pop(group_id, None) is None:
+                    continue
+                # flows using a deleted group are deleted with it.
+                for table in self.tables.values():
+                    for flow in table.flows():
+                        if group_id in flow.out_groups:
+                            self.remove_flow(flow, ofp.OFPRR_GROUP_DELETE, now)
+
+    def packet_out(self, msg, now):
+        pkt = FakePacket.parse(msg.data)
+        outputs = []
+        self.apply_actions(msg.actions, msg.in_port, pkt, None, outputs, now)
+        return outputs
+
+    def receive(self, in_port, pkt, now=None):
+        """Forward a packet received on in_port through the pipeline.
+
+        Returns:
+        A list of (port number, FakePacket) the packet was output as."""
+        if now is None:
+            now = time.time()
+        outputs = []
+        if not self.ports.get(in_port, False):
+            return outputs
+        pkt = pkt.copy()
+        pkt.fields['in_port'] = in_port
+        size = len(pkt.payload) + 14
+        table_id = 0
+        while table_id is not None:
+            table = self.tables.get(table_id, None)
+            if table is None:
+                break
+            flow = table.lookup(pkt.fields)
+            if flow is None:
+                break
+            flow.packet_count += 1
+            flow.byte_count += size
+            flow.last_used = now
+            table_id = None
+            for inst in flow.instructions:
+                if isinstance(inst, parser.OFPInstructionGotoTable):
+                    table_id = inst.table_id
+                elif (isinstance(inst, parser.OFPInstructionActions) and
+                      inst.type == ofp.OFPIT_APPLY_ACTIONS):
+                    self.apply_actions(
+                        inst.actions, in_port, pkt, flow, outputs, now)
+        return outputs
+
+    def apply_actions(self, actions, in_port, pkt, flow, outputs, now):
+        for action in actions:
+            if isinstance(action, parser.OFPActionOutput):
+                self.output(
+                    action.port, action.max_len, in_port, pkt, flow, outputs)
+            elif isinstance(action, parser.OFPActionPushVlan):
+                pkt.fields['vlan_vid'] |= ofp.OFPVID_PRESENT
+            elif isinstance(action, parser.OFPActionPopVlan):
+                pkt.fields['vlan_vid'] = ofp.OFPVID_NONE
+            elif isinstance(action, parser.OFPActionSetField):
+                pkt.fields[action.key] = field_value(action.key, action.value)
+            elif isinstance(action, parser.OFPActionGroup):
+                if action.group_id not in self.groups:
+                    continue
+                _, buckets = self.groups[action.group_id]
+                for bucket in buckets:
+                    self.apply_actions(
+                        bucket.actions, in_port, pkt.copy(), flow, outputs,
+                        now)
+
+    def output(self, port_num, max_len, in_port, pkt, flow, outputs):
+        if port_num == ofp.OFPP_CONTROLLER:
+            self.packet_in(pkt, in_port, flow, max_len)
+        elif port_num == ofp.OFPP_IN_PORT:
+            outputs.append((in_port, pkt.copy()))
+        elif port_num in (ofp.OFPP_FLOOD, ofp.OFPP_ALL):
+            for out_port in sorted(self.up_port_nums()):
+                if out_port != in_port:
+                    outputs.append((out_port, pkt.copy()))
+        elif port_num != in_port and self.ports.get(port_num, False):
+            outputs.append((port_num, pkt.copy()))
+
+    def packet_in(self, pkt, in_port, flow, max_len):
+        data = pkt.data()
+        total_len = len(data)
+        if max_len != ofp.OFPCML_NO_BUFFER:
+            data = data[:max_len]
+        table_id = None
+        cookie = 0xffffffffffffffff
+        if flow is not None:
+            table_id = flow.table_id
+            cookie = flow.cookie
+        self.msgs.append(parser.OFPPacketIn(
+            None, buffer_id=ofp.OFP_NO_BUFFER, total_len=total_len,
+            reason=ofp.OFPR_ACTION, table_id=table_id, cookie=cookie,
+            match=parser.OFPMatch(in_port=in_port), data=data))
+
+    def flow_stats(self, msg, now):
+        return [flow.flow_stats(now) for flow in self.select_flows(msg)]
+
+    def port_status(self, port_num, up):
+        """Bring a port up or down, and tell the controller."""
+        self.ports[port_num] = up
+        state = 0
+        if not up:
+            state = ofp.OFPPS_LINK_DOWN
+        self.msgs.append(parser.OFPPortStatus(
+            None, reason=ofp.OFPPR_MODIFY, desc=parser.OFPPort(
+                port_num, '00:00:00:00:00:00', 'port%u' % port_num,
+                0, state, 0, 0, 0, 0, 0, 0)))
+
+    def expire(self, now=None):
+        """Remove timed out flows.
+
+        Returns:
+        The number of flows removed."""
+        if now is None:
+            now = time.time()
+        expired = 0
+        for table in self.tables.values():
+            for flow in table.flows():
+                reason = flow.expiry_reason(now)
+                if reason is not None:
+                    self.remove_flow(flow, reason, now)
+                    expired += 1
+        return expired
+
+
+class ValveDriver(object):
+    """Passes messages between a Valve and a FakeDatapath, as Faucet does."""
+
+    def __init__(self, valve, datapath):
+        self.valve = valve
+        self.datapath = datapath
+        self.dp_id = valve.dp.dp_id
+        self.flow_stats = []
+        self.sent = collections.defaultdict(int)
+        self.received = collections.defaultdict(int)
+        self.errors = []
+
+    def send(self, ofmsgs):
+        for ofmsg in ofmsgs:
+            self.sent[ofmsg.__class__.__name__] += 1
+            self.datapath.send_msg(ofmsg)
+
+    def connect(self):
+        self.send(self.valve.switch_features(self.dp_id, None))
+        self.run()
+        self.send(self.valve.datapath_reconnect(
+            self.dp_id, self.datapath.up_port_nums()))
+        self.run()
+
+    def run(self):
+        """Handle the datapath's messages until there are none left."""
+        msgs = self.datapath.msgs
+        while msgs:
+            self.handle(msgs.popleft())
+
+    def handle(self, msg):
+        self.received[msg.__class__.__name__] += 1
+        if isinstance(msg, parser.OFPPacketIn):
+            self.packet_in(msg)
+        elif isinstance(msg, parser.OFPFlowRemoved):
+            self.valve.flow_removed(self.dp_id, msg)
+        elif isinstance(msg, parser.OFPPortStatus):
+            self.port_status(msg)
+        elif isinstance(msg, parser.OFPFlowStatsReply):
+            self.flow_stats.extend(msg.body)
+            if msg.flags & ofp.OFPMPF_REPLY_MORE:
+                return
+            flow_stats = self.flow_stats
+            self.flow_stats = []
+            self.send(self.valve.flow_stats_reply(self.dp_id, flow_stats))
+        elif isinstance(msg, parser.OFPGroupDescStatsReply):
+            self.valve.group_desc(self.dp_id, msg.body)
+        elif isinstance(msg, parser.OFPTableFeaturesStatsReply):
+            self.valve.table_features(self.dp_id, msg.body)
+        elif isinstance(msg, parser.OFPErrorMsg):
+            self.errors.append(msg)
+
+    def packet_in(self, msg):
+        pkt = self.valve.parse_packet_in(msg.data, msg.cookie)
+        eth_pkt = pkt.get_protocols(ethernet.ethernet)[0]
+        if eth_pkt.ethertype != ether.ETH_TYPE_8021Q:
+            return
+        vlan_vid = pkt.get_protocols(packet_vlan.vlan)[0].vid
+        self.send(self.valve.rcv_packet(
+            self.dp_id, msg.match['in_port'], vlan_vid, pkt, msg.cookie))
+
+    def port_status(self, msg):
+        port_num = msg.desc.port_no
+        if msg.desc.state & ofp.OFPPS_LINK_DOWN:
+            self.send(self.valve.port_delete(self.dp_id, port_num))
+        else:
+            self.send(self.valve.port_add(self.dp_id, port_num))
+
+    def receive(self, in_port, pkt):
+        """Send a packet into the datapath, and handle what it sends to the
+        controller as a result.
+
+        Returns:
+        A list of (port number, FakePacket) the packet was output as."""
+        outputs = self.datapath.receive(in_port, pkt)
+        self.run()
+        return outputs
+
+    def port_status_change(self, port_num, up):
+        self.datapath.port_status(port_num, up)
+        self.run()
+
+    def host_expire(self, now=None):
+        """Time out flows on the datapath, then run Valve's periodic expiry
+        as Faucet's timer would."""
+        self.datapath.expire(now)
+        self.run()
+        self.send(self.valve.host_expire())
+        self.run()
@@ -0,0 +1,343 @@
+#!/usr/bin/python
+
+# Offline benchmarks for FAUCET's Valve.
+#
+# Builds synthetic DP objects of configurable size and drives Valve directly,
+# without ryu, OVS or mininet. For each Valve operation the wall time, the
+# number of OpenFlow messages produced and the peak memory the operation used
+# are reported, and optionally saved as JSON so that runs can be compared.
+#
+# Eg:
+#
+#   ./faucet_benchmark.py --ports 48 --vlans 8 --output before.json
+#   ./faucet_benchmark.py --ports 48 --vlans 8 --compare before.json
+#
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from cookie import OWNER_HOST, OWNER_LEARN
+from dp import DP
+from valve import valve_factory
+
+from ryu.lib.packet import arp, ethernet, packet
+from ryu.lib.packet import vlan as packet_vlan
+from ryu.ofproto import ether
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+BENCHMARK_DP_ID = 0x1
+BENCHMARK_LOGNAME = 'faucet.benchmark'
+
+
+def synthetic_dp(n_ports, n_vlans, n_acl_rules, n_routes,
+                 hardware='Open vSwitch'):
+    """Return a DP with n_ports ports spread over n_vlans VLANs.
+
+    Port 1 is a trunk tagged on every VLAN, the remaining ports are
+    untagged on VLANs round robin. Every untagged port has an ACL of
+    n_acl_rules rules applied, and each VLAN has n_routes IPv4 routes
+    (and n_routes IPv6 routes) via gateways on the VLAN's controller_ips.
+    """
+    dp = DP(BENCHMARK_DP_ID, BENCHMARK_LOGNAME)
+    dp.hardware = hardware
+    vids = [100 + i for i in range(n_vlans)]
+    for i, vid in enumerate(vids):
+        routes = []
+        for route in range(n_routes):
+            routes.append({'route': {
+                'ip_dst': '172.%u.%u.0/24' % (16 + i % 16, route % 256),
+                'ip_gw': '10.%u.0.%u' % (i % 256, 1 + route % 250)}})
+            routes.append({'route': {
+                'ip_dst': 'fc%02x:%x::/64' % (i % 256, route),
+                'ip_gw': 'fc00:%x::%x' % (i, 1 + route % 250)}})
+        dp.add_vlan(vid, {
+            'controller_ips': [
+                '10.%u.0.254/16' % (i % 256), 'fc00:%x::254/64' % i],
+            'routes': routes,
+        })
+    if n_acl_rules:
+        dp.add_acl(1, [
+            {'rule': {
+                'dl_type': 0x800, 'nw_proto': 6, 'tp_dst': 1000 + rule,
+                'actions': {'allow': rule % 2}}}
+            for rule in range(n_acl_rules)])
+    dp.add_port(1, {'tagged_vlans': vids})
+    for port_num in range(2, n_ports + 1):
+        port_conf = {'native_vlan': vids[port_num % n_vlans]}
+        if n_acl_rules:
+            port_conf['acl_in'] = 1
+        dp.add_port(port_num, port_conf)
+    dp.sanity_check()
+    return dp
+
+
+def synthetic_packet(eth_src, vid):
+    """Return a tagged ARP request from eth_src, as received in a packet-in."""
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(
+        'ff:ff:ff:ff:ff:ff', eth_src, ether.ETH_TYPE_8021Q))
+    pkt.add_protocol(packet_vlan.vlan(vid=vid, ethertype=ether.ETH_TYPE_ARP))
+    pkt.add_protocol(arp.arp(
+        opcode=arp.ARP_REQUEST, src_mac=eth_src, src_ip='192.0.2.1',
+        dst_mac='00:00:00:00:00:00', dst_ip='192.0.2.2'))
+    pkt.serialize()
+    return packet.Packet(pkt.data)
+
+
+def synthetic_host_macs(n_hosts):
+    return ['0e:%02x:%02x:%02x:%02x:%02x' % (
+        (host >> 32) & 0xff, (host >> 24) & 0xff, (host >> 16) & 0xff,
+        (host >> 8) & 0xff, host & 0xff) for host in range(1, n_hosts + 1)]
+
+
+def proc_status_kb(field):
+    """Return a memory field of /proc/self/status in kB, or None."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset the process' peak RSS to its current RSS, if the OS can."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def rss_kb():
+    rss = proc_status_kb('VmRSS')
+    if rss is None:
+        return peak_rss_kb()
+    return rss
+
+
+def peak_rss_kb():
+    peak_rss = proc_status_kb('VmHWM')
+    if peak_rss is None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss
+
+
+class ValveBenchmark(object):
+    """Times Valve operations against a synthetic topology."""
+
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+
+    def new_dp(self):
+        return synthetic_dp(
+            self.args.ports, self.args.vlans,
+            self.args.acl_rules, self.args.routes, self.args.hardware)
+
+    def record(self, name, func, calls):
+        """Run func calls times and record the cost of the whole batch.
+
+        The memory recorded is how far the batch took the process' RSS
+        above where it started. Where the peak RSS can't be reset (not
+        Linux), only growth of the process' peak RSS can be seen.
+        """
+        gc.collect()
+        if reset_peak_rss():
+            start_kb = rss_kb()
+        else:
+            start_kb = peak_rss_kb()
+        start = time.time()
+        ofmsgs = 0
+        for call in calls:
+            result = func(*call)
+            if result:
+                ofmsgs += len(result)
+        elapsed = time.time() - start
+        peak_kb = max(0, peak_rss_kb() - start_kb)
+        result = self.results.setdefault(name, {
+            'calls': len(calls),
+            'ofmsgs': ofmsgs,
+            'wall_times': [],
+            'peak_memory_kb': 0})
+        result['wall_times'].append(elapsed)
+        result['peak_memory_kb'] = max(result['peak_memory_kb'], peak_kb)
+
+    def host_flow_removed(self, valve, dp):
+        """Return a hard timeout FlowRemoved for every learned host."""
+        flow_removed = []
+        for vlan in dp.vlans.itervalues():
+            for eth_src, host_cache_entry in vlan.host_cache.iteritems():
+                port_num = host_cache_entry.port_num
+                match = valve.valve_in_match(
+                    in_port=port_num, vlan=vlan, eth_src=eth_src)
+                msg = parser.OFPFlowRemoved(
+                    None, cookie=valve.valve_cookie(
+                        OWNER_HOST, vlan.vid, port_num),
+                    priority=dp.highest_priority - 1,
+                    reason=ofp.OFPRR_HARD_TIMEOUT, table_id=dp.eth_src_table,
+                    duration_sec=dp.timeout, duration_nsec=0,
+                    idle_timeout=0, hard_timeout=dp.timeout,
+                    packet_count=0, byte_count=0, match=match)
+                flow_removed.append((dp.dp_id, msg))
+        return flow_removed
+
+    def run_once(self):
+        dp = self.new_dp()
+        valve = valve_factory(dp)
+        dp_id = dp.dp_id
+        port_nums = sorted(dp.ports.keys())
+        vids = sorted(dp.vlans.keys())
+
+        self.record('datapath_connect', valve.datapath_connect,
+                    [(dp_id, port_nums)])
+        self.record('port_delete', valve.port_delete,
+                    [(dp_id, port_num) for port_num in port_nums])
+        self.record('port_add', valve.port_add,
+                    [(dp_id, port_num) for port_num in port_nums])
+
+        # learn hosts on the trunk port, spread across VLANs, as sent by
+        # the learn flow.
+        learn_cookie = valve.valve_cookie(OWNER_LEARN)
+        pkts = []
+        for i, eth_src in enumerate(synthetic_host_macs(self.args.hosts)):
+            vid = vids[i % len(vids)]
+            pkts.append((
+                dp_id, 1, vid, synthetic_packet(eth_src, vid), learn_cookie))
+        self.record('rcv_packet', valve.rcv_packet, pkts)
+
+        self.record('resolve_gateways', valve.resolve_gateways, [()])
+
+        # the learned hosts' flows time out on the datapath.
+        expire_time = time.time() + dp.timeout
+        valve.clock = lambda: expire_time
+        self.record('flow_removed', valve.flow_removed,
+                    self.host_flow_removed(valve, dp))
+        valve.clock = time.time
+
+        self.record('reload_config', valve.reload_config, [(self.new_dp(),)])
+
+    def run(self):
+        for _ in range(self.args.repeat):
+            self.run_once()
+        for result in self.results.itervalues():
+            wall_times = result['wall_times']
+            result['wall_time_min'] = min(wall_times)
+            result['wall_time_mean'] = sum(wall_times) / len(wall_times)
+        return {
+            'topology': {
+                'ports': self.args.ports,
+                'vlans': self.args.vlans,
+                'acl_rules': self.args.acl_rules,
+                'routes': self.args.routes,
+                'hosts': self.args.hosts,
+                'hardware': self.args.hardware,
+            },
+            'repeat': self.args.repeat,
+            'time': int(time.time()),
+            'results': self.results,
+        }
+
+
+def report(run, baseline=None, threshold=None):
+    """Print results, and flag operations slower than baseline by threshold.
+
+    Returns the names of regressed operations."""
+    regressions = []
+    print '%-20s %8s %10s %12s %12s %12s' % (
+        'operation', 'calls', 'ofmsgs', 'min (s)', 'mean (s)', 'peak kB')
+    for name in sorted(run['results']):
+        result = run['results'][name]
+        line = '%-20s %8u %10u %12.6f %12.6f %12u' % (
+            name, result['calls'], result['ofmsgs'],
+            result['wall_time_min'], result['wall_time_mean'],
+            result['peak_memory_kb'])
+        if baseline is not None and name in baseline['results']:
+            base_result = baseline['results'][name]
+            base_time = base_result['wall_time_min']
+            if base_time > 0:
+                ratio = result['wall_time_min'] / base_time
+                line += '  x%.2f time' % ratio
+                if threshold is not None and ratio > threshold:
+                    regressions.append(name)
+                    line += ' REGRESSION'
+            ofmsgs_delta = result['ofmsgs'] - base_result['ofmsgs']
+            if ofmsgs_delta:
+                line += '  %+d ofmsgs' % ofmsgs_delta
+        print line
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark Valve operations on a synthetic topology.')
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--vlans', type=int, default=4)
+    parser.add_argument('--acl-rules', type=int, default=10,
+                        help='rules in the ACL applied to untagged ports')
+    parser.add_argument('--routes', type=int, default=4,
+                        help='IPv4 and IPv6 routes per VLAN')
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help='hosts to learn via rcv_packet')
+    parser.add_argument('--hardware', default='Open vSwitch')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='save results as JSON to this file')
+    parser.add_argument('--compare',
+                        help='compare results with a previous JSON output')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='flag operations this many times slower '
+                             'than --compare (default 1.2)')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    # Valve logs every operation; don't let logging dominate the timings.
+    for logname in (BENCHMARK_LOGNAME, 'faucet'):
+        logger = logging.getLogger(logname)
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = 0
+        logger.setLevel(logging.CRITICAL)
+    run = ValveBenchmark(args).run()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = report(run, baseline, args.threshold)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(run, output_file, indent=2, sort_keys=True)
+    if regressions:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
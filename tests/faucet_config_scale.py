@@ -0,0 +1,356 @@
+#!/usr/bin/python
+
+# Scale test for FAUCET's configuration handling.
+#
+# Generates valid FAUCET configuration files of a configurable size - many
+# interfaces, many VLANs carried on tagged trunks, large ACLs with mirror
+# actions and mirror ports, and large IPv4 and IPv6 route tables via
+# controller_ips - and times how long FAUCET takes to start with them and
+# to reload them: DP.parser, sanity_check, valve_factory, datapath_connect
+# and reload_config. With --scale, the same configuration is generated at
+# several multiples of its size so the growth in cost can be seen.
+#
+# The default sizes run in seconds. --large starts from a much larger
+# configuration (1000 interfaces, 100 VLANs, 10 ACLs of 100 rules and 10
+# routes per VLAN), which takes minutes.
+#
+# Eg:
+#
+#   ./faucet_config_scale.py --scale 1,2,4
+#   ./faucet_config_scale.py --large --vlans 500
+#   ./faucet_config_scale.py --routes 1000 --write-config big.yaml
+#
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from faucet_benchmark import peak_rss_kb, reset_peak_rss
+from faucet_benchmark import BENCHMARK_DP_ID, BENCHMARK_LOGNAME
+from dp import DP
+from valve import valve_factory
+
+# VLAN IDs 1 and 4095 are reserved.
+FIRST_VID = 2
+MAX_VLANS = 4094 - FIRST_VID + 1
+# Every this many ACL rules mirrors to a mirror port.
+ACL_MIRROR_EVERY = 10
+# Configuration sizes by default, and with --large.
+DEFAULT_SIZES = {
+    'interfaces': 200,
+    'vlans': 20,
+    'acls': 4,
+    'acl_rules': 20,
+    'routes': 4,
+}
+LARGE_SIZES = {
+    'interfaces': 1000,
+    'vlans': 100,
+    'acls': 10,
+    'acl_rules': 100,
+    'routes': 10,
+}
+
+
+def vlan_controller_ips(vlan):
+    return ['10.%u.%u.254/24' % (vlan >> 8, vlan & 0xff),
+            'fc00:%x::254/64' % vlan]
+
+
+def vlan_routes(vlan, n_routes):
+    """Return n_routes IPv4 and n_routes IPv6 routes for the vlan'th VLAN.
+
+    Destinations are unique across VLANs, and gateways are on the VLAN's
+    controller_ips networks."""
+    routes = []
+    for route in range(n_routes):
+        dst = vlan * n_routes + route
+        routes.append({'route': {
+            'ip_dst': '%u.%u.%u.0/24' % (
+                20 + (dst >> 16), (dst >> 8) & 0xff, dst & 0xff),
+            'ip_gw': '10.%u.%u.%u' % (vlan >> 8, vlan & 0xff, 1 + route % 250),
+        }})
+        routes.append({'route': {
+            'ip_dst': 'fd00:%x:%x::/64' % (dst >> 16, dst & 0xffff),
+            'ip_gw': 'fc00:%x::%x' % (vlan, 1 + route % 250),
+        }})
+    return routes
+
+
+def acl_rules(acl_num, n_rules, mirror_ports):
+    """Return n_rules rules, some mirroring to mirror_ports in turn."""
+    rules = []
+    for rule in range(n_rules):
+        actions = {'allow': rule % 2}
+        if mirror_ports and rule % ACL_MIRROR_EVERY == 0:
+            actions['mirror'] = mirror_ports[
+                (acl_num + rule // ACL_MIRROR_EVERY) % len(mirror_ports)]
+        if rule % 3 == 2:
+            match = {'dl_type': 0x86dd, 'nw_proto': 17,
+                     'tp_dst': 1000 + rule % 60000}
+        else:
+            match = {'dl_type': 0x800, 'nw_proto': 6,
+                     'tp_dst': 1000 + rule % 60000}
+        match['actions'] = actions
+        rules.append({'rule': match})
+    return rules
+
+
+def scale_config(n_interfaces, n_vlans, n_trunks=1, n_acls=0,
+                 n_acl_rules=0, n_mirrors=0, n_routes=0,
+                 hardware='Open vSwitch'):
+    """Return a FAUCET configuration, as it would be loaded from YAML.
+
+    The first n_trunks interfaces are tagged on every VLAN, and the last
+    n_mirrors interfaces are mirror ports, each mirroring one of the
+    untagged interfaces in between. Untagged interfaces are spread over the
+    VLANs and ACLs round robin. Every VLAN has controller_ips and n_routes
+    routes each of IPv4 and IPv6."""
+    assert 0 < n_vlans <= MAX_VLANS
+    n_untagged = n_interfaces - n_trunks - n_mirrors
+    assert n_untagged > 0
+    assert n_mirrors <= n_untagged
+    vids = range(FIRST_VID, FIRST_VID + n_vlans)
+    vlans = {}
+    for vlan, vid in enumerate(vids):
+        vlan_conf = {
+            'name': 'vlan%u' % vid,
+            'controller_ips': vlan_controller_ips(vlan),
+        }
+        if n_routes:
+            vlan_conf['routes'] = vlan_routes(vlan, n_routes)
+        vlans[vid] = vlan_conf
+    mirror_ports = range(n_interfaces - n_mirrors + 1, n_interfaces + 1)
+    acls = {}
+    for acl in range(n_acls):
+        acls[acl + 1] = acl_rules(acl, n_acl_rules, mirror_ports)
+    interfaces = {}
+    for port_num in range(1, n_trunks + 1):
+        interfaces[port_num] = {
+            'name': 'trunk%u' % port_num,
+            'tagged_vlans': vids,
+        }
+    for untagged in range(n_untagged):
+        port_num = n_trunks + untagged + 1
+        port_conf = {
+            'name': 'port%u' % port_num,
+            'native_vlan': vids[untagged % n_vlans],
+        }
+        if n_acls:
+            port_conf['acl_in'] = untagged % n_acls + 1
+        interfaces[port_num] = port_conf
+    for mirror, port_num in enumerate(mirror_ports):
+        interfaces[port_num] = {
+            'name': 'mirror%u' % port_num,
+            'mirror': n_trunks + mirror + 1,
+        }
+    conf = {
+        'dp_id': BENCHMARK_DP_ID,
+        'name': 'scale',
+        'hardware': hardware,
+        'interfaces': interfaces,
+        'vlans': vlans,
+    }
+    if acls:
+        conf['acls'] = acls
+    return conf
+
+
+def write_config(conf, config_file):
+    with open(config_file, 'w') as stream:
+        yaml.safe_dump(conf, stream, default_flow_style=False)
+
+
+class ConfigScaleBenchmark(object):
+    """Times FAUCET's handling of generated configs of increasing size."""
+
+    def __init__(self, args):
+        self.args = args
+
+    def scaled(self, scale):
+        args = self.args
+        return {
+            'interfaces': args.interfaces * scale,
+            'vlans': min(args.vlans * scale, MAX_VLANS),
+            'trunks': args.trunks,
+            'acls': args.acls,
+            'acl_rules': args.acl_rules * scale,
+            'mirrors': args.mirrors,
+            'routes': args.routes * scale,
+        }
+
+    def config(self, size):
+        return scale_config(
+            size['interfaces'], size['vlans'], size['trunks'],
+            size['acls'], size['acl_rules'], size['mirrors'], size['routes'],
+            self.args.hardware)
+
+    def run_once(self, config_file):
+        """Start FAUCET with config_file then reload it, timing each step."""
+        times = {}
+
+        def timed(name, func, *args):
+            start = time.time()
+            result = func(*args)
+            times[name] = time.time() - start
+            return result
+
+        dp = timed('parser', DP.parser, config_file, BENCHMARK_LOGNAME)
+        timed('sanity_check', dp.sanity_check)
+        valve = timed('valve_factory', valve_factory, dp)
+        ofmsgs = timed(
+            'datapath_connect', valve.datapath_connect,
+            dp.dp_id, sorted(dp.ports.keys()))
+        start = time.time()
+        new_dp = DP.parser(config_file, BENCHMARK_LOGNAME)
+        new_dp.sanity_check()
+        timed('reload_config', valve.reload_config, new_dp)
+        # reload as FAUCET does it, from reading the file to the flowmods.
+        times['reload_total'] = time.time() - start
+        return times, len(ofmsgs)
+
+    def run_scale(self, scale):
+        size = self.scaled(scale)
+        # report each scale's own peak, not the largest so far.
+        reset_peak_rss()
+        start = time.time()
+        conf = self.config(size)
+        generate_time = time.time() - start
+        handle, config_file = tempfile.mkstemp(suffix='.yaml')
+        os.close(handle)
+        try:
+            write_config(conf, config_file)
+            config_bytes = os.path.getsize(config_file)
+            runs = [self.run_once(config_file)
+                    for _ in range(self.args.repeat)]
+        finally:
+            os.remove(config_file)
+        wall_times = {}
+        for name in runs[0][0]:
+            wall_times[name] = min([times[name] for times, _ in runs])
+        return {
+            'scale': scale,
+            'size': size,
+            'config_bytes': config_bytes,
+            'generate_time': generate_time,
+            'wall_time_min': wall_times,
+            'ofmsgs': runs[0][1],
+            'peak_rss_kb': peak_rss_kb(),
+        }
+
+    def run(self):
+        return {
+            'hardware': self.args.hardware,
+            'repeat': self.args.repeat,
+            'time': int(time.time()),
+            'results': [self.run_scale(scale) for scale in self.args.scale],
+        }
+
+
+STEPS = ('parser', 'sanity_check', 'valve_factory', 'datapath_connect',
+         'reload_config', 'reload_total')
+
+
+def report(run):
+    print '%-6s %7s %6s %7s %7s %9s' % (
+        'scale', 'ports', 'vlans', 'rules', 'routes', 'kbytes'),
+    print ' '.join(['%16s' % step for step in STEPS]),
+    print '%8s %12s' % ('ofmsgs', 'peak rss kB')
+    for result in run['results']:
+        size = result['size']
+        print '%-6u %7u %6u %7u %7u %9u' % (
+            result['scale'], size['interfaces'], size['vlans'],
+            size['acls'] * size['acl_rules'],
+            size['vlans'] * size['routes'] * 2,
+            result['config_bytes'] / 1024),
+        print ' '.join([
+            '%16.3f' % result['wall_time_min'][step] for step in STEPS]),
+        print '%8u %12u' % (result['ofmsgs'], result['peak_rss_kb'])
+
+
+def parse_scale(scale):
+    return [int(multiple) for multiple in scale.split(',')]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Time FAUCET starting and reloading generated configs.')
+    parser.add_argument('--large', action='store_true',
+                        help='default to a large configuration, which '
+                             'takes minutes rather than seconds')
+    parser.add_argument('--interfaces', type=int)
+    parser.add_argument('--vlans', type=int)
+    parser.add_argument('--trunks', type=int, default=2,
+                        help='interfaces tagged on every VLAN')
+    parser.add_argument('--acls', type=int)
+    parser.add_argument('--acl-rules', type=int,
+                        help='rules in each ACL')
+    parser.add_argument('--mirrors', type=int, default=2,
+                        help='mirror ports, used by ACL rules')
+    parser.add_argument('--routes', type=int,
+                        help='IPv4 and IPv6 routes per VLAN')
+    parser.add_argument('--hardware', default='Open vSwitch')
+    parser.add_argument('--scale', type=parse_scale, default=[1],
+                        help='multiples of interfaces, VLANs, ACL rules and '
+                             'routes to time, eg 1,2,4')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--write-config',
+                        help='only write the config (at the first --scale) '
+                             'to this file')
+    parser.add_argument('--output', help='save results as JSON to this file')
+    args = parser.parse_args(argv)
+    sizes = DEFAULT_SIZES
+    if args.large:
+        sizes = LARGE_SIZES
+    for name, size in sizes.iteritems():
+        if getattr(args, name) is None:
+            setattr(args, name, size)
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    benchmark = ConfigScaleBenchmark(args)
+    if args.write_config:
+        write_config(
+            benchmark.config(benchmark.scaled(args.scale[0])),
+            args.write_config)
+        return 0
+    for logname in (BENCHMARK_LOGNAME, 'faucet'):
+        logger = logging.getLogger(logname)
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = 0
+        logger.setLevel(logging.CRITICAL)
+    run = benchmark.run()
+    report(run)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(run, output_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,595 @@
+#!/usr/bin/python
+
+# OpenFlow load generator for FAUCET and Gauge.
+#
+# Connects to a running controller over TCP as one or many OpenFlow 1.3
+# switches, so the controller is measured with ryu's real network stack.
+# Each switch answers the controller's handshake, echo, barrier and stats
+# requests (with synthetic port stats and flow tables), and sends packet-ins
+# at a fixed rate from a configurable mix of:
+#
+#   learn  a broadcast ARP from a new MAC, as sent by FAUCET's learn flow
+#   arp    an ARP request for the VLAN's controller IPv4 address
+#   nd     a neighbor solicitation for the VLAN's controller IPv6 address
+#   icmp   an ICMP echo request to the VLAN's controller IPv4 address
+#
+# The response to a packet-in is taken to be the first flowmod or
+# packet-out from the controller that refers to the packet's source MAC,
+# and the latency percentiles of responses and the throughput are
+# reported, along with the round trip time of echo requests.
+#
+# FAUCET controls one datapath, so it should be configured with --dp-id and
+# with --ports, --vid and the controller IPs on that VLAN. Switches beyond
+# the first then only load ryu. Gauge polls as many datapaths as it is
+# configured for.
+#
+# Eg:
+#
+#   ./faucet_loadgen.py --rate 500 --duration 30 --mix learn=8,arp=1,icmp=1
+#   ./faucet_loadgen.py --port 6654 --switches 20 --rate 0 --flows 2000
+#
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import collections
+import ipaddr
+import json
+import os
+import random
+import select
+import socket
+import struct
+import sys
+import time
+
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from cookie import flow_cookie
+from cookie import OWNER_LEARN, OWNER_CONTROLLER_ARP, OWNER_CONTROLLER_ICMP
+from cookie import OWNER_CONTROLLER_ICMPV6
+from valve import Valve
+
+from ryu.lib import addrconv
+from ryu.lib import mac
+from ryu.lib.packet import arp, ethernet, icmp, icmpv6, ipv4, ipv6, packet
+from ryu.lib.packet import vlan as packet_vlan
+from ryu.ofproto import ether
+from ryu.ofproto import inet
+from ryu.ofproto import ofproto_common
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+# packet-ins are sent as if from FAUCET's eth_src table, which has the
+# learn and controller IP flows.
+PACKET_IN_TABLE_ID = 2
+# largest OpenFlow message, replies are split to fit.
+MAX_MSG_LEN = 0xffff
+# offsets into messages from the controller.
+FLOW_MOD_MATCH_OFFSET = ofp.OFP_FLOW_MOD_SIZE - ofp.OFP_MATCH_SIZE
+PACKET_OUT_ACTIONS_OFFSET = ofp.OFP_PACKET_OUT_SIZE
+
+PACKET_IN_KINDS = ('learn', 'arp', 'nd', 'icmp')
+
+
+def of_msg(msg_type, xid, body=''):
+    return struct.pack(
+        ofp.OFP_HEADER_PACK_STR, ofp.OFP_VERSION, msg_type,
+        ofp.OFP_HEADER_SIZE + len(body), xid) + body
+
+
+def serialize(obj):
+    """Return the bytes of a ryu match or instruction."""
+    buf = bytearray()
+    obj.serialize(buf, 0)
+    return str(buf)
+
+
+def multipart_replies(xid, mp_type, entries):
+    """Return multipart replies of entries, split to fit in messages."""
+    max_body = MAX_MSG_LEN - ofp.OFP_MULTIPART_REPLY_SIZE
+    bodies = ['']
+    for entry in entries:
+        if len(bodies[-1]) + len(entry) > max_body:
+            bodies.append('')
+        bodies[-1] += entry
+    msgs = []
+    for i, body in enumerate(bodies):
+        flags = 0
+        if i < len(bodies) - 1:
+            flags = ofp.OFPMPF_REPLY_MORE
+        msgs.append(of_msg(ofp.OFPT_MULTIPART_REPLY, xid, struct.pack(
+            ofp.OFP_MULTIPART_REPLY_PACK_STR, mp_type, flags) + body))
+    return msgs
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def host_mac(host):
+    return '0e:02:%02x:%02x:%02x:%02x' % (
+        (host >> 24) & 0xff, (host >> 16) & 0xff, (host >> 8) & 0xff,
+        host & 0xff)
+
+
+class PacketInMix(object):
+    """Builds the data and cookies of the packet-ins to send."""
+
+    def __init__(self, args):
+        self.vid = args.vid
+        self.n_hosts = args.hosts
+        self.ipv4 = ipaddr.IPNetwork(args.ipv4)
+        self.ipv6 = ipaddr.IPNetwork(args.ipv6)
+        self.cookies = {
+            'learn': flow_cookie(args.cookie, OWNER_LEARN),
+            'arp': flow_cookie(args.cookie, OWNER_CONTROLLER_ARP, args.vid),
+            'icmp': flow_cookie(args.cookie, OWNER_CONTROLLER_ICMP, args.vid),
+            'nd': flow_cookie(args.cookie, OWNER_CONTROLLER_ICMPV6, args.vid),
+        }
+        self.weights = []
+        for kind, weight in args.mix.iteritems():
+            self.weights.extend([kind] * weight)
+        self.learn_template = self.eth_vlan(
+            mac.BROADCAST_STR, host_mac(0), ether.ETH_TYPE_ARP)
+        self.learn_template.add_protocol(arp.arp(
+            opcode=arp.ARP_REQUEST, src_mac=host_mac(0),
+            src_ip=str(self.host_ip(self.ipv4, 0)),
+            dst_mac='00:00:00:00:00:00',
+            dst_ip=str(self.host_ip(self.ipv4, 1))))
+        self.learn_template.serialize()
+        self.learn_template = str(self.learn_template.data)
+        self.next_learn_host = self.n_hosts
+        self.data_cache = {}
+
+    def eth_vlan(self, eth_dst, eth_src, ethertype):
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(
+            eth_dst, eth_src, ether.ETH_TYPE_8021Q))
+        pkt.add_protocol(packet_vlan.vlan(vid=self.vid, ethertype=ethertype))
+        return pkt
+
+    @staticmethod
+    def host_ip(network, host):
+        """Return the host'th address on network, other than the network's
+        own address (the controller IP)."""
+        host_ip = int(network.network) + 1 + (
+            host % min(network.numhosts - 3, 2**24))
+        if host_ip >= int(network.ip):
+            host_ip += 1
+        return ipaddr.IPAddress(host_ip, network.version)
+
+    def choose(self):
+        """Return (kind, eth_src, data, cookie) of a packet-in to send."""
+        kind = random.choice(self.weights)
+        if kind == 'learn':
+            # a new host every time, so every packet-in is learned.
+            eth_src = host_mac(self.next_learn_host)
+            self.next_learn_host += 1
+            data = (self.learn_template[:6] +
+                    addrconv.mac.text_to_bin(eth_src) +
+                    self.learn_template[12:])
+        else:
+            host = random.randint(0, self.n_hosts - 1)
+            eth_src = host_mac(host)
+            key = (kind, host)
+            if key not in self.data_cache:
+                self.data_cache[key] = getattr(self, '%s_data' % kind)(
+                    host, eth_src)
+            data = self.data_cache[key]
+        return kind, eth_src, data, self.cookies[kind]
+
+    def arp_data(self, host, eth_src):
+        pkt = self.eth_vlan(mac.BROADCAST_STR, eth_src, ether.ETH_TYPE_ARP)
+        pkt.add_protocol(arp.arp(
+            opcode=arp.ARP_REQUEST, src_mac=eth_src,
+            src_ip=str(self.host_ip(self.ipv4, host)),
+            dst_mac='00:00:00:00:00:00', dst_ip=str(self.ipv4.ip)))
+        pkt.serialize()
+        return str(pkt.data)
+
+    def icmp_data(self, host, eth_src):
+        pkt = self.eth_vlan(Valve.FAUCET_MAC, eth_src, ether.ETH_TYPE_IP)
+        pkt.add_protocol(ipv4.ipv4(
+            src=str(self.host_ip(self.ipv4, host)), dst=str(self.ipv4.ip),
+            proto=inet.IPPROTO_ICMP))
+        pkt.add_protocol(icmp.icmp(
+            type_=icmp.ICMP_ECHO_REQUEST, code=0,
+            data=icmp.echo(id_=host & 0xffff, seq=1, data='loadgen')))
+        pkt.serialize()
+        return str(pkt.data)
+
+    def nd_data(self, host, eth_src):
+        target = int(self.ipv6.ip)
+        solicited_node = ipaddr.IPv6Address(
+            int(ipaddr.IPv6Address('ff02::1:ff00:0')) | (target & 0xffffff))
+        pkt = self.eth_vlan(
+            '33:33:ff:%02x:%02x:%02x' % (
+                (target >> 16) & 0xff, (target >> 8) & 0xff, target & 0xff),
+            eth_src, ether.ETH_TYPE_IPV6)
+        pkt.add_protocol(ipv6.ipv6(
+            src=str(self.host_ip(self.ipv6, host)), dst=str(solicited_node),
+            nxt=inet.IPPROTO_ICMPV6, hop_limit=255))
+        pkt.add_protocol(icmpv6.icmpv6(
+            type_=icmpv6.ND_NEIGHBOR_SOLICIT,
+            data=icmpv6.nd_neighbor(
+                dst=str(self.ipv6.ip),
+                option=icmpv6.nd_option_sla(hw_src=eth_src))))
+        pkt.serialize()
+        return str(pkt.data)
+
+
+class LoadSwitch(object):
+    """An OpenFlow 1.3 switch connected to the controller."""
+
+    def __init__(self, dp_id, args, mix, stats):
+        self.dp_id = dp_id
+        self.args = args
+        self.mix = mix
+        self.stats = stats
+        self.sock = socket.create_connection((args.controller, args.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buf = ''
+        self.xid = 0
+        self.connected = time.time()
+        self.next_packet_in = self.connected + args.warmup
+        self.next_echo = self.connected + args.warmup
+        # source MAC -> [(time sent, kind)] of packet-ins awaiting response.
+        self.pending = {}
+        self.echoes = {}
+        self.closed = False
+        self.send(of_msg(ofp.OFPT_HELLO, self.next_xid()))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def next_xid(self):
+        self.xid = (self.xid + 1) & 0xffffffff
+        return self.xid
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def tick(self, now):
+        """Send the packet-ins and echo requests now due.
+
+        Returns the time the next one is due."""
+        if self.args.rate:
+            interval = 1.0 / self.args.rate
+            while self.next_packet_in <= now:
+                self.send_packet_in(now)
+                self.next_packet_in += interval
+        if self.args.echo_interval and self.next_echo <= now:
+            xid = self.next_xid()
+            self.echoes[xid] = now
+            self.send(of_msg(ofp.OFPT_ECHO_REQUEST, xid))
+            self.next_echo = now + self.args.echo_interval
+        next_due = []
+        if self.args.rate:
+            next_due.append(self.next_packet_in)
+        if self.args.echo_interval:
+            next_due.append(self.next_echo)
+        if next_due:
+            return min(next_due)
+        return None
+
+    def send_packet_in(self, now):
+        kind, eth_src, data, cookie = self.mix.choose()
+        in_port = random.randint(1, self.args.ports)
+        match = serialize(parser.OFPMatch(in_port=in_port))
+        max_len = self.args.max_len
+        self.send(of_msg(
+            ofp.OFPT_PACKET_IN, self.next_xid(),
+            struct.pack(ofp.OFP_PACKET_IN_PACK_STR, ofp.OFP_NO_BUFFER,
+                        len(data), ofp.OFPR_ACTION, PACKET_IN_TABLE_ID,
+                        cookie) +
+            match + '\x00\x00' + data[:max_len]))
+        self.pending.setdefault(eth_src, []).append((now, kind))
+        self.stats.sent[kind] += 1
+
+    def receive(self):
+        data = self.sock.recv(65536)
+        if not data:
+            self.closed = True
+            return
+        self.buf += data
+        now = time.time()
+        while len(self.buf) >= ofp.OFP_HEADER_SIZE:
+            _, msg_type, msg_len, xid = struct.unpack_from(
+                ofp.OFP_HEADER_PACK_STR, self.buf)
+            if len(self.buf) < msg_len:
+                break
+            msg = self.buf[:msg_len]
+            self.buf = self.buf[msg_len:]
+            self.handle(now, msg_type, xid, msg)
+
+    def handle(self, now, msg_type, xid, msg):
+        stats = self.stats
+        stats.received[msg_type] += 1
+        if msg_type == ofp.OFPT_FEATURES_REQUEST:
+            self.send(of_msg(ofp.OFPT_FEATURES_REPLY, xid, struct.pack(
+                ofp.OFP_SWITCH_FEATURES_PACK_STR, self.dp_id, 0, 254, 0,
+                ofp.OFPC_FLOW_STATS | ofp.OFPC_PORT_STATS, 0)))
+        elif msg_type == ofp.OFPT_ECHO_REQUEST:
+            self.send(of_msg(
+                ofp.OFPT_ECHO_REPLY, xid, msg[ofp.OFP_HEADER_SIZE:]))
+        elif msg_type == ofp.OFPT_ECHO_REPLY:
+            if xid in self.echoes:
+                stats.latency['echo'].append(now - self.echoes.pop(xid))
+        elif msg_type == ofp.OFPT_BARRIER_REQUEST:
+            self.send(of_msg(ofp.OFPT_BARRIER_REPLY, xid))
+        elif msg_type == ofp.OFPT_GET_CONFIG_REQUEST:
+            self.send(of_msg(ofp.OFPT_GET_CONFIG_REPLY, xid, struct.pack(
+                ofp.OFP_SWITCH_CONFIG_PACK_STR, ofp.OFPC_FRAG_NORMAL,
+                ofp.OFPCML_MAX)))
+        elif msg_type == ofp.OFPT_MULTIPART_REQUEST:
+            mp_type, _ = struct.unpack_from(
+                ofp.OFP_MULTIPART_REQUEST_PACK_STR, msg, ofp.OFP_HEADER_SIZE)
+            stats.multipart[mp_type] += 1
+            for reply in multipart_replies(
+                    xid, mp_type, self.multipart_entries(mp_type, now)):
+                self.send(reply)
+        elif msg_type == ofp.OFPT_FLOW_MOD:
+            if self.pending:
+                match = parser.OFPMatch.parser(msg, FLOW_MOD_MATCH_OFFSET)
+                for field in ('eth_src', 'eth_dst'):
+                    if self.responded(now, match.get(field, None)):
+                        break
+        elif msg_type == ofp.OFPT_PACKET_OUT:
+            if self.pending:
+                _, _, actions_len = struct.unpack_from(
+                    ofp.OFP_PACKET_OUT_PACK_STR, msg, ofp.OFP_HEADER_SIZE)
+                data_offset = PACKET_OUT_ACTIONS_OFFSET + actions_len
+                eth_dst = msg[data_offset:data_offset + 6]
+                if len(eth_dst) == 6:
+                    self.responded(now, addrconv.mac.bin_to_text(eth_dst))
+
+    def responded(self, now, eth_addr):
+        """Record the response to the oldest packet-in from eth_addr."""
+        if eth_addr is None or isinstance(eth_addr, tuple):
+            return False
+        waiting = self.pending.get(eth_addr, None)
+        if not waiting:
+            return False
+        sent, kind = waiting.pop(0)
+        if not waiting:
+            del self.pending[eth_addr]
+        self.stats.latency[kind].append(now - sent)
+        return True
+
+    def multipart_entries(self, mp_type, now):
+        if mp_type == ofp.OFPMP_PORT_DESC:
+            return [self.port(port_no) for port_no in self.port_nos()]
+        if mp_type == ofp.OFPMP_PORT_STATS:
+            return [self.port_stats(port_no, now)
+                    for port_no in self.port_nos()]
+        if mp_type == ofp.OFPMP_FLOW:
+            return self.flow_stats(now)
+        # eg. table features and group descriptions, which are optional.
+        return []
+
+    def port_nos(self):
+        return range(1, self.args.ports + 1)
+
+    def port(self, port_no):
+        return struct.pack(
+            ofp.OFP_PORT_PACK_STR, port_no,
+            addrconv.mac.text_to_bin('0e:03:00:00:%02x:%02x' % (
+                port_no >> 8, port_no & 0xff)),
+            'port%u' % port_no, 0, 0, ofp.OFPPF_1GB_FD, ofp.OFPPF_1GB_FD,
+            ofp.OFPPF_1GB_FD, 0, 1000000, 1000000)
+
+    def port_stats(self, port_no, now):
+        # counters that grow steadily with time.
+        elapsed = int(now - self.connected)
+        packets = elapsed * 1000 + port_no
+        return struct.pack(
+            ofp.OFP_PORT_STATS_PACK_STR, port_no, packets, packets,
+            packets * 500, packets * 500, 0, 0, 0, 0, 0, 0, 0, 0,
+            elapsed, 0)
+
+    def flow_stats(self, now):
+        """Return flow stats entries of a synthetic table of eth_dst flows."""
+        entries = []
+        duration = int(now - self.connected)
+        for flow in range(self.args.flows):
+            match = serialize(parser.OFPMatch(
+                vlan_vid=self.args.vid | ofp.OFPVID_PRESENT,
+                eth_dst=host_mac(flow)))
+            inst = serialize(parser.OFPInstructionActions(
+                ofp.OFPIT_APPLY_ACTIONS, [parser.OFPActionOutput(
+                    1 + flow % self.args.ports)]))
+            length = ofp.OFP_FLOW_STATS_0_SIZE + len(match) + len(inst)
+            entries.append(struct.pack(
+                ofp.OFP_FLOW_STATS_0_PACK_STR, length, 3, duration, 0,
+                9001, 300, 0, 0, flow_cookie(self.args.cookie),
+                duration * 10, duration * 5000) + match + inst)
+        return entries
+
+
+class LoadStats(object):
+
+    def __init__(self):
+        self.sent = collections.defaultdict(int)
+        self.received = collections.defaultdict(int)
+        self.multipart = collections.defaultdict(int)
+        self.latency = collections.defaultdict(list)
+
+
+def msg_type_names():
+    names = {}
+    for name in dir(ofp):
+        if name.startswith('OFPT_'):
+            names[getattr(ofp, name)] = name
+    return names
+
+
+def mp_type_names():
+    names = {}
+    for name in dir(ofp):
+        if name.startswith('OFPMP_') and name != 'OFPMP_EXPERIMENTER':
+            value = getattr(ofp, name)
+            if isinstance(value, int) and value < 0xffff:
+                names.setdefault(value, name)
+    return names
+
+
+def run_load(args):
+    stats = LoadStats()
+    mix = PacketInMix(args)
+    switches = [
+        LoadSwitch(args.dp_id + i, args, mix, stats)
+        for i in range(args.switches)]
+    start = time.time()
+    end = start + args.warmup + args.duration
+    now = start
+    while now < end and switches:
+        next_due = end
+        for switch in switches:
+            switch_due = switch.tick(now)
+            if switch_due is not None:
+                next_due = min(next_due, switch_due)
+        timeout = max(0, next_due - time.time())
+        readable, _, _ = select.select(switches, [], [], timeout)
+        for switch in readable:
+            switch.receive()
+        for switch in [switch for switch in switches if switch.closed]:
+            print 'controller closed connection of dp_id %x' % switch.dp_id
+            switches.remove(switch)
+        now = time.time()
+    for switch in switches:
+        switch.sock.close()
+    return stats
+
+
+def results(args, stats):
+    msg_names = msg_type_names()
+    mp_names = mp_type_names()
+    latency = {}
+    for kind, values in stats.latency.iteritems():
+        values.sort()
+        latency[kind] = {
+            'responses': len(values),
+            'p50_ms': percentile(values, 0.5) * 1000,
+            'p90_ms': percentile(values, 0.9) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': percentile(values, 1.0) * 1000,
+        }
+    responses = sum([len(stats.latency[kind]) for kind in PACKET_IN_KINDS])
+    return {
+        'switches': args.switches,
+        'rate': args.rate,
+        'duration': args.duration,
+        'sent': dict(stats.sent),
+        'latency': latency,
+        'packet_ins_per_sec': sum(stats.sent.values()) / float(args.duration),
+        'responses_per_sec': responses / float(args.duration),
+        'flowmods_per_sec': (
+            stats.received[ofp.OFPT_FLOW_MOD] / float(args.duration)),
+        'received': dict([
+            (msg_names.get(msg_type, str(msg_type)), count)
+            for msg_type, count in stats.received.iteritems()]),
+        'multipart_requests': dict([
+            (mp_names.get(mp_type, str(mp_type)), count)
+            for mp_type, count in stats.multipart.iteritems()]),
+    }
+
+
+def report(run):
+    print '%-8s %8s %10s %10s %10s %10s %10s' % (
+        'kind', 'sent', 'responses', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)',
+        'max (ms)')
+    for kind in PACKET_IN_KINDS + ('echo',):
+        if kind not in run['latency'] and kind not in run['sent']:
+            continue
+        latency = run['latency'].get(kind, {})
+        print '%-8s %8s %10u %10.3f %10.3f %10.3f %10.3f' % (
+            kind, run['sent'].get(kind, ''), latency.get('responses', 0),
+            latency.get('p50_ms', 0), latency.get('p90_ms', 0),
+            latency.get('p99_ms', 0), latency.get('max_ms', 0))
+    print '%.1f packet-ins/s, %.1f responses/s, %.1f flowmods/s' % (
+        run['packet_ins_per_sec'], run['responses_per_sec'],
+        run['flowmods_per_sec'])
+    for name, count in sorted(run['received'].iteritems()):
+        print 'received %-28s %u' % (name, count)
+    for name, count in sorted(run['multipart_requests'].iteritems()):
+        print 'answered %-28s %u' % (name, count)
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in PACKET_IN_KINDS:
+            raise argparse.ArgumentTypeError('unknown packet-in kind %s' % kind)
+        weights[kind] = int(weight or 1)
+    return weights
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Load a running FAUCET or Gauge as OpenFlow switches.')
+    parser.add_argument('--controller', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=ofproto_common.OFP_TCP_PORT)
+    parser.add_argument('--switches', type=int, default=1)
+    parser.add_argument('--dp-id', type=lambda x: int(x, 0), default=1,
+                        help='dp_id of the first switch, the rest follow')
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--vid', type=int, default=100,
+                        help='VLAN packet-ins are tagged with')
+    parser.add_argument('--ipv4', default='10.0.0.254/24',
+                        help='controller IPv4 address on the VLAN')
+    parser.add_argument('--ipv6', default='fc00::254/64',
+                        help='controller IPv6 address on the VLAN')
+    parser.add_argument('--cookie', type=int, default=1524372928,
+                        help='the cookie configured for FAUCET')
+    parser.add_argument('--rate', type=float, default=100,
+                        help='packet-ins per second, per switch')
+    parser.add_argument('--mix', type=parse_mix, default='learn=1',
+                        help='weights of packet-in kinds, eg. '
+                             'learn=8,arp=1,nd=1,icmp=1')
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help='hosts sending arp, nd and icmp packet-ins')
+    parser.add_argument('--max-len', type=int, default=ofp.OFPCML_NO_BUFFER,
+                        help='bytes of each packet to send')
+    parser.add_argument('--flows', type=int, default=0,
+                        help='flows in flow stats replies')
+    parser.add_argument('--echo-interval', type=float, default=1.0,
+                        help='seconds between echo requests (0 for none)')
+    parser.add_argument('--warmup', type=float, default=2.0,
+                        help='seconds to wait after connecting, for the '
+                             'controller to configure the switches')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', help='save results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    stats = run_load(args)
+    run = results(args, stats)
+    report(run)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(run, output_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
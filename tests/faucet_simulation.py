@@ -0,0 +1,257 @@
+#!/usr/bin/python
+
+# End to end simulation of FAUCET controlling a simulated datapath.
+#
+# Valve is connected to a FakeDatapath (see fake_datapath.py) with a
+# synthetic topology, and simulated hosts on the datapath's untagged ports
+# send packets through it. Without ryu, OVS or mininet this measures, at
+# thousands of hosts on one machine: how many rounds of traffic it takes
+# until all hosts' packets are forwarded without packet-ins or flooding,
+# how many packet-ins per second are handled, and how many flowmods are
+# sent per learned host.
+#
+# Eg:
+#
+#   ./faucet_simulation.py --ports 48 --vlans 4 --hosts 5000
+#   ./faucet_simulation.py --hosts 1000 --timeout 2 --expire
+#
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+from faucet_benchmark import synthetic_dp, peak_rss_kb, BENCHMARK_LOGNAME
+from fake_datapath import FakeDatapath, ValveDriver
+from fake_datapath import arp_request, unicast_packet
+from valve import valve_factory
+
+
+class SimulatedHost(object):
+
+    def __init__(self, eth_src, ip, port_num, vid):
+        self.eth_src = eth_src
+        self.ip = ip
+        self.port_num = port_num
+        self.vid = vid
+
+
+def simulated_hosts(dp, n_hosts):
+    """Return n_hosts hosts spread over dp's untagged ports, by VLAN."""
+    untagged_ports = []
+    for vlan in dp.vlans.itervalues():
+        untagged_ports.extend([
+            (port.number, vlan.vid) for port in vlan.untagged])
+    untagged_ports.sort()
+    hosts = {}
+    for host in range(n_hosts):
+        port_num, vid = untagged_ports[host % len(untagged_ports)]
+        eth_src = '0e:01:%02x:%02x:%02x:%02x' % (
+            (host >> 24) & 0xff, (host >> 16) & 0xff, (host >> 8) & 0xff,
+            host & 0xff)
+        ip = '192.168.%u.%u' % ((host >> 8) & 0xff, host & 0xff)
+        hosts.setdefault(vid, []).append(
+            SimulatedHost(eth_src, ip, port_num, vid))
+    return hosts
+
+
+class FaucetSimulation(object):
+    """Runs phases of traffic through a Valve driven FakeDatapath."""
+
+    def __init__(self, args):
+        self.args = args
+        self.dp = synthetic_dp(
+            args.ports, args.vlans, args.acl_rules, args.routes)
+        self.dp.timeout = args.timeout
+        self.valve = valve_factory(self.dp)
+        self.datapath = FakeDatapath(
+            self.dp.dp_id, self.dp.ports.keys(), args.table_size)
+        self.driver = ValveDriver(self.valve, self.datapath)
+        self.hosts = simulated_hosts(self.dp, args.hosts)
+        self.results = []
+
+    def learned_hosts(self):
+        return sum([
+            len(vlan.host_cache) for vlan in self.dp.vlans.itervalues()])
+
+    def phase(self, name, func, *args):
+        """Run func, recording the messages exchanged and the time taken."""
+        sent = dict(self.driver.sent)
+        received = dict(self.driver.received)
+        start = time.time()
+        extra = func(*args) or {}
+        elapsed = time.time() - start
+        result = {
+            'phase': name,
+            'wall_time': elapsed,
+            'packet_ins': self.driver.received['OFPPacketIn'] -
+                          received.get('OFPPacketIn', 0),
+            'flowmods': self.driver.sent['OFPFlowMod'] -
+                        sent.get('OFPFlowMod', 0),
+            'flows': self.datapath.flow_count(),
+            'learned_hosts': self.learned_hosts(),
+            'peak_rss_kb': peak_rss_kb(),
+        }
+        result.update(extra)
+        self.results.append(result)
+        return result
+
+    def learn(self):
+        """Every host ARPs for its VLAN's first host."""
+        for vid_hosts in self.hosts.itervalues():
+            target = vid_hosts[0]
+            for host in vid_hosts:
+                self.driver.receive(host.port_num, arp_request(
+                    host.eth_src, host.ip, target.ip))
+
+    def unicast_round(self):
+        """Every host sends a packet to the next host on its VLAN.
+
+        Returns the number of packets flooded."""
+        flooded = 0
+        for vid_hosts in self.hosts.itervalues():
+            for i, host in enumerate(vid_hosts):
+                dst = vid_hosts[(i + 1) % len(vid_hosts)]
+                outputs = self.driver.receive(
+                    host.port_num, unicast_packet(host.eth_src, dst.eth_src))
+                if len(outputs) > 1:
+                    flooded += 1
+        return {'flooded': flooded}
+
+    def converge(self, name):
+        """Run unicast rounds until there are no packet-ins or floods."""
+        for rounds in range(1, self.args.max_rounds + 1):
+            result = self.phase(
+                '%s round %u' % (name, rounds), self.unicast_round)
+            if not result['packet_ins'] and not result['flooded']:
+                return rounds
+        return None
+
+    def port_flap(self):
+        port_num = self.hosts.values()[0][0].port_num
+        self.driver.port_status_change(port_num, False)
+        self.driver.port_status_change(port_num, True)
+
+    def expire(self):
+        # Valve compares flow removed messages with its own clock, so
+        # flows time out in real time.
+        time.sleep(self.args.timeout + 1)
+        self.driver.host_expire()
+
+    def run(self):
+        self.phase('connect', self.driver.connect)
+        self.phase('learn', self.learn)
+        learn_result = self.results[-1]
+        convergence = {'learn': self.converge('learn')}
+        self.phase('port flap', self.port_flap)
+        convergence['port flap'] = self.converge('port flap')
+        if self.args.expire:
+            self.phase('expire', self.expire)
+            self.phase('relearn', self.learn)
+            convergence['relearn'] = self.converge('relearn')
+        learned = max(learn_result['learned_hosts'], 1)
+        packet_in_rate = 0
+        if learn_result['wall_time'] > 0:
+            packet_in_rate = (
+                learn_result['packet_ins'] / learn_result['wall_time'])
+        return {
+            'topology': {
+                'ports': self.args.ports,
+                'vlans': self.args.vlans,
+                'acl_rules': self.args.acl_rules,
+                'routes': self.args.routes,
+                'hosts': self.args.hosts,
+            },
+            'time': int(time.time()),
+            'phases': self.results,
+            'convergence_rounds': convergence,
+            'learn_packet_ins_per_sec': packet_in_rate,
+            'learn_flowmods_per_host': learn_result['flowmods'] / float(learned),
+            'errors': len(self.driver.errors),
+        }
+
+
+def report(run):
+    print '%-20s %10s %10s %10s %10s %10s %8s' % (
+        'phase', 'time (s)', 'pkt-ins', 'flowmods', 'flows', 'hosts',
+        'flooded')
+    for result in run['phases']:
+        print '%-20s %10.3f %10u %10u %10u %10u %8s' % (
+            result['phase'], result['wall_time'], result['packet_ins'],
+            result['flowmods'], result['flows'], result['learned_hosts'],
+            result.get('flooded', ''))
+    for name, rounds in sorted(run['convergence_rounds'].iteritems()):
+        if rounds is None:
+            print '%s: not converged' % name
+        else:
+            print '%s: converged after %u rounds' % (name, rounds)
+    print 'learn: %.0f packet-ins/s, %.2f flowmods/host' % (
+        run['learn_packet_ins_per_sec'], run['learn_flowmods_per_host'])
+    if run['errors']:
+        print '%u errors from the datapath' % run['errors']
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Simulate FAUCET controlling a datapath with many hosts.')
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--vlans', type=int, default=4)
+    parser.add_argument('--acl-rules', type=int, default=0,
+                        help='rules in the ACL applied to untagged ports')
+    parser.add_argument('--routes', type=int, default=0,
+                        help='IPv4 and IPv6 routes per VLAN')
+    parser.add_argument('--hosts', type=int, default=1000)
+    parser.add_argument('--table-size', type=int,
+                        help='flows per table on the datapath (default '
+                             'unlimited)')
+    parser.add_argument('--timeout', type=int, default=300,
+                        help='learned host timeout (seconds)')
+    parser.add_argument('--expire', action='store_true',
+                        help='wait for learned hosts to time out, and '
+                             'relearn them')
+    parser.add_argument('--max-rounds', type=int, default=5,
+                        help='rounds of unicast traffic to wait for '
+                             'convergence')
+    parser.add_argument('--output', help='save results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    for logname in (BENCHMARK_LOGNAME, 'faucet'):
+        logger = logging.getLogger(logname)
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = 0
+        logger.setLevel(logging.CRITICAL)
+    run = FaucetSimulation(args).run()
+    report(run)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(run, output_file, indent=2, sort_keys=True)
+    for rounds in run['convergence_rounds'].itervalues():
+        if rounds is None:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import logging
+import threading
+import time
+import unittest
+
+from asynclog import AsyncLogHandler, RateLimitFilter, parse_log_levels
+
+
+def log_record(msg, created, args=(), name='faucet', level=logging.INFO):
+    record = logging.makeLogRecord({
+        'name': name, 'levelno': level,
+        'levelname': logging.getLevelName(level),
+        'msg': msg, 'args': args})
+    record.created = created
+    return record
+
+
+class RecordingHandler(logging.Handler):
+    """Keeps the records it is given, optionally waiting to be released."""
+
+    def __init__(self, release=None):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.unblock = release
+        self.writing = threading.Event()
+
+    def emit(self, record):
+        self.writing.set()
+        if self.unblock is not None:
+            self.unblock.wait()
+        self.records.append(record)
+
+    def messages(self):
+        return [record.getMessage() for record in self.records]
+
+
+class RateLimitFilterTestCase(unittest.TestCase):
+
+    def test_rate_per_window(self):
+        rate_limiter = RateLimitFilter(2, 10)
+        passed = [rate_limiter.filter(log_record('learned %u', 100 + i, (i,)))
+                  for i in range(4)]
+        self.assertEqual(passed, [True, True, False, False])
+        # a new window starts after the interval.
+        self.assertTrue(rate_limiter.filter(log_record('learned %u', 111)))
+
+    def test_records_limited_separately(self):
+        rate_limiter = RateLimitFilter(1, 10)
+        self.assertTrue(rate_limiter.filter(log_record('learned', 100)))
+        self.assertTrue(rate_limiter.filter(log_record('expired', 100)))
+        self.assertTrue(rate_limiter.filter(
+            log_record('learned', 100, level=logging.WARNING)))
+        self.assertFalse(rate_limiter.filter(log_record('learned', 101)))
+
+    def test_summaries(self):
+        rate_limiter = RateLimitFilter(1, 10)
+        for i in range(4):
+            rate_limiter.filter(log_record('learned host %u', 100, (i,)))
+        summaries = rate_limiter.summaries(105)
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(
+            summaries[0].getMessage(),
+            '3 messages suppressed in 10s, the last: learned host 3')
+        self.assertEqual(summaries[0].levelno, logging.INFO)
+        # suppressed records are only summarized once.
+        self.assertEqual(rate_limiter.summaries(106), [])
+        # finished windows are forgotten.
+        rate_limiter.summaries(110)
+        self.assertEqual(rate_limiter.windows, {})
+
+
+class AsyncLogHandlerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = None
+
+    def tearDown(self):
+        if self.handler is not None:
+            self.handler.close()
+
+    def async_handler(self, target, **kwargs):
+        self.handler = AsyncLogHandler(target, **kwargs)
+        return self.handler
+
+    def test_records_written(self):
+        target = RecordingHandler()
+        handler = self.async_handler(target)
+        arg = ['a']
+        handler.handle(log_record('host %s', time.time(), (arg,)))
+        # the record is formatted when logged, not when written.
+        arg.append('b')
+        handler.flush()
+        self.assertEqual(target.messages(), ["host ['a']"])
+
+    def test_rate_limit_summarized(self):
+        target = RecordingHandler()
+        handler = self.async_handler(target, rate_limit=1, summary_interval=10)
+        for i in range(3):
+            handler.handle(log_record('host %u', time.time(), (i,)))
+        handler.flush()
+        handler.summarize(time.time())
+        self.assertEqual(
+            target.messages(),
+            ['host 0', '2 messages suppressed in 10s, the last: host 2'])
+
+    def test_queue_full_drops(self):
+        release = threading.Event()
+        target = RecordingHandler(release)
+        handler = self.async_handler(target, queue_size=1)
+        handler.handle(log_record('first', time.time()))
+        # wait for the writer to take the first record off the queue.
+        target.writing.wait(5)
+        for msg in ('second', 'third', 'fourth'):
+            handler.handle(log_record(msg, time.time()))
+        self.assertEqual(handler.dropped, 2)
+        release.set()
+        handler.flush()
+        handler.summarize(time.time())
+        self.assertEqual(
+            target.messages(),
+            ['first', 'second', 'log queue full, 2 messages dropped'])
+
+    def test_close_writes_queued(self):
+        release = threading.Event()
+        target = RecordingHandler(release)
+        handler = AsyncLogHandler(target, rate_limit=1)
+        handler.handle(log_record('first', time.time()))
+        target.writing.wait(5)
+        handler.handle(log_record('second', time.time()))
+        handler.handle(log_record('second', time.time()))
+        release.set()
+        handler.close()
+        self.assertFalse(handler.thread.is_alive())
+        self.assertEqual(
+            target.messages(),
+            ['first', 'second',
+             '1 messages suppressed in 60s, the last: second'])
+
+
+class ParseLogLevelsTestCase(unittest.TestCase):
+
+    def test_levels(self):
+        self.assertEqual(
+            parse_log_levels(' valve.learn=info, valve.route = WARNING,'),
+            {'valve.learn': logging.INFO, 'valve.route': logging.WARNING})
+        self.assertEqual(parse_log_levels(''), {})
+
+    def test_malformed(self):
+        for log_levels in ('valve.learn', 'valve.learn=LOUD', '=INFO',
+                           'valve.learn=INFO,valve.route'):
+            self.assertRaises(ValueError, parse_log_levels, log_levels)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,8 +20,11 @@ testdir = os.path.dirname(__file__)
 srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
 sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
 
+import shutil
+import tempfile
 import unittest
 from dp import DP
+from faucet_config_scale import scale_config, write_config
 
 class DistConfigTestCase(unittest.TestCase):
     def setUp(self):
@@ -72,6 +75,57 @@ class DistConfigTestCase(unittest.TestCase):
                 self.assertNotIn(port.number, untaggedports)
                 untaggedports.add(port.number)
 
+class CookieConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmpdir, 'cookie.yaml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_large_cookie_masked(self):
+        with open('config/testconfig.yaml') as config:
+            conf = config.read()
+        with open(self.config_file, 'w') as config:
+            config.write(conf + 'cookie: 0x1deadbeef\n')
+        dp = DP.parser(self.config_file)
+        self.assertEqual(dp.cookie, 0xdeadbeef)
+        dp.sanity_check()
+
+class ScaleConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmpdir, 'scale.yaml')
+        write_config(scale_config(
+            20, 4, n_trunks=2, n_acls=2, n_acl_rules=20, n_mirrors=2,
+            n_routes=3), self.config_file)
+        self.dp = DP.parser(self.config_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sanity_check(self):
+        self.dp.sanity_check()
+
+    def test_trunks_and_mirrors(self):
+        self.assertEqual(set(self.dp.ports.keys()), set(range(1, 21)))
+        for vlan in self.dp.vlans.itervalues():
+            self.assertEqual(
+                set([port.number for port in vlan.tagged]), set([1, 2]))
+            self.assertEqual(len(vlan.controller_ips), 2)
+            self.assertEqual(len(vlan.ipv4_routes), 3)
+            self.assertEqual(len(vlan.ipv6_routes), 3)
+        self.assertEqual(self.dp.mirror_from_port, {3: 19, 4: 20})
+
+    def test_acls(self):
+        self.assertEqual(len(self.dp.acls), 2)
+        for rules in self.dp.acls.itervalues():
+            self.assertEqual(len(rules), 20)
+            mirrors = [rule['actions']['mirror'] for rule in rules
+                       if 'mirror' in rule['actions']]
+            self.assertEqual(len(mirrors), 2)
+            self.assertTrue(set(mirrors) <= set([19, 20]))
+
 if __name__ == "__main__":
     unittest.main()
 
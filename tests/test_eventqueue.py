@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import unittest
+
+from eventqueue import PrioritizedEventQueues, ryu_app_supported
+from eventqueue import CLASS_WEIGHTS, CONTROL, TIMER, PACKET_IN
+from eventqueue import DROP_NEWEST, DROP_OLDEST
+
+from ryu.base import app_manager
+from ryu.lib import hub
+
+
+class ControlEvent(object):
+
+    def __init__(self, num):
+        self.num = num
+
+
+class TimerEvent(ControlEvent):
+    pass
+
+
+class PacketInEvent(ControlEvent):
+    pass
+
+
+EVENT_CLASSES = {TimerEvent: TIMER, PacketInEvent: PACKET_IN}
+
+
+class PrioritizedEventQueuesTestCase(unittest.TestCase):
+
+    def queues(self, **kwargs):
+        return PrioritizedEventQueues(EVENT_CLASSES, **kwargs)
+
+    def put(self, queues, event_class, count):
+        for num in range(count):
+            queues.put(event_class(num), None)
+
+    def get(self, queues, count):
+        return [queues.get()[0] for _ in range(count)]
+
+    def test_ryu_supported(self):
+        self.assertTrue(ryu_app_supported(app_manager.RyuApp))
+        self.assertFalse(ryu_app_supported(object))
+
+    def test_weighted_round_robin(self):
+        queues = self.queues()
+        for event_class in (PacketInEvent, TimerEvent, ControlEvent):
+            self.put(queues, event_class, 20)
+        for _ in range(2):
+            events = self.get(queues, 14)
+            self.assertEqual(
+                [event.__class__ for event in events],
+                [ControlEvent] * CLASS_WEIGHTS[CONTROL] +
+                [TimerEvent] * CLASS_WEIGHTS[TIMER] +
+                [PacketInEvent] * CLASS_WEIGHTS[PACKET_IN])
+        # events of each class are still handled in order.
+        self.assertEqual(
+            [event.num for event in events[:8]], range(8, 16))
+
+    def test_packet_ins_not_starved(self):
+        queues = self.queues()
+        self.put(queues, ControlEvent, 100)
+        self.put(queues, PacketInEvent, 1)
+        events = self.get(queues, 10)
+        self.assertEqual(events[-2].__class__, PacketInEvent)
+        self.assertTrue(queues.queues[CONTROL].events)
+
+    def test_drop_newest(self):
+        queues = self.queues(packet_in_maxlen=3, drop_policy=DROP_NEWEST)
+        self.put(queues, PacketInEvent, 5)
+        self.assertEqual(
+            [event.num for event in self.get(queues, 3)], [0, 1, 2])
+        self.assertTrue(queues.empty())
+        self.assertEqual(queues.queues[PACKET_IN].dropped, 2)
+        self.assertEqual(queues.queues[PACKET_IN].queued, 3)
+
+    def test_drop_oldest(self):
+        queues = self.queues(packet_in_maxlen=3, drop_policy=DROP_OLDEST)
+        self.put(queues, PacketInEvent, 5)
+        self.assertEqual(
+            [event.num for event in self.get(queues, 3)], [2, 3, 4])
+        self.assertTrue(queues.empty())
+        self.assertEqual(queues.queues[PACKET_IN].dropped, 2)
+
+    def test_control_events_wait_for_room(self):
+        queues = self.queues(maxlen=2)
+        sender = hub.spawn(self.put, queues, ControlEvent, 3)
+        hub.sleep(0)
+        # the third event waits rather than being dropped.
+        self.assertEqual(len(queues.queues[CONTROL].events), 2)
+        self.assertFalse(sender.dead)
+        self.assertEqual(queues.get()[0].num, 0)
+        hub.joinall([sender])
+        self.assertEqual(
+            [event.num for event in self.get(queues, 2)], [1, 2])
+        self.assertEqual(queues.queues[CONTROL].dropped, 0)
+
+    def test_unknown_drop_policy(self):
+        self.assertRaises(
+            ValueError, self.queues, drop_policy='sometimes')
+        self.assertRaises(
+            ValueError, self.queues, drop_policy='block')
+
+
+if __name__ == "__main__":
+    unittest.main()
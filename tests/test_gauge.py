@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import logging
+import unittest
+
+from dp import DP
+from gauge import GaugePrometheusStore, GaugeFlowTablePrometheusPoller
+from gauge import GaugePortStatsPrometheusPoller
+from gauge import GaugePortStatePrometheusLogger
+
+from ryu.ofproto.ofproto_protocol import ProtocolDesc
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+logging.getLogger('gauge').addHandler(logging.NullHandler())
+logging.getLogger('gauge').propagate = 0
+
+
+def port_stats(datapath, port_no, packets):
+    return parser.OFPPortStats(
+        port_no, packets, packets, packets * 100, packets * 100,
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+
+
+def flow_stats(table_id):
+    return parser.OFPFlowStats(
+        table_id, 0, 0, 1, 0, 0, 0, 0, 0, 0, parser.OFPMatch(), [])
+
+
+class GaugePrometheusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dp = DP.parser('config/testconfig.yaml', 'gauge')
+        self.datapath = ProtocolDesc(ofp.OFP_VERSION)
+        self.store = GaugePrometheusStore()
+
+    def samples(self):
+        samples = {}
+        for line in self.store.render().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = value
+        return samples
+
+    def port_stats_reply(self, packets):
+        msg = parser.OFPPortStatsReply(self.datapath)
+        msg.body = [
+            port_stats(self.datapath, port_no, packets)
+            for port_no in sorted(self.dp.ports)]
+        return msg
+
+    def test_port_stats(self):
+        poller = GaugePortStatsPrometheusPoller(
+            self.dp, self.datapath, 'gauge', self.store)
+        poller.update(0, self.port_stats_reply(10))
+        labels = 'dp_id="0xcafef00d",dp_name="3405705229",port="2",' \
+                 'port_name="2"'
+        self.assertEqual(
+            self.samples()['of_port_rx_packets{%s}' % labels], '10')
+        self.assertEqual(
+            self.samples()['of_port_tx_bytes{%s}' % labels], '1000')
+
+    def test_render_cached(self):
+        poller = GaugePortStatsPrometheusPoller(
+            self.dp, self.datapath, 'gauge', self.store)
+        poller.update(0, self.port_stats_reply(10))
+        text = self.store.render()
+        # unchanged stats don't render again.
+        poller.update(0, self.port_stats_reply(10))
+        self.assertTrue(self.store.render() is text)
+        poller.update(0, self.port_stats_reply(11))
+        self.assertFalse(self.store.render() is text)
+        self.assertEqual(
+            self.store.render().count('# TYPE of_port_rx_packets counter'), 1)
+
+    def test_flow_table_multipart(self):
+        poller = GaugeFlowTablePrometheusPoller(
+            self.dp, self.datapath, 'gauge', self.store)
+        msg = parser.OFPFlowStatsReply(self.datapath)
+        msg.flags = ofp.OFPMPF_REPLY_MORE
+        msg.body = [flow_stats(0), flow_stats(1)]
+        poller.update(0, msg)
+        self.assertEqual(self.samples(), {})
+        msg = parser.OFPFlowStatsReply(self.datapath)
+        msg.flags = 0
+        msg.body = [flow_stats(1)]
+        poller.update(0, msg)
+        labels = 'dp_id="0xcafef00d",dp_name="3405705229"'
+        self.assertEqual(
+            self.samples()['of_flows{%s,table_id="0"}' % labels], '1')
+        self.assertEqual(
+            self.samples()['of_flows{%s,table_id="1"}' % labels], '2')
+        # table 0 has emptied.
+        poller.update(0, msg)
+        self.assertEqual(
+            self.samples()['of_flows{%s,table_id="0"}' % labels], '0')
+
+    def test_port_deleted(self):
+        poller = GaugePortStatsPrometheusPoller(
+            self.dp, self.datapath, 'gauge', self.store)
+        poller.update(0, self.port_stats_reply(10))
+        port_state = GaugePortStatePrometheusLogger(
+            self.dp, self.datapath, 'gauge', self.store)
+        port_state.set_ports([parser.OFPPort(
+            port_no, '', '', 0, 0, 0, 0, 0, 0, 0, 0)
+            for port_no in self.dp.ports])
+        labels = 'dp_id="0xcafef00d",dp_name="3405705229",port="2",' \
+                 'port_name="2"'
+        self.assertEqual(self.samples()['of_port_up{%s}' % labels], '1')
+        msg = parser.OFPPortStatus(
+            self.datapath, ofp.OFPPR_DELETE,
+            parser.OFPPort(2, '', '', 0, 0, 0, 0, 0, 0, 0, 0))
+        port_state.update(0, msg)
+        samples = self.samples()
+        self.assertFalse([name for name in samples if labels in name])
+        self.assertEqual(len(samples), 8 * (len(self.dp.ports) - 1))
+
+    def test_dp_disconnected(self):
+        GaugePortStatsPrometheusPoller(
+            self.dp, self.datapath, 'gauge', self.store).update(
+                0, self.port_stats_reply(10))
+        self.store.set_dp_connected(self.dp, False)
+        self.assertEqual(self.samples(), {
+            'gauge_dp_connected{dp_id="0xcafef00d",dp_name="3405705229"}':
+                '0'})
+        self.assertEqual(self.store.render().count('# TYPE'), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
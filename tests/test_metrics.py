@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import logging
+import unittest
+
+from eventlet import patcher
+from eventlet.green import urllib2
+
+from metrics import CONTENT_TYPE, MetricsServer
+
+thread = patcher.original('thread')
+
+logging.getLogger('test_metrics').addHandler(logging.NullHandler())
+
+
+class MetricsServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.render_threads = []
+        self.fail_render = False
+        self.server = MetricsServer('127.0.0.1', 0, self.render, 'test_metrics')
+        self.url = 'http://127.0.0.1:%u' % self.server.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def render(self):
+        self.render_threads.append(thread.get_ident())
+        if self.fail_render:
+            raise ValueError('cannot render')
+        return 'faucet_test 1\n'
+
+    def get(self, path):
+        try:
+            response = urllib2.urlopen(self.url + path, timeout=5)
+        except urllib2.HTTPError as err:
+            return err.code, None, None
+        return (response.getcode(), response.info()['Content-Type'],
+                response.read())
+
+    def test_metrics(self):
+        for path in ('/', '/metrics'):
+            self.assertEqual(
+                self.get(path), (200, CONTENT_TYPE, 'faucet_test 1\n'))
+
+    def test_rendered_off_hub(self):
+        self.get('/metrics')
+        self.assertEqual(len(self.render_threads), 1)
+        self.assertNotEqual(self.render_threads[0], thread.get_ident())
+
+    def test_not_found(self):
+        self.assertEqual(self.get('/other')[0], 404)
+        self.assertEqual(self.render_threads, [])
+
+    def test_render_error(self):
+        self.fail_render = True
+        self.assertEqual(self.get('/metrics')[0], 500)
+        self.fail_render = False
+        self.assertEqual(self.get('/metrics')[0], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import shutil
+import tempfile
+import time
+import unittest
+
+from ofchannel import OFChannelLogWriter, read_ofchannel_log
+from ofchannel import OFCHANNEL_MAGIC, RECORD_HEADER, RECEIVED, SENT
+
+from ryu.ofproto.ofproto_protocol import ProtocolDesc
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+
+def serialized(msg):
+    msg.serialize()
+    return str(msg.buf)
+
+
+class OFChannelLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmpdir, 'ofchannel.log')
+        datapath = ProtocolDesc(ofp.OFP_VERSION)
+        self.msgs = [
+            (RECEIVED, serialized(parser.OFPEchoRequest(datapath, 'ping'))),
+            (SENT, serialized(parser.OFPFlowMod(
+                datapath, cookie=1, table_id=2, priority=3,
+                match=parser.OFPMatch(in_port=1, eth_src='0e:00:00:00:01:01'),
+                instructions=[]))),
+            (SENT, serialized(parser.OFPBarrierRequest(datapath))),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_log(self):
+        writer = OFChannelLogWriter(self.log_file, 'faucet')
+        for direction, data in self.msgs:
+            writer.log(direction, data)
+        writer.flush()
+
+    def test_round_trip(self):
+        start = time.time()
+        self.write_log()
+        records = list(read_ofchannel_log(self.log_file))
+        self.assertEqual(
+            [(direction, str(msg.buf)) for _, direction, msg in records],
+            self.msgs)
+        record_times = [record_time for record_time, _, _ in records]
+        self.assertEqual(record_times, sorted(record_times))
+        self.assertTrue(start <= record_times[0])
+        self.assertTrue(record_times[-1] <= time.time())
+        self.assertTrue(isinstance(records[1][2], parser.OFPFlowMod))
+        self.assertEqual(records[1][2].match['in_port'], 1)
+
+    def test_truncated_last_record(self):
+        self.write_log()
+        for truncated in ('\0' * (RECORD_HEADER.size - 1),
+                          RECORD_HEADER.pack(time.time(), SENT, 100) + 'x'):
+            with open(self.log_file, 'rb') as log_file:
+                data = log_file.read()
+            with open(self.log_file, 'wb') as log_file:
+                log_file.write(data + truncated)
+            records = list(read_ofchannel_log(self.log_file))
+            self.assertEqual(len(records), len(self.msgs))
+            with open(self.log_file, 'wb') as log_file:
+                log_file.write(data)
+
+    def test_not_a_log(self):
+        with open(self.log_file, 'wb') as log_file:
+            log_file.write('garbage' + OFCHANNEL_MAGIC)
+        self.assertRaises(
+            ValueError, list, read_ofchannel_log(self.log_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import re
+import shutil
+import tempfile
+import time
+import unittest
+
+from profiling import CPUProfiler, MemoryProfiler
+from valve import HostCacheEntry
+
+
+def busy_loop(seconds):
+    """Use CPU for the given number of seconds of CPU time."""
+    end = time.clock() + seconds
+    total = 0
+    while time.clock() < end:
+        total += 1
+    return total
+
+
+class Leak(object):
+    pass
+
+
+class ProfilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_report(self, report_files, suffix):
+        report_name = [
+            name for name in report_files if name.endswith(suffix)][0]
+        self.assertEqual(os.path.dirname(report_name), self.tmpdir)
+        with open(report_name) as report:
+            return report.read()
+
+
+class CPUProfilerTestCase(ProfilerTestCase):
+
+    def test_profile(self):
+        profiler = CPUProfiler(interval=0.001)
+        self.assertTrue(profiler.start())
+        self.assertTrue(profiler.running())
+        busy_loop(0.2)
+        elapsed = profiler.stop()
+        self.assertFalse(profiler.running())
+        report_files = profiler.write(self.tmpdir, elapsed)
+        report = self.read_report(report_files, '.txt')
+        samples = int(re.match(r'CPU profile: (\d+) samples', report).group(1))
+        self.assertTrue(samples > 0)
+        self.assertEqual(samples, profiler.sample_count)
+        self.assertIn('test_profiling.py:busy_loop:', report)
+        folded = self.read_report(report_files, '.folded')
+        busy_stacks = [
+            line for line in folded.splitlines()
+            if 'test_profiling.py:busy_loop:' in line]
+        self.assertTrue(busy_stacks)
+        # outermost function first.
+        self.assertTrue(busy_stacks[0].index('test_profile') <
+                        busy_stacks[0].index('busy_loop'))
+
+    def test_second_start_ignored(self):
+        profiler = CPUProfiler(interval=0.001)
+        self.assertTrue(profiler.start())
+        busy_loop(0.05)
+        sample_count = profiler.sample_count
+        self.assertTrue(sample_count > 0)
+        self.assertFalse(profiler.start())
+        self.assertTrue(profiler.sample_count >= sample_count)
+        profiler.stop()
+        self.assertTrue(profiler.start())
+        profiler.stop()
+
+
+class MemoryProfilerTestCase(ProfilerTestCase):
+
+    def test_profile(self):
+        profiler = MemoryProfiler()
+        self.assertTrue(profiler.start())
+        self.assertTrue(profiler.running())
+        leaks = [Leak() for _ in range(1000)]
+        hosts = [HostCacheEntry('0e:00:00:00:00:%02x' % i, 1, False, 0)
+                 for i in range(10)]
+        elapsed = profiler.stop()
+        self.assertFalse(profiler.running())
+        report = self.read_report(profiler.write(self.tmpdir, elapsed), '.txt')
+        self.assertTrue(report.startswith('Memory profile over'))
+        self.assertTrue(re.search(
+            r'^ +1000 +\+1000 +\d+  %s\.Leak$' % re.escape(Leak.__module__),
+            report, re.M))
+        watched = report.split('FAUCET and ryu types')[1]
+        self.assertTrue(re.search(
+            r'^ +\d+ +\+10 +\d+  valve\.HostCacheEntry$', watched, re.M))
+        self.assertEqual(len(leaks) + len(hosts), 1010)
+
+    def test_second_start_ignored(self):
+        profiler = MemoryProfiler()
+        self.assertTrue(profiler.start())
+        start_counts = profiler.start_counts
+        self.assertFalse(profiler.start())
+        self.assertTrue(profiler.start_counts is start_counts)
+        profiler.stop()
+        self.assertTrue(profiler.start())
+        profiler.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import subprocess
+import unittest
+
+# Run with threading patched, as ryu-manager --enable-debugger does. A
+# native thread blocks in a real sleep while the hub keeps running.
+NATIVE_THREAD_TEST = '''
+import sys
+from ryu.lib import hub
+hub.patch(thread=True)
+sys.path.insert(0, %r)
+from eventlet import patcher
+from util import Queue, start_native_thread
+real_sleep = patcher.original('time').sleep
+thread = patcher.original('thread')
+queue = Queue.Queue()
+
+def blocker():
+    queue.put(thread.get_ident())
+    real_sleep(0.5)
+    queue.put('done')
+
+start_native_thread(blocker)
+ticks = 0
+while queue.qsize() < 1:
+    hub.sleep(0.01)
+ident = queue.get()
+while queue.empty():
+    ticks += 1
+    hub.sleep(0.01)
+print ident != thread.get_ident(), ticks > 10
+'''
+
+
+class NativeThreadTestCase(unittest.TestCase):
+
+    def test_native_thread_when_threading_patched(self):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            NATIVE_THREAD_TEST % os.path.abspath(
+                os.path.join(testdir, srcdir))])
+        self.assertEqual(output.split(), ['True', 'True'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,1040 @@
+#!/usr/bin/python
+
+# Copyright (C) 2015 Research and Education Advanced Network New Zealand Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys, os
+testdir = os.path.dirname(__file__)
+srcdir = '../src/ryu_faucet/org/onfsdn/faucet'
+sys.path.insert(0, os.path.abspath(os.path.join(testdir, srcdir)))
+
+import ipaddr
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+from cookie import owner_cookie, OWNER_HOST, OWNER_PORT, PORT_MASK
+from cookie import OWNER_LEARN, OWNER_CONTROLLER_ARP
+from dp import DP
+from fake_datapath import FakeDatapath, ValveDriver
+from fake_datapath import arp_request, unicast_packet
+from flowtable import FlowEntry
+from journal import ValveJournalReplay, CONFIG, CONNECT, PACKET_IN
+from journal import FLOW_REMOVED, DP_ID, PORT, PACKET_IN_HEADER
+from journal import ValveJournal, read_journal
+from metrics import FaucetMetrics
+from snapshot import read_snapshot
+from valve import valve_factory, LinkNeighbor
+import aruba.aruba_pipeline as aruba
+
+from ryu.lib.packet import arp, ethernet, packet
+from ryu.lib.packet import vlan as packet_vlan
+from ryu.ofproto import ether
+from ryu.ofproto.ofproto_protocol import ProtocolDesc
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+logging.getLogger('faucet').addHandler(logging.NullHandler())
+logging.getLogger('faucet').propagate = 0
+
+
+def tagged_arp_packet(eth_src, vid):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(
+        'ff:ff:ff:ff:ff:ff', eth_src, ether.ETH_TYPE_8021Q))
+    pkt.add_protocol(packet_vlan.vlan(vid=vid, ethertype=ether.ETH_TYPE_ARP))
+    pkt.add_protocol(arp.arp(
+        opcode=arp.ARP_REQUEST, src_mac=eth_src, src_ip='192.0.2.1',
+        dst_mac='00:00:00:00:00:00', dst_ip='192.0.2.2'))
+    pkt.serialize()
+    return packet.Packet(pkt.data)
+
+
+def flowmods(ofmsgs, command=None):
+    return [
+        ofmsg for ofmsg in ofmsgs if isinstance(ofmsg, parser.OFPFlowMod) and
+        (command is None or ofmsg.command == command)]
+
+
+def flow_stat(flowmod, packet_count=0):
+    """Return flowmod as it would be in a flow stats reply from a switch."""
+    buf = bytearray()
+    flowmod.match.serialize(buf, 0)
+    match = parser.OFPMatch.parser(str(buf), 0)
+    instructions = []
+    for inst in flowmod.instructions:
+        buf = bytearray()
+        inst.serialize(buf, 0)
+        instructions.append(parser.OFPInstruction.parser(str(buf), 0))
+    return parser.OFPFlowStats(
+        flowmod.table_id, 1, 0, flowmod.priority, flowmod.idle_timeout,
+        flowmod.hard_timeout, 0, flowmod.cookie, packet_count, 0, match,
+        instructions)
+
+
+def flow_removed_data(msg):
+    """Return an OFPFlowRemoved as the switch would send it."""
+    match_buf = bytearray()
+    match_len = msg.match.serialize(match_buf, 0)
+    body = struct.pack(
+        ofp.OFP_FLOW_REMOVED_PACK_STR0, msg.cookie, msg.priority, msg.reason,
+        msg.table_id, msg.duration_sec, msg.duration_nsec, msg.idle_timeout,
+        msg.hard_timeout, msg.packet_count, msg.byte_count)
+    header = struct.pack(
+        ofp.OFP_HEADER_PACK_STR, ofp.OFP_VERSION, ofp.OFPT_FLOW_REMOVED,
+        ofp.OFP_HEADER_SIZE + len(body) + match_len, 0)
+    return header + body + str(match_buf)
+
+
+class FakeSwitch(object):
+    """Flow tables of a switch, for the flowmods Valve sends on connect."""
+
+    def __init__(self):
+        self.flows = {}
+
+    def apply(self, ofmsgs):
+        for flowmod in flowmods(ofmsgs):
+            if flowmod.command == ofp.OFPFC_ADD:
+                self.flows[(flowmod.table_id, flowmod.priority,
+                            str(flowmod.match))] = flowmod
+            elif flowmod.command == ofp.OFPFC_DELETE_STRICT:
+                del self.flows[(flowmod.table_id, flowmod.priority,
+                                str(flowmod.match))]
+            else:
+                assert flowmod.command == ofp.OFPFC_DELETE
+                for key in self.flows.keys():
+                    if key[0] == flowmod.table_id:
+                        del self.flows[key]
+
+    def flow_stats(self):
+        return [flow_stat(flowmod) for flowmod in self.flows.values()]
+
+
+class ValveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dp = DP.parser('config/testconfig.yaml')
+        self.valve = valve_factory(self.dp)
+        self.connect_ofmsgs = self.valve.datapath_connect(
+            self.dp.dp_id, self.dp.ports.keys())
+
+    def learn(self, in_port, vid, eth_src):
+        return self.valve.rcv_packet(
+            self.dp.dp_id, in_port, vid, tagged_arp_packet(eth_src, vid))
+
+    def eth_src_flowmod(self, ofmsgs):
+        for flowmod in flowmods(ofmsgs, ofp.OFPFC_ADD):
+            if flowmod.table_id == self.dp.eth_src_table:
+                return flowmod
+        return None
+
+    def eth_dst_flowmod(self, ofmsgs):
+        for flowmod in flowmods(ofmsgs, ofp.OFPFC_ADD):
+            if flowmod.table_id == self.dp.eth_dst_table:
+                return flowmod
+        return None
+
+    def flow_removed(self, flowmod, reason=ofp.OFPRR_HARD_TIMEOUT,
+                     duration_sec=None):
+        """Return the OFPFlowRemoved a switch sends when flowmod's flow is
+        removed, by default when its hard timeout has passed."""
+        if duration_sec is None:
+            duration_sec = flowmod.hard_timeout
+        return parser.OFPFlowRemoved(
+            None, cookie=flowmod.cookie, priority=flowmod.priority,
+            reason=reason, table_id=flowmod.table_id,
+            duration_sec=duration_sec, duration_nsec=0,
+            idle_timeout=flowmod.idle_timeout,
+            hard_timeout=flowmod.hard_timeout, packet_count=0, byte_count=0,
+            match=flow_stat(flowmod).match)
+
+
+class ValveFlowTableTestCase(ValveTestCase):
+
+    def test_connect_no_duplicate_adds(self):
+        adds = set()
+        for flowmod in flowmods(self.connect_ofmsgs, ofp.OFPFC_ADD):
+            key = (flowmod.table_id, flowmod.priority, str(flowmod.match))
+            self.assertNotIn(key, adds)
+            adds.add(key)
+
+    def test_connect_deletes_all_flows(self):
+        deletes = flowmods(self.connect_ofmsgs, ofp.OFPFC_DELETE)
+        self.assertEqual(
+            set([flowmod.table_id for flowmod in deletes]),
+            set(self.valve.all_valve_tables()))
+
+    def test_port_add_after_connect(self):
+        # port 1 is already configured, so there is nothing to send.
+        self.assertEqual(
+            flowmods(self.valve.port_add(self.dp.dp_id, 1)), [])
+
+    def test_port_delete_add(self):
+        port_delete_ofmsgs = flowmods(self.valve.port_delete(self.dp.dp_id, 2))
+        self.assertTrue(port_delete_ofmsgs)
+        self.assertEqual(
+            flowmods(self.valve.port_delete(self.dp.dp_id, 2)), [])
+        port_add_ofmsgs = self.valve.port_add(self.dp.dp_id, 2)
+        # the flows for the port were all deleted, so none are deleted again.
+        self.assertEqual(flowmods(port_add_ofmsgs, ofp.OFPFC_DELETE), [])
+        self.assertTrue(flowmods(port_add_ofmsgs, ofp.OFPFC_ADD))
+
+    def test_learn_no_deletes_for_new_host(self):
+        ofmsgs = self.learn(1, 40, '0e:00:00:00:01:01')
+        self.assertEqual(flowmods(ofmsgs, ofp.OFPFC_DELETE), [])
+        self.assertEqual(len(flowmods(ofmsgs, ofp.OFPFC_ADD)), 2)
+
+    def test_relearn_refreshes_timed_flows(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        ofmsgs = self.learn(1, 40, '0e:00:00:00:01:01')
+        # the unchanged eth_dst flow is replaced rather than deleted.
+        self.assertEqual(flowmods(ofmsgs, ofp.OFPFC_DELETE), [])
+        self.assertEqual(len(flowmods(ofmsgs, ofp.OFPFC_ADD)), 2)
+
+    def test_expire_only_expired_flows(self):
+        flow_table = self.valve.flow_table
+        now = time.time()
+        self.valve.clock = lambda: now
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.learn(2, 40, '0e:00:00:00:01:02')
+        # relearn the second host later, refreshing its flows.
+        self.valve.clock = lambda: now + 100
+        self.learn(2, 40, '0e:00:00:00:01:02')
+        entries = flow_table.entries(self.dp.eth_src_table)
+        expired = now + self.dp.timeout + FlowEntry.EXPIRY_GRACE + 1
+        flow_table.expire(expired - 2)
+        self.assertEqual(flow_table.entries(self.dp.eth_src_table), entries)
+        flow_table.expire(expired)
+        self.assertEqual(
+            flow_table.entries(self.dp.eth_src_table), entries - 1)
+        # only the relearned host's flows are left to expire.
+        self.assertEqual(
+            set([expiry for expiry, _, _ in flow_table.expiries]),
+            set([now + 100 + self.dp.timeout + FlowEntry.EXPIRY_GRACE]))
+
+    def test_host_move_deletes_old_flow(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        ofmsgs = self.learn(2, 40, '0e:00:00:00:01:01')
+        self.assertEqual(flowmods(ofmsgs, ofp.OFPFC_DELETE), [])
+        deletes = flowmods(ofmsgs, ofp.OFPFC_DELETE_STRICT)
+        self.assertEqual(
+            [flowmod.table_id for flowmod in deletes], [self.dp.eth_src_table])
+        self.assertEqual(deletes[0].match['in_port'], 1)
+
+
+class ValveCookieTestCase(ValveTestCase):
+
+    def test_port_delete_by_cookie(self):
+        self.learn(2, 40, '0e:00:00:00:01:01')
+        deletes = flowmods(
+            self.valve.port_delete(self.dp.dp_id, 2), ofp.OFPFC_DELETE)
+        # the port's flows in all tables, and eth_dst flows to the port.
+        self.assertEqual(len(deletes), 2)
+        cookie, cookie_mask = owner_cookie(self.dp.cookie, port_num=2)
+        self.assertEqual(deletes[0].table_id, ofp.OFPTT_ALL)
+        self.assertEqual(deletes[0].cookie, cookie)
+        self.assertEqual(deletes[0].cookie_mask, cookie_mask)
+        self.assertEqual(deletes[1].table_id, self.dp.eth_dst_table)
+        self.assertEqual(deletes[1].out_port, 2)
+
+    def test_port_delete_deletes_learned_hosts(self):
+        eth_src_flowmod = self.eth_src_flowmod(
+            self.learn(2, 40, '0e:00:00:00:01:01'))
+        cookie, cookie_mask = owner_cookie(
+            self.dp.cookie, OWNER_HOST, 40, 2)
+        self.assertEqual(eth_src_flowmod.cookie, cookie)
+        self.valve.port_delete(self.dp.dp_id, 2)
+        self.assertFalse(self.valve.flow_table.installed(
+            self.dp.eth_src_table, eth_src_flowmod.priority,
+            eth_src_flowmod.match))
+
+    def test_large_port_deleted_by_in_port(self):
+        port_num = PORT_MASK + 1
+        self.dp.add_port(port_num, {'native_vlan': 40})
+        self.assertTrue(flowmods(
+            self.valve.port_add(self.dp.dp_id, port_num), ofp.OFPFC_ADD))
+        self.learn(port_num, 40, '0e:00:00:00:01:01')
+        deletes = flowmods(
+            self.valve.port_delete(self.dp.dp_id, port_num), ofp.OFPFC_DELETE)
+        self.assertTrue(deletes)
+        for flowmod in deletes:
+            self.assertEqual(flowmod.cookie_mask, 0)
+            self.assertNotEqual(flowmod.table_id, ofp.OFPTT_ALL)
+        # the port's flows are gone, and flows of no port are kept.
+        flow_table = self.valve.flow_table
+        self.assertEqual(flow_table.candidates(
+            self.dp.vlan_table, [('in_port', port_num)], ofp.OFPP_ANY, 0, 0),
+            set())
+        self.assertTrue(flow_table.installed(
+            self.dp.eth_src_table, self.dp.low_priority,
+            self.valve.valve_in_match()))
+        self.assertRaises(
+            ValueError, owner_cookie, self.dp.cookie, port_num=port_num)
+
+    def test_port_flows_owned_by_port(self):
+        cookie, cookie_mask = owner_cookie(self.dp.cookie, OWNER_PORT, 40, 2)
+        vlan_flowmods = [
+            flowmod for flowmod in flowmods(self.connect_ofmsgs, ofp.OFPFC_ADD)
+            if flowmod.table_id == self.dp.vlan_table and
+            flowmod.match.get('in_port', None) == 2]
+        self.assertEqual(len(vlan_flowmods), 1)
+        self.assertEqual(vlan_flowmods[0].cookie, cookie)
+
+
+class ValveGroupTableTestCase(ValveTestCase):
+
+    def setUp(self):
+        self.dp = DP.parser('config/testconfig.yaml')
+        self.dp.group_table = True
+        self.valve = valve_factory(self.dp)
+        self.connect_ofmsgs = self.valve.datapath_connect(
+            self.dp.dp_id, self.dp.ports.keys())
+
+    def group_mods(self, ofmsgs, command=None):
+        return [
+            ofmsg for ofmsg in ofmsgs
+            if isinstance(ofmsg, parser.OFPGroupMod) and
+            (command is None or ofmsg.command == command)]
+
+    def group_desc(self):
+        """Return the groups installed, as in a group desc reply."""
+        group_descs = []
+        for _, group_mod in self.valve.flow_table.groups.values():
+            buckets = []
+            for bucket in group_mod.buckets:
+                buf = bytearray()
+                bucket.serialize(buf, 0)
+                buckets.append(parser.OFPBucket.parser(str(buf), 0))
+            group_descs.append(parser.OFPGroupDescStats(
+                group_mod.type, group_mod.group_id, buckets))
+        return group_descs
+
+    def test_connect_groups_before_flood_flows(self):
+        group_adds = self.group_mods(self.connect_ofmsgs, ofp.OFPGC_ADD)
+        # a flood and a unicast flood group for each VLAN.
+        self.assertEqual(len(group_adds), 2 * len(self.dp.vlans))
+        self.assertEqual(
+            len(set([group_mod.group_id for group_mod in group_adds])),
+            len(group_adds))
+        group_add_index = dict([
+            (group_mod.group_id, self.connect_ofmsgs.index(group_mod))
+            for group_mod in group_adds])
+        for flowmod in flowmods(self.connect_ofmsgs, ofp.OFPFC_ADD):
+            if (flowmod.table_id == self.dp.flood_table and
+                    flowmod.instructions):
+                group_action = flowmod.instructions[0].actions[0]
+                self.assertTrue(
+                    isinstance(group_action, parser.OFPActionGroup))
+                self.assertTrue(
+                    self.connect_ofmsgs.index(flowmod) >
+                    group_add_index[group_action.group_id])
+
+    def test_untagged_buckets_pop_vlan(self):
+        group_id = self.valve.flood_group_id(self.dp.vlans[40], None)
+        _, group_mod = self.valve.flow_table.groups[group_id]
+        bucket_actions = dict([
+            (bucket.actions[-1].port, bucket.actions)
+            for bucket in group_mod.buckets])
+        self.assertEqual(sorted(bucket_actions.keys()), [1, 2, 3])
+        self.assertEqual(len(bucket_actions[1]), 1)
+        self.assertTrue(
+            isinstance(bucket_actions[2][0], parser.OFPActionPopVlan))
+
+    def test_port_delete_modifies_groups(self):
+        ofmsgs = self.valve.port_delete(self.dp.dp_id, 2)
+        group_mods = self.group_mods(ofmsgs)
+        self.assertEqual(
+            set([group_mod.command for group_mod in group_mods]),
+            set([ofp.OFPGC_MODIFY]))
+        # port 2 is only in VLAN 40.
+        self.assertEqual(len(group_mods), 2)
+        self.assertEqual([
+            flowmod for flowmod in flowmods(ofmsgs)
+            if flowmod.table_id == self.dp.flood_table], [])
+        group_mods = self.group_mods(self.valve.port_add(self.dp.dp_id, 2))
+        self.assertEqual(len(group_mods), 2)
+
+    def test_reconnect_groups_unchanged(self):
+        switch = FakeSwitch()
+        switch.apply(self.connect_ofmsgs)
+        ofmsgs = self.valve.datapath_reconnect(
+            self.dp.dp_id, self.dp.ports.keys())
+        self.assertTrue(isinstance(ofmsgs[0], parser.OFPGroupDescStatsRequest))
+        group_descs = self.group_desc()
+        missing_group = group_descs.pop()
+        self.valve.group_desc(self.dp.dp_id, group_descs)
+        ofmsgs = self.valve.datapath_reconcile(
+            self.dp.dp_id, switch.flow_stats())
+        self.assertEqual(len(ofmsgs), 1)
+        self.assertEqual(ofmsgs[0].command, ofp.OFPGC_ADD)
+        self.assertEqual(ofmsgs[0].group_id, missing_group.group_id)
+
+
+class ValveHostMoveTestCase(ValveTestCase):
+
+    def test_host_move_modifies_eth_dst(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        ofmsgs = self.learn(2, 40, '0e:00:00:00:01:01')
+        self.assertFalse(
+            [ofmsg for ofmsg in ofmsgs
+             if isinstance(ofmsg, parser.OFPBarrierRequest)])
+        # packets to the host are redirected first.
+        self.assertEqual(ofmsgs[0].command, ofp.OFPFC_MODIFY_STRICT)
+        self.assertEqual(ofmsgs[0].table_id, self.dp.eth_dst_table)
+        self.assertEqual(
+            ofmsgs[0].instructions[0].actions[-1].port, 2)
+        host_cache_entry = self.dp.vlans[40].host_cache['0e:00:00:00:01:01']
+        self.assertEqual(host_cache_entry.port_num, 2)
+        self.assertEqual(host_cache_entry.moves, 1)
+        self.assertEqual(self.dp.vlans[40].host_moves, 1)
+
+    def test_host_move_after_eth_dst_idle(self):
+        eth_dst_flowmod = self.eth_dst_flowmod(
+            self.learn(1, 40, '0e:00:00:00:01:01'))
+        self.valve.flow_removed(self.dp.dp_id, self.flow_removed(
+            eth_dst_flowmod, reason=ofp.OFPRR_IDLE_TIMEOUT, duration_sec=0))
+        ofmsgs = self.learn(2, 40, '0e:00:00:00:01:01')
+        self.assertEqual(flowmods(ofmsgs, ofp.OFPFC_MODIFY_STRICT), [])
+        self.assertEqual(len(flowmods(ofmsgs, ofp.OFPFC_ADD)), 2)
+
+    def test_host_flapping_held(self):
+        self.dp.max_host_moves = 2
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        for in_port in (2, 1):
+            self.assertTrue(flowmods(
+                self.learn(in_port, 40, '0e:00:00:00:01:01'),
+                ofp.OFPFC_MODIFY_STRICT))
+        ofmsgs = self.learn(2, 40, '0e:00:00:00:01:01')
+        self.assertEqual(len(ofmsgs), 1)
+        self.assertEqual(ofmsgs[0].table_id, self.dp.eth_src_table)
+        self.assertEqual(ofmsgs[0].instructions, [])
+        self.assertEqual(ofmsgs[0].hard_timeout, self.dp.timeout)
+        host_cache_entry = self.dp.vlans[40].host_cache['0e:00:00:00:01:01']
+        self.assertEqual(host_cache_entry.port_num, 1)
+
+
+class ValveReconcileTestCase(ValveTestCase):
+
+    def setUp(self):
+        super(ValveReconcileTestCase, self).setUp()
+        self.switch = FakeSwitch()
+        self.switch.apply(self.connect_ofmsgs)
+
+    def reconnect(self):
+        ofmsgs = self.valve.datapath_reconnect(
+            self.dp.dp_id, self.dp.ports.keys())
+        self.assertEqual(len(ofmsgs), 1)
+        self.assertTrue(isinstance(ofmsgs[0], parser.OFPFlowStatsRequest))
+        return self.valve.datapath_reconcile(
+            self.dp.dp_id, self.switch.flow_stats())
+
+    def test_reconnect_unchanged(self):
+        self.assertEqual(self.reconnect(), [])
+
+    def test_reconnect_keeps_learned_hosts(self):
+        self.switch.apply(self.learn(1, 40, '0e:00:00:00:01:01'))
+        self.assertEqual(self.reconnect(), [])
+
+    def test_reconnect_keeps_permanent_hosts(self):
+        self.dp.ports[1].permanent_learn = True
+        self.switch.apply(self.learn(1, 40, '0e:00:00:00:01:01'))
+        flows = dict(self.switch.flows)
+        self.assertEqual(self.reconnect(), [])
+        self.assertIn('0e:00:00:00:01:01', self.dp.vlans[40].host_cache)
+        # the antispoof, eth_src and eth_dst flows are still modelled.
+        self.assertEqual(
+            self.valve.flow_table.entries(self.dp.eth_src_table) +
+            self.valve.flow_table.entries(self.dp.eth_dst_table),
+            len([key for key in flows
+                 if key[0] in (self.dp.eth_src_table, self.dp.eth_dst_table)]))
+
+    def test_reconnect_missing_flow(self):
+        missing_key = self.switch.flows.keys()[0]
+        missing_flowmod = self.switch.flows.pop(missing_key)
+        ofmsgs = self.reconnect()
+        self.assertEqual(len(ofmsgs), 1)
+        self.assertEqual(str(ofmsgs[0]), str(missing_flowmod))
+
+    def test_reconnect_unexpected_flow(self):
+        unexpected_flowmod = self.valve.valve_flowdrop(
+            self.dp.eth_dst_table,
+            self.valve.valve_in_match(in_port=99),
+            priority=self.dp.highest_priority)
+        self.switch.apply([unexpected_flowmod])
+        ofmsgs = self.reconnect()
+        self.assertEqual(len(ofmsgs), 1)
+        self.assertEqual(ofmsgs[0].command, ofp.OFPFC_DELETE_STRICT)
+        self.assertEqual(ofmsgs[0].table_id, self.dp.eth_dst_table)
+
+    def test_reconnect_expires_hosts_without_flows(self):
+        # the host's flows time out while the datapath is disconnected.
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.assertEqual(self.reconnect(), [])
+        self.assertEqual(self.dp.vlans[40].host_cache, {})
+
+    def test_reconcile_reply_never_comes(self):
+        now = time.time()
+        self.valve.clock = lambda: now
+        self.valve.datapath_reconnect(self.dp.dp_id, self.dp.ports.keys())
+        self.assertEqual(self.valve.host_expire(), [])
+        self.valve.clock = lambda: now + self.valve.RECONCILE_TIMEOUT
+        # the datapath is configured from scratch instead.
+        ofmsgs = self.valve.host_expire()
+        self.assertTrue(flowmods(ofmsgs, ofp.OFPFC_DELETE))
+        self.assertEqual(self.valve.reconcile_port_nums, None)
+        self.dp.host_refresh_interval = 30
+        self.assertTrue(self.valve.host_usage_request(now + 60))
+
+    def test_disconnect_cancels_reconcile(self):
+        self.valve.datapath_reconnect(self.dp.dp_id, self.dp.ports.keys())
+        self.valve.datapath_disconnect(self.dp.dp_id)
+        self.assertEqual(self.valve.reconcile_port_nums, None)
+        self.assertEqual(self.valve.host_expire(), [])
+
+    def test_cold_connect(self):
+        self.dp.running = False
+        ofmsgs = self.valve.datapath_reconnect(
+            self.dp.dp_id, self.dp.ports.keys())
+        self.assertTrue(flowmods(ofmsgs, ofp.OFPFC_DELETE))
+
+
+class ValveFlowRemovedTestCase(ValveTestCase):
+
+    def test_learn_sends_flow_removed(self):
+        flowmod = self.eth_src_flowmod(self.learn(1, 40, '0e:00:00:00:01:01'))
+        self.assertEqual(flowmod.flags, ofp.OFPFF_SEND_FLOW_REM)
+
+    def test_flow_removed_expires_host(self):
+        flowmod = self.eth_src_flowmod(self.learn(1, 40, '0e:00:00:00:01:01'))
+        # the host was learned when the flow was installed, a timeout ago.
+        host_cache_entry = self.dp.vlans[40].host_cache['0e:00:00:00:01:01']
+        host_cache_entry.cache_time -= flowmod.hard_timeout
+        self.valve.flow_removed(self.dp.dp_id, self.flow_removed(flowmod))
+        self.assertEqual(self.dp.vlans[40].host_cache, {})
+        # the flows are relearned when the host is seen again.
+        ofmsgs = self.learn(1, 40, '0e:00:00:00:01:01')
+        self.assertEqual(len(flowmods(ofmsgs, ofp.OFPFC_ADD)), 2)
+
+    def test_flow_deleted_keeps_host(self):
+        flowmod = self.eth_src_flowmod(self.learn(1, 40, '0e:00:00:00:01:01'))
+        self.valve.flow_removed(self.dp.dp_id, self.flow_removed(
+            flowmod, reason=ofp.OFPRR_DELETE))
+        self.assertIn('0e:00:00:00:01:01', self.dp.vlans[40].host_cache)
+
+    def test_port_delete_expires_hosts(self):
+        flowmod = self.eth_src_flowmod(self.learn(2, 40, '0e:00:00:00:01:01'))
+        self.valve.port_delete(self.dp.dp_id, 2)
+        self.valve.flow_removed(self.dp.dp_id, self.flow_removed(
+            flowmod, reason=ofp.OFPRR_DELETE))
+        self.valve.host_expire()
+        self.assertEqual(self.dp.vlans[40].host_cache, {})
+
+    def test_port_add_keeps_hosts(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        # the port is already configured, and its host's flows are kept.
+        self.assertEqual(flowmods(self.valve.port_add(self.dp.dp_id, 1)), [])
+        self.assertIn('0e:00:00:00:01:01', self.dp.vlans[40].host_cache)
+
+    def test_flow_removed_after_relearn_keeps_host(self):
+        flowmod = self.eth_src_flowmod(self.learn(1, 40, '0e:00:00:00:01:01'))
+        # the removed flow was installed before the host was last learned.
+        self.valve.flow_removed(self.dp.dp_id, self.flow_removed(
+            flowmod, duration_sec=flowmod.hard_timeout + 10))
+        self.assertIn('0e:00:00:00:01:01', self.dp.vlans[40].host_cache)
+
+
+class ValveCapacityTestCase(ValveTestCase):
+
+    def limit_host_tables(self, hosts):
+        """Make room in the host tables for this many more hosts."""
+        for table_id in (self.dp.eth_src_table, self.dp.eth_dst_table):
+            self.dp.table_sizes[table_id] = (
+                self.valve.flow_table.entries(table_id) + hosts)
+
+    def test_table_features_capacity(self):
+        self.assertEqual(self.valve.table_capacity(self.dp.eth_dst_table), None)
+        table_feature = parser.OFPTableFeaturesStats(
+            table_id=self.dp.eth_dst_table, max_entries=1000, properties=[])
+        self.valve.table_features(self.dp.dp_id, [table_feature])
+        self.assertEqual(self.valve.table_capacity(self.dp.eth_dst_table), 1000)
+        self.dp.table_sizes[self.dp.eth_dst_table] = 10
+        self.assertEqual(self.valve.table_capacity(self.dp.eth_dst_table), 10)
+
+    def test_table_features_requested_if_configured(self):
+        table_features_requests = lambda: [
+            ofmsg for ofmsg in self.valve.switch_features(self.dp.dp_id, None)
+            if isinstance(ofmsg, parser.OFPTableFeaturesStatsRequest)]
+        self.assertEqual(table_features_requests(), [])
+        self.dp.request_table_features = True
+        self.assertEqual(len(table_features_requests()), 1)
+
+    def test_evict_relearned_host_last(self):
+        self.limit_host_tables(2)
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.learn(2, 40, '0e:00:00:00:01:02')
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.learn(3, 40, '0e:00:00:00:01:03')
+        host_cache = self.dp.vlans[40].host_cache
+        self.assertIn('0e:00:00:00:01:01', host_cache)
+        self.assertNotIn('0e:00:00:00:01:02', host_cache)
+
+    def test_evict_least_recently_used(self):
+        self.limit_host_tables(2)
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.learn(2, 40, '0e:00:00:00:01:02')
+        ofmsgs = self.learn(3, 40, '0e:00:00:00:01:03')
+        host_cache = self.dp.vlans[40].host_cache
+        self.assertNotIn('0e:00:00:00:01:01', host_cache)
+        self.assertIn('0e:00:00:00:01:03', host_cache)
+        deletes = flowmods(ofmsgs, ofp.OFPFC_DELETE)
+        self.assertEqual(len(deletes), 2)
+        self.assertEqual(deletes[0].match['eth_src'], '0e:00:00:00:01:01')
+
+    def test_evict_least_used(self):
+        self.limit_host_tables(2)
+        ofmsgs = self.learn(1, 40, '0e:00:00:00:01:01')
+        used_flowmod = self.eth_dst_flowmod(ofmsgs)
+        self.learn(2, 40, '0e:00:00:00:01:02')
+        self.assertTrue(self.valve.host_usage_request(time.time()))
+        # the first host has been used since it was learned.
+        self.valve.host_usage(
+            self.dp.dp_id, [flow_stat(used_flowmod, packet_count=10)])
+        self.learn(3, 40, '0e:00:00:00:01:03')
+        host_cache = self.dp.vlans[40].host_cache
+        self.assertIn('0e:00:00:00:01:01', host_cache)
+        self.assertNotIn('0e:00:00:00:01:02', host_cache)
+
+    def test_permanent_hosts_not_evicted(self):
+        self.dp.ports[1].permanent_learn = True
+        self.limit_host_tables(1)
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        ofmsgs = self.learn(2, 40, '0e:00:00:00:01:02')
+        host_cache = self.dp.vlans[40].host_cache
+        self.assertIn('0e:00:00:00:01:01', host_cache)
+        # there's no room for the new host, so it isn't learned.
+        self.assertNotIn('0e:00:00:00:01:02', host_cache)
+        self.assertEqual(flowmods(ofmsgs, ofp.OFPFC_DELETE), [])
+        self.assertEqual(flowmods(ofmsgs, ofp.OFPFC_ADD), [])
+
+
+class ValveHostRefreshTestCase(ValveTestCase):
+
+    def test_learn_jitter(self):
+        self.dp.learn_jitter = 100
+        hard_timeouts = set()
+        for host in range(20):
+            flowmod = self.eth_src_flowmod(
+                self.learn(1, 40, '0e:00:00:00:01:%02x' % host))
+            self.assertTrue(
+                self.dp.timeout - 100 <= flowmod.hard_timeout <= self.dp.timeout)
+            hard_timeouts.add(flowmod.hard_timeout)
+        self.assertTrue(len(hard_timeouts) > 1)
+
+    def refresh(self, flowmod, packet_count, remaining):
+        stat = flow_stat(flowmod, packet_count=packet_count)
+        stat.duration_sec = flowmod.hard_timeout - remaining
+        return self.valve.host_usage(self.dp.dp_id, [stat])
+
+    def test_refresh_active_host(self):
+        self.dp.host_refresh_interval = 30
+        flowmod = self.eth_src_flowmod(self.learn(1, 40, '0e:00:00:00:01:01'))
+        requests = self.valve.host_usage_request(time.time())
+        self.assertEqual(len(requests), 1)
+        cookie, cookie_mask = owner_cookie(self.dp.cookie, OWNER_HOST)
+        self.assertEqual(requests[0].cookie_mask, cookie_mask)
+        # not about to expire.
+        self.assertEqual(self.refresh(flowmod, 10, 100), [])
+        # about to expire, but no packets since the last flow stats.
+        self.assertEqual(self.refresh(flowmod, 10, 30), [])
+        ofmsgs = self.refresh(flowmod, 20, 30)
+        self.assertEqual(flowmods(ofmsgs, ofp.OFPFC_DELETE), [])
+        refreshed_flowmod = self.eth_src_flowmod(ofmsgs)
+        self.assertEqual(str(refreshed_flowmod.match), str(flowmod.match))
+
+    def test_no_refresh_by_default(self):
+        flowmod = self.eth_src_flowmod(self.learn(1, 40, '0e:00:00:00:01:01'))
+        self.assertEqual(self.valve.host_usage_request(time.time()), [])
+        self.assertEqual(self.refresh(flowmod, 10, 1), [])
+
+
+class ValveResolveGatewaysTestCase(ValveTestCase):
+
+    def test_one_packet_out_per_tag_class(self):
+        vlan = self.dp.vlans[40]
+        vlan.controller_ips = [ipaddr.IPNetwork('10.0.0.254/24')]
+        vlan.ipv4_routes = {
+            ipaddr.IPNetwork('10.1.0.0/24'): ipaddr.IPAddress('10.0.0.1')}
+        packet_outs = [
+            ofmsg for ofmsg in self.valve.resolve_gateways()
+            if isinstance(ofmsg, parser.OFPPacketOut)]
+        # one for the untagged ports and one for the tagged port.
+        self.assertEqual(len(packet_outs), 2)
+        out_ports = [
+            sorted([action.port for action in packet_out.actions])
+            for packet_out in packet_outs]
+        self.assertEqual(out_ports, [[2, 3], [1]])
+
+
+class ValvePacketInTestCase(ValveTestCase):
+
+    def test_learn_flow_max_len(self):
+        self.dp.packet_in_max_len = 64
+        learn_flowmods = self.valve.add_controller_learn_flow()
+        self.assertEqual(len(learn_flowmods), 1)
+        output = learn_flowmods[0].instructions[0].actions[0]
+        self.assertEqual(output.port, ofp.OFPP_CONTROLLER)
+        self.assertEqual(output.max_len, 64)
+
+    def test_miss_send_len(self):
+        ofmsgs = self.valve.switch_features(self.dp.dp_id, None)
+        self.assertFalse([
+            ofmsg for ofmsg in ofmsgs if isinstance(ofmsg, parser.OFPSetConfig)])
+        self.dp.miss_send_len = 64
+        ofmsgs = self.valve.switch_features(self.dp.dp_id, None)
+        self.assertEqual(ofmsgs[0].miss_send_len, 64)
+
+
+class ValvePacketInCookieTestCase(ValveTestCase):
+
+    def setUp(self):
+        super(ValvePacketInCookieTestCase, self).setUp()
+        self.dp.vlans[40].controller_ips = [ipaddr.IPNetwork('192.0.2.2/24')]
+        self.data = tagged_arp_packet('0e:00:00:00:01:01', 40).data
+
+    def packet_in(self, owner):
+        cookie = self.valve.valve_cookie(owner, 40)
+        pkt = self.valve.parse_packet_in(self.data, cookie)
+        return pkt, self.valve.rcv_packet(self.dp.dp_id, 1, 40, pkt, cookie)
+
+    def packet_outs(self, ofmsgs):
+        return [
+            ofmsg for ofmsg in ofmsgs if isinstance(ofmsg, parser.OFPPacketOut)]
+
+    def test_learn_parses_headers_only(self):
+        pkt, ofmsgs = self.packet_in(OWNER_LEARN)
+        self.assertEqual(pkt.get_protocol(arp.arp), None)
+        self.assertEqual(self.packet_outs(ofmsgs), [])
+        self.assertIn('0e:00:00:00:01:01', self.dp.vlans[40].host_cache)
+
+    def test_controller_arp(self):
+        pkt, ofmsgs = self.packet_in(OWNER_CONTROLLER_ARP)
+        self.assertEqual(len(self.packet_outs(ofmsgs)), 1)
+        self.assertIn('0e:00:00:00:01:01', self.dp.vlans[40].host_cache)
+
+    def test_no_cookie(self):
+        pkt = self.valve.parse_packet_in(self.data)
+        ofmsgs = self.valve.rcv_packet(self.dp.dp_id, 1, 40, pkt)
+        self.assertEqual(len(self.packet_outs(ofmsgs)), 1)
+
+
+class ValveMetricsTestCase(ValveTestCase):
+
+    def setUp(self):
+        super(ValveMetricsTestCase, self).setUp()
+        self.metrics = FaucetMetrics()
+        vlan = self.dp.vlans[40]
+        vlan.ipv4_routes = {
+            ipaddr.IPNetwork('10.1.0.0/24'): ipaddr.IPAddress('10.0.0.1'),
+            ipaddr.IPNetwork('10.2.0.0/24'): ipaddr.IPAddress('10.0.0.2')}
+        vlan.arp_cache[ipaddr.IPAddress('10.0.0.1')] = LinkNeighbor(
+            '0e:00:00:00:02:01', time.time())
+
+    def samples(self):
+        samples = {}
+        for line in self.metrics.render(self.valve).splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = value
+        return samples
+
+    def test_packet_ins_and_flowmods(self):
+        self.metrics.packet_in(self.valve.packet_in_owner(
+            self.valve.valve_cookie(OWNER_LEARN)))
+        self.metrics.packet_in(None)
+        self.metrics.sent(self.learn(2, 40, '0e:00:00:00:01:01'))
+        samples = self.samples()
+        self.assertEqual(samples[
+            'faucet_packet_ins_total{dp_id="0xcafef00d",type="learn"}'], '1')
+        self.assertEqual(samples[
+            'faucet_packet_ins_total{dp_id="0xcafef00d",type="unknown"}'], '1')
+        self.assertEqual(samples[
+            'faucet_vlan_hosts_learned{dp_id="0xcafef00d",vlan="40"}'], '1')
+        self.assertIn(
+            'faucet_flowmods_sent_total{dp_id="0xcafef00d",table_id="%u",'
+            'command="add"}' % self.dp.eth_dst_table, samples)
+
+    def test_gateways(self):
+        samples = self.samples()
+        labels = 'dp_id="0xcafef00d",vlan="40",ipv="4"'
+        self.assertEqual(samples[
+            'faucet_vlan_route_gateways{%s,state="resolved"}' % labels], '1')
+        self.assertEqual(samples[
+            'faucet_vlan_route_gateways{%s,state="unresolved"}' % labels],
+            '1')
+        self.assertEqual(samples['faucet_vlan_neighbors{%s}' % labels], '1')
+
+    def test_max_hosts_bans(self):
+        self.dp.vlans[40].max_hosts = 1
+        self.learn(2, 40, '0e:00:00:00:01:01')
+        self.learn(2, 40, '0e:00:00:00:01:02')
+        self.assertEqual(self.samples()[
+            'faucet_vlan_max_hosts_bans_total{dp_id="0xcafef00d",vlan="40"}'],
+            '1')
+
+
+class ValveFakeDatapathTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dp = DP.parser('config/testconfig.yaml')
+        self.dp.vlans[40].controller_ips = [ipaddr.IPNetwork('10.0.0.254/24')]
+        self.valve = valve_factory(self.dp)
+        self.datapath = FakeDatapath(self.dp.dp_id, self.dp.ports.keys())
+        self.driver = ValveDriver(self.valve, self.datapath)
+        self.driver.connect()
+
+    def send(self, in_port, eth_src, eth_dst):
+        outputs = self.driver.receive(
+            in_port, unicast_packet(eth_src, eth_dst))
+        return sorted([(port_num, pkt.vid()) for port_num, pkt in outputs])
+
+    def test_learn_then_unicast(self):
+        # unknown destination, flooded to VLAN 40 (tagged on port 1).
+        self.assertEqual(
+            self.send(2, '0e:00:00:00:01:01', '0e:00:00:00:01:02'),
+            [(1, 40), (3, None)])
+        self.assertEqual(self.driver.received['OFPPacketIn'], 1)
+        self.assertEqual(
+            self.send(3, '0e:00:00:00:01:02', '0e:00:00:00:01:01'),
+            [(2, None)])
+        self.assertEqual(
+            self.send(2, '0e:00:00:00:01:01', '0e:00:00:00:01:02'),
+            [(3, None)])
+        self.assertEqual(self.driver.received['OFPPacketIn'], 2)
+
+    def test_port_down_floods(self):
+        self.send(2, '0e:00:00:00:01:01', '0e:00:00:00:01:02')
+        self.send(3, '0e:00:00:00:01:02', '0e:00:00:00:01:01')
+        self.driver.port_status_change(3, False)
+        self.assertEqual(
+            self.send(2, '0e:00:00:00:01:01', '0e:00:00:00:01:02'),
+            [(1, 40)])
+
+    def test_timeout(self):
+        self.send(2, '0e:00:00:00:01:01', '0e:00:00:00:01:02')
+        flows = self.datapath.flow_count()
+        self.datapath.expire(time.time() + self.dp.timeout + 1)
+        self.assertEqual(self.datapath.flow_count(), flows - 2)
+        self.assertEqual(
+            [msg.table_id for msg in self.datapath.msgs],
+            [self.dp.eth_src_table, self.dp.eth_dst_table])
+
+    def test_controller_arp(self):
+        outputs = self.driver.receive(1, arp_request(
+            '0e:00:00:00:01:01', '10.0.0.1', '10.0.0.254', vid=40))
+        self.assertEqual(outputs, [])
+        self.assertEqual(self.driver.received['OFPPacketIn'], 1)
+        self.assertEqual(self.driver.sent['OFPPacketOut'], 1)
+
+
+class ArubaValveTestCase(unittest.TestCase):
+
+    def serialized(self, msg):
+        msg.datapath = ProtocolDesc(ofp.OFP_VERSION)
+        msg.xid = 1
+        msg.serialize()
+        return msg.buf
+
+    def test_compiled_pipeline(self):
+        dp = DP.parser('config/testconfig.yaml')
+        dp.hardware = 'Aruba'
+        valve = valve_factory(dp)
+        ryu_table_loader = aruba.LoadRyuTables()
+        ryu_table_loader.load_tables(
+            os.path.join(aruba.CFG_PATH, 'aruba_pipeline.json'), parser)
+        expected = parser.OFPTableFeaturesStatsRequest(
+            None, body=ryu_table_loader.ryu_tables)
+        for _ in range(2):
+            ofmsgs = valve.switch_features(dp.dp_id, None)
+            self.assertEqual(
+                self.serialized(ofmsgs[0]), self.serialized(expected))
+
+
+class ValveJournalReplayTestCase(ValveTestCase):
+
+    def setUp(self):
+        super(ValveJournalReplayTestCase, self).setUp()
+        self.replayer = ValveJournalReplay()
+        self.start = 1000000.0
+        with open('config/testconfig.yaml') as config:
+            self.replay(CONFIG, config.read())
+        self.replay(CONNECT, DP_ID.pack(self.dp.dp_id) + ''.join(
+            [PORT.pack(port_num) for port_num in self.dp.ports]))
+
+    def replay(self, record_type, payload, offset=0):
+        return self.replayer.replay_record(
+            record_type, payload, self.start + offset)
+
+    def test_flow_removed_at_record_time(self):
+        data = tagged_arp_packet('0e:00:00:00:01:01', 40).data
+        flowmod = self.eth_src_flowmod(self.replay(
+            PACKET_IN, PACKET_IN_HEADER.pack(
+                self.dp.dp_id, 1, 40, 0) + data, 1))
+        host_cache = self.replayer.valve.dp.vlans[40].host_cache
+        self.assertIn('0e:00:00:00:01:01', host_cache)
+        # removed a timeout after it was learned, however fast the replay.
+        self.replay(
+            FLOW_REMOVED, DP_ID.pack(self.dp.dp_id) + flow_removed_data(
+                self.flow_removed(flowmod)), 1 + flowmod.hard_timeout)
+        self.assertEqual(host_cache, {})
+
+    def test_reconnect_reconciles_stats_reply(self):
+        valve = self.replayer.valve
+        switch = FakeSwitch()
+        switch.apply(self.connect_ofmsgs)
+        self.replay(CONNECT, DP_ID.pack(self.dp.dp_id) + ''.join(
+            [PORT.pack(port_num) for port_num in self.dp.ports]), 10)
+        self.assertNotEqual(valve.reconcile_port_nums, None)
+        flow_stats = switch.flow_stats()
+        datapath = ProtocolDesc(ofp.OFP_VERSION)
+        for body, flags in (
+                (flow_stats[:5], ofp.OFPMPF_REPLY_MORE), (flow_stats[5:], 0)):
+            msg = parser.OFPFlowStatsReply(datapath)
+            msg.body = body
+            msg.flags = flags
+            self.assertEqual(
+                self.replayer.stats_reply(self.dp.dp_id, msg), [])
+        self.assertEqual(valve.reconcile_port_nums, None)
+
+    def test_journal_round_trip(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            journal_file = os.path.join(tmpdir, 'faucet.journal')
+            journal = ValveJournal(journal_file)
+            journal.connect(self.dp.dp_id, [1, 2])
+            journal.packet_in(self.dp.dp_id, 1, 40, 'data', 0x1234)
+            journal.close()
+            records = list(read_journal(journal_file))
+            self.assertEqual(
+                [(record_type, payload)
+                 for record_type, _, payload in records],
+                [(CONNECT, DP_ID.pack(self.dp.dp_id) + PORT.pack(1) +
+                  PORT.pack(2)),
+                 (PACKET_IN, PACKET_IN_HEADER.pack(
+                     self.dp.dp_id, 1, 40, 0x1234) + 'data')])
+            # journals from before packet-ins had cookies are rejected.
+            with open(journal_file, 'wb') as old_journal:
+                old_journal.write('FAUCETJ1')
+            self.assertRaises(ValueError, list, read_journal(journal_file))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class ValveSnapshotTestCase(ValveTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.snapshot_file = os.path.join(self.tmpdir, 'faucet.snapshot')
+        super(ValveSnapshotTestCase, self).setUp()
+        self.dp.snapshot_file = self.snapshot_file
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def restart(self):
+        """Return the connect ofmsgs of a new Valve using the snapshot."""
+        self.dp = DP.parser('config/testconfig.yaml')
+        self.dp.snapshot_file = self.snapshot_file
+        self.valve = valve_factory(self.dp)
+        return self.valve.datapath_connect(
+            self.dp.dp_id, self.dp.ports.keys())
+
+    def write_snapshot(self):
+        """Write a snapshot, and wait for the writer thread to finish."""
+        self.valve.write_snapshot()
+        self.valve.snapshot_writer.flush()
+
+    def test_snapshot_round_trip(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        ip_gw = ipaddr.IPAddress('fc00::1:1')
+        self.dp.vlans[41].nd_cache[ip_gw] = LinkNeighbor(
+            '0e:00:00:00:02:02', 1234.5)
+        self.write_snapshot()
+        hosts, neighbors = read_snapshot(self.snapshot_file)
+        self.assertEqual(len(hosts), 1)
+        vid, eth_src, port_num, permanent, _ = hosts[0]
+        self.assertEqual(
+            (vid, eth_src, port_num, permanent),
+            (40, '0e:00:00:00:01:01', 1, False))
+        self.assertEqual(
+            neighbors, [(41, ip_gw, '0e:00:00:00:02:02', 1234.5)])
+
+    def test_restore_learned_host(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.write_snapshot()
+        ofmsgs = self.restart()
+        self.assertIn('0e:00:00:00:01:01', self.dp.vlans[40].host_cache)
+        eth_src_flows = [
+            flowmod for flowmod in flowmods(ofmsgs, ofp.OFPFC_ADD)
+            if flowmod.table_id == self.dp.eth_src_table and
+            flowmod.hard_timeout]
+        self.assertEqual(len(eth_src_flows), 1)
+        self.assertTrue(eth_src_flows[0].hard_timeout <= self.dp.timeout)
+
+    def test_expired_host_not_restored(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        host_cache_entry = self.dp.vlans[40].host_cache['0e:00:00:00:01:01']
+        host_cache_entry.cache_time = time.time() - self.dp.timeout - 1
+        self.write_snapshot()
+        self.restart()
+        self.assertEqual(self.dp.vlans[40].host_cache, {})
+
+    def test_restored_only_on_first_connect(self):
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.write_snapshot()
+        flowmod = [
+            flowmod for flowmod in flowmods(self.restart(), ofp.OFPFC_ADD)
+            if flowmod.table_id == self.dp.eth_src_table and
+            flowmod.hard_timeout][0]
+        expire_time = time.time() + flowmod.hard_timeout
+        self.valve.clock = lambda: expire_time
+        self.valve.flow_removed(self.dp.dp_id, self.flow_removed(flowmod))
+        self.valve.clock = time.time
+        self.assertEqual(self.dp.vlans[40].host_cache, {})
+        # the expired host is still in the snapshot, but isn't restored.
+        self.dp = DP.parser('config/testconfig.yaml')
+        self.dp.snapshot_file = self.snapshot_file
+        self.valve.reload_config(self.dp)
+        self.assertEqual(self.dp.vlans[40].host_cache, {})
+
+    def test_unwritable_snapshot_ignored(self):
+        self.dp.snapshot_file = os.path.join(
+            self.tmpdir, 'missing', 'faucet.snapshot')
+        self.learn(1, 40, '0e:00:00:00:01:01')
+        self.write_snapshot()
+        self.assertFalse(os.path.exists(self.dp.snapshot_file))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_corrupt_snapshot_ignored(self):
+        with open(self.snapshot_file, 'wb') as snapshot:
+            snapshot.write('garbage')
+        self.restart()
+        self.assertEqual(self.dp.vlans[40].host_cache, {})
+
+
+if __name__ == "__main__":
+    unittest.main()